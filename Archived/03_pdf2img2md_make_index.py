@@ -6,25 +6,128 @@
 python 03_pdf2img2md_make_index.py [pdf_folder] [--resume resume_dir]
 
 '''
+import hashlib
+import io
+import itertools
 import json
 import os
 import sys
 import shutil
+import tempfile
 import glob
 import csv
+import functools
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import argparse
+import contextlib
+import random
+import re
+import threading
 import time  # 添加在文件开头的导入部分
 
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from tqdm import tqdm
 from dotenv import load_dotenv
 import google.generativeai as genai
 from google.cloud import vision
+from google.api_core.exceptions import ResourceExhausted
 from PIL import Image
-from natsort import natsorted
 from autogen import ConversableAgent, LLMConfig, initiate_swarm_chat, AfterWorkOption
+from ocr_cache import get_cache
+
+# 缓存键的版本号，修改API、模型或提示词时需要同步修改，使旧的缓存失效
+VISION_CACHE_NAMESPACE = "vision-v1-document_text_detection"
+FORMAT_PROMPT_VERSION = "v1"
+TRANSLATE_PROMPT_VERSION = "v1"
+ANALYZE_PROMPT_VERSION = "v1"
+
+# 模型返回的内容不是纯JSON时，用于从中提取JSON部分
+JSON_PATTERN = re.compile(r'\{.*\}', re.DOTALL)
+
+# 文件名中需要替换的字符，以及替换后仍需删除的字符（\w与str.isalnum()一致，包含日文等Unicode字符）
+FILENAME_REPLACE_TABLE = str.maketrans({'/': '-', ' ': '_'})
+FILENAME_INVALID_PATTERN = re.compile(r'[^\w-]')
+
+# 每个大学文件夹中保存招生信息分析结果的文件名
+ADMISSION_INFO_FILE_NAME = "admission_info.json"
+# 记录PDF转换状态的文件名
+STATE_FILE_NAME = "state.json"
+# review时记录每页图像哈希和markdown的清单文件名
+PAGE_MANIFEST_FILE_NAME = "pages.json"
+# 分段翻译时每段的最大字符数，以及同时翻译的最大段数
+TRANSLATE_CHUNK_SIZE = 8000
+TRANSLATE_MAX_WORKERS = 6
+# 并发分析招生信息的最大文件夹数
+ANALYZE_MAX_WORKERS = 8
+
+# batch_annotate_images一次最多接受16张图像
+VISION_BATCH_SIZE = 16
+# 同时进行Gemini格式化的最大页数
+FORMAT_MAX_WORKERS = 8
+# 各API每分钟的默认请求数上限，可通过环境变量 VISION_RPM / GEMINI_RPM 覆盖
+# Vision的配额为1800次/分钟，留出余量
+DEFAULT_RPM = {"VISION": 1500, "GEMINI": 60}
+# 发送给Gemini的参考图像的最大边长和JPEG质量
+REFERENCE_IMAGE_MAX_SIZE = 1024
+REFERENCE_IMAGE_QUALITY = 75
+
+
+class ThreadLocalStdout:
+    """按线程重定向的stdout，使并发的agent对话输出各自写入自己的日志文件"""
+
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    @property
+    def target(self):
+        return getattr(self._local, 'target', None) or self._default
+
+    def write(self, text):
+        return self.target.write(text)
+
+    def flush(self):
+        return self.target.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+    @contextlib.contextmanager
+    def redirect(self, stream):
+        """将当前线程的stdout重定向到stream"""
+        self._local.target = stream
+        try:
+            yield stream
+        finally:
+            self._local.target = None
+
+
+_thread_stdout = None
+_thread_stdout_lock = threading.Lock()
+_agent_log_counter = itertools.count()
+
+
+@contextlib.contextmanager
+def redirect_agent_stdout(prefix):
+    """将当前线程中agent对话的输出重定向到 {prefix}_{时间}_{序号}.stdout.log"""
+    global _thread_stdout
+    with _thread_stdout_lock:
+        if _thread_stdout is None:
+            _thread_stdout = ThreadLocalStdout(sys.stdout)
+            sys.stdout = _thread_stdout
+
+    # 用当前的日期时间和序号来命名重定向，避免并发时写入同一个文件
+    output_file = f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{next(_agent_log_counter)}.stdout.log"
+    with open(output_file, 'w', encoding='utf-8') as f:
+        with _thread_stdout.redirect(f):
+            yield f
+
+
+@functools.lru_cache(maxsize=None)
+def load_llm_config_file(llm_config_path):
+    """读取并解析LLM配置文件，同一路径只解析一次（where()返回新的对象，不会修改缓存的配置）"""
+    return LLMConfig.from_json(path=llm_config_path)
 
 
 class ServiceConfig:
@@ -44,10 +147,32 @@ class ServiceConfig:
         self.llm_config = self.load_config("MINI")
         self.llm_config_mini = self.load_config("LOW_COST")
 
+        # llm_config实际使用的模型名，作为缓存键的一部分，在llm_config.json中更换模型后旧的缓存自动失效
+        self.llm_model_name = ','.join(entry['model'] if isinstance(entry, dict) else entry.model for entry in self.llm_config.config_list)
+
     def load_config(self, model_tag: str = "STD") -> LLMConfig:
         """从配置文件加载LLM配置"""
         filter_dict = {"tags": [model_tag]}
-        return LLMConfig.from_json(path=self.llm_config_path).where(**filter_dict)
+        return load_llm_config_file(self.llm_config_path).where(**filter_dict)
+
+
+@functools.lru_cache(maxsize=1)
+def get_service_config():
+    """获取共享的ServiceConfig，只加载一次LLM配置文件"""
+    return ServiceConfig()
+
+
+@functools.lru_cache(maxsize=1)
+def get_vision_client():
+    """获取共享的Vision客户端，复用gRPC连接"""
+    return vision.ImageAnnotatorClient()
+
+
+@functools.lru_cache(maxsize=None)
+def get_gemini_model(model_name):
+    """获取共享的Gemini模型实例，每个模型只创建一次"""
+    genai.configure()
+    return genai.GenerativeModel(model_name)
 
 
 def set_google_cloud_api_key_json():
@@ -70,46 +195,45 @@ def set_google_cloud_api_key_json():
     sys.exit(1)
 
 
-def convert_pdf_to_images(pdf_file, dpi):
-    """Convert PDF file to list of images"""
-    images = convert_from_path(pdf_file, dpi=dpi)
-    return images
+def convert_pdf_to_images(pdf_file, dpi, output_folder):
+    """Convert PDF file to scan_{i}.png files in output_folder
 
+    由poppler多线程直接将页面写入磁盘，不在内存中保留所有页面的图像
 
-def save_images_with_progress(images, output_folder):
-    """Save images with multi-threading and progress bars"""
-    total_pages = len(images)
-    print(f'Total pages: {total_pages}')
-
-    max_workers = max(1, os.cpu_count() - 1)
-    print(f'Using {max_workers} threads for conversion')
-
-    chunk_size = (total_pages + max_workers - 1) // max_workers
-    chunks = [images[i:i + chunk_size] for i in range(0, total_pages, chunk_size)]
-
-    progress_bars = [tqdm(total=len(chunk), desc=f'Thread {i+1}', position=i, ncols=80) for i, chunk in enumerate(chunks)]
-
-    def save_chunk(chunk_images, start_idx, progress_bar):
-        for j, image in enumerate(chunk_images):
-            image.save(os.path.join(output_folder, f'scan_{start_idx + j}.png'), 'PNG')
-            progress_bar.update(1)
-
-    try:
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = []
-            for i, chunk in enumerate(chunks):
-                futures.append(executor.submit(save_chunk, chunk, i * chunk_size, progress_bars[i]))
-
-            for future in as_completed(futures):
-                future.result()
-    finally:
-        for progress_bar in progress_bars:
-            progress_bar.close()
+    Returns:
+        int: 转换的页数
+    """
+    total_pages = pdfinfo_from_path(pdf_file)["Pages"]
+    thread_count = max(1, os.cpu_count() - 1)
+    print(f'Using {thread_count} poppler threads for conversion')
+
+    with tempfile.TemporaryDirectory(dir=output_folder) as temp_folder:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(convert_from_path,
+                                     pdf_file,
+                                     dpi=dpi,
+                                     output_folder=temp_folder,
+                                     fmt='png',
+                                     output_file='scan',
+                                     paths_only=True,
+                                     thread_count=thread_count)
+            # 通过统计已写出的文件数显示进度
+            with tqdm(total=total_pages, ncols=80) as progress_bar:
+                while not future.done():
+                    progress_bar.update(len(os.listdir(temp_folder)) - progress_bar.n)
+                    time.sleep(0.5)
+                progress_bar.update(total_pages - progress_bar.n)
+            image_paths = future.result()
+
+        for i, image_path in enumerate(image_paths):
+            os.replace(image_path, os.path.join(output_folder, f'scan_{i}.png'))
+    print(f'Total pages: {len(image_paths)}')
+    return len(image_paths)
 
 
 def ocr_by_google_cloud(image_path):
     """Perform OCR using Google Cloud Vision API"""
-    client = vision.ImageAnnotatorClient()
+    client = get_vision_client()
     print("OCR by Google Vision")
 
     try:
@@ -119,23 +243,141 @@ def ocr_by_google_cloud(image_path):
         print(f"Error reading image file: {e}")
         return None
 
+    cache_key = get_cache().make_key(VISION_CACHE_NAMESPACE, content)
+    cached_text = get_cache().get(cache_key)
+    if cached_text is not None:
+        print(f"Using cached OCR result for {image_path}")
+        return cached_text
+
     try:
         image = vision.Image(content=content)
         # pylint: disable=no-member
-        response = client.document_text_detection(image=image)
-        time.sleep(10)  # OCR 后暂停10秒
+        response = call_with_backoff(lambda: client.document_text_detection(image=image))
         if response.error.message:
             raise Exception(f'Google Cloud API Error: {response.error.message}')
+        get_cache().put(cache_key, response.full_text_annotation.text)
         return response.full_text_annotation.text
     except Exception as e:
         print(f"Error during OCR: {e}")
         raise e
 
 
+class RateLimiter:
+    """线程安全的令牌桶限流器，只在请求速率超过上限时才等待"""
+
+    def __init__(self, calls, period=60):
+        self.capacity = calls
+        self.tokens = calls
+        self.rate = calls / period
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """取得一个令牌，令牌不足时等待"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_name):
+    """获取指定API的限流器，首次使用时根据环境变量创建"""
+    with _rate_limiters_lock:
+        if api_name not in _rate_limiters:
+            rpm = int(os.getenv(f"{api_name}_RPM", str(DEFAULT_RPM[api_name])))
+            _rate_limiters[api_name] = RateLimiter(rpm, 60)
+        return _rate_limiters[api_name]
+
+
+def call_with_backoff(func, api_name="VISION", max_attempts=5, base_delay=5):
+    """调用Google Cloud API，调用前先经过限流器，遇到配额限制（ResourceExhausted）时指数退避后重试"""
+    limiter = get_rate_limiter(api_name)
+    for attempt in range(max_attempts):
+        limiter.acquire()
+        try:
+            return func()
+        except ResourceExhausted as e:
+            if attempt == max_attempts - 1:
+                raise
+            delay = base_delay * 2**attempt + random.uniform(0, base_delay)
+            print(f"Google Cloud quota exceeded: {e}, retry in {delay:.1f}s...")
+            time.sleep(delay)
+
+
+def ocr_batch(image_paths):
+    """Perform OCR on multiple images using Google Cloud Vision batch_annotate_images
+
+    已缓存的图像直接使用缓存，其余的每16张合并为一次请求
+
+    Returns:
+        list: 与image_paths顺序一致的OCR文本
+    """
+    results = [None] * len(image_paths)
+    pending = []
+    for i, image_path in enumerate(image_paths):
+        with open(image_path, 'rb') as image_file:
+            content = image_file.read()
+        cache_key = get_cache().make_key(VISION_CACHE_NAMESPACE, content)
+        cached_text = get_cache().get(cache_key)
+        if cached_text is not None:
+            results[i] = cached_text
+        else:
+            pending.append((i, content, cache_key))
+
+    if not pending:
+        return results
+
+    client = get_vision_client()
+    for start in range(0, len(pending), VISION_BATCH_SIZE):
+        batch = pending[start:start + VISION_BATCH_SIZE]
+        print(f"OCR by Google Vision: {len(batch)} images in one request")
+        # pylint: disable=no-member
+        requests = [
+            vision.AnnotateImageRequest(image=vision.Image(content=content), features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)])
+            for _, content, _ in batch
+        ]
+        response = call_with_backoff(lambda requests=requests: client.batch_annotate_images(requests=requests))
+
+        for (i, _, cache_key), image_response in zip(batch, response.responses):
+            if image_response.error.message:
+                raise Exception(f'Google Cloud API Error: {image_response.error.message}')
+            results[i] = image_response.full_text_annotation.text
+            get_cache().put(cache_key, results[i])
+
+    return results
+
+
+def encode_reference_image(image_path):
+    """将页面图像缩小并编码为JPEG，仅作为Gemini排版参考（文字内容来自Vision OCR）"""
+    with Image.open(image_path) as img:
+        img = img.convert('RGB')
+        img.thumbnail((REFERENCE_IMAGE_MAX_SIZE, REFERENCE_IMAGE_MAX_SIZE), Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, 'JPEG', quality=REFERENCE_IMAGE_QUALITY)
+    return buffer.getvalue()
+
+
 def format_to_markdown_ref_image(text_content, image_path):
     """Format OCR text to markdown using Gemini"""
-    genai.configure()
-    model = genai.GenerativeModel(os.getenv('GEMINI_MODEL_FOR_FORMAT_MD', 'gemini-1.5-flash'))
+    model_name = os.getenv('GEMINI_MODEL_FOR_FORMAT_MD', 'gemini-1.5-flash')
+    with open(image_path, 'rb') as image_file:
+        cache_key = get_cache().make_key(f"format-{model_name}-{FORMAT_PROMPT_VERSION}", image_file.read(), text_content or "")
+    cached_markdown = get_cache().get(cache_key)
+    if cached_markdown is not None:
+        print(f"Using cached markdown for {image_path}")
+        return cached_markdown
+
+    model = get_gemini_model(model_name)
     print(f"Format OCR text to markdown by: {os.getenv('GEMINI_MODEL_FOR_FORMAT_MD', 'gemini-1.5-flash')}")
 
     try:
@@ -158,20 +400,90 @@ def format_to_markdown_ref_image(text_content, image_path):
 6. 如果遇到空白页（或整页都是没有意义的内容），请返回：EMPTY_PAGE
 """
 
-        img = Image.open(image_path)
-        contents = [prompt, img]
+        contents = [prompt, {'mime_type': 'image/jpeg', 'data': encode_reference_image(image_path)}]
 
-        response = model.generate_content(contents)
-        return response.text.replace('```markdown\n', '').replace('```', '\n')
+        response = call_with_backoff(lambda: model.generate_content(contents), api_name="GEMINI")
+        markdown = response.text.replace('```markdown\n', '').replace('```', '\n')
+        get_cache().put(cache_key, markdown)
+        return markdown
     except Exception as e:
         print(f"Error formatting to markdown: {e}")
         return None
 
 
+def _process_page(img, text_content, output_folder=None):
+    """将单个页面的OCR结果格式化为markdown，指定output_folder时保存为单页md，返回markdown内容"""
+    img_name = os.path.basename(img)
+    md_file = os.path.join(output_folder, f"{os.path.splitext(img_name)[0]}.md") if output_folder else None
+    print(f'Processing {img_name}...')
+    try:
+        markdown_output = format_to_markdown_ref_image(text_content, img)
+
+        if markdown_output and md_file:
+            # 保存单个页面的markdown
+            with open(md_file, 'w', encoding='utf-8') as f:
+                f.write(markdown_output)
+        return markdown_output
+    except Exception as e:
+        print(f"Error processing {img}: {e}")
+        if md_file and os.path.exists(md_file):
+            os.remove(md_file)
+        raise e
+
+
+def process_pages(image_files, output_folder=None):
+    """并发格式化多个页面，返回 {img: markdown} 字典（格式化失败的页面不包含在内）"""
+    text_contents = ocr_batch(image_files)
+    page_contents = {}
+    with ThreadPoolExecutor(max_workers=min(FORMAT_MAX_WORKERS, len(image_files))) as executor:
+        futures = {
+            executor.submit(_process_page, img, text_content, output_folder): img
+            for img, text_content in zip(image_files, text_contents)
+        }
+        for future in as_completed(futures):
+            markdown_output = future.result()
+            if markdown_output:
+                page_contents[futures[future]] = markdown_output
+    return page_contents
+
+
+def split_markdown(md_content: str, chunk_size: int) -> list:
+    """按空行将markdown切分为不超过chunk_size个字符的段（单个段落过长时单独成段）"""
+    chunks = []
+    current = []
+    current_len = 0
+    for paragraph in md_content.split('\n\n'):
+        if current and current_len + len(paragraph) + 2 > chunk_size:
+            chunks.append('\n\n'.join(current))
+            current = []
+            current_len = 0
+        current.append(paragraph)
+        current_len += len(paragraph) + 2
+    chunks.append('\n\n'.join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
 def translate_markdown(md_content: str) -> str:
-    """使用 autogen agent 翻译 markdown 内容"""
+    """使用 autogen agent 翻译 markdown 内容，长文档分段并发翻译"""
+    chunks = split_markdown(md_content, TRANSLATE_CHUNK_SIZE)
+    if len(chunks) <= 1:
+        return translate_chunk(md_content)
+
+    print(f"文档较长，分为 {len(chunks)} 段并发翻译")
+    with ThreadPoolExecutor(max_workers=min(TRANSLATE_MAX_WORKERS, len(chunks))) as executor:
+        return '\n\n'.join(executor.map(translate_chunk, chunks))
+
+
+def translate_chunk(md_content: str) -> str:
+    """使用 autogen agent 翻译一段 markdown 内容"""
+
+    config = get_service_config()
 
-    config = ServiceConfig()
+    cache_key = get_cache().make_key(f"translate-{config.llm_model_name}-{TRANSLATE_PROMPT_VERSION}", md_content)
+    cached_translation = get_cache().get(cache_key)
+    if cached_translation is not None:
+        print("Using cached translation")
+        return cached_translation
 
     # 配置翻译 agent
     translator_agent = ConversableAgent(
@@ -201,32 +513,30 @@ def translate_markdown(md_content: str) -> str:
 
 请直接返回翻译结果。"""
 
-    # 用当前的日期时间来命名重定向
-    output_file = f"translate_{datetime.now().strftime('%Y%m%d_%H%M%S')}.stdout.log"
-    # 保存原始的stdout
-    old_stdout = sys.stdout
-
     # 执行翻译
-    try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            sys.stdout = f
-            chat_result, _, _ = initiate_swarm_chat(initial_agent=translator_agent,
-                                                    agents=[translator_agent],
-                                                    messages=translate_prompt,
-                                                    after_work=AfterWorkOption.TERMINATE,
-                                                    max_rounds=2)
+    with redirect_agent_stdout("translate"):
+        chat_result, _, _ = initiate_swarm_chat(initial_agent=translator_agent,
+                                                agents=[translator_agent],
+                                                messages=translate_prompt,
+                                                after_work=AfterWorkOption.TERMINATE,
+                                                max_rounds=2)
 
-            # 获取翻译结果
-            return chat_result.chat_history[-1]["content"]
-    finally:
-        # 恢复原始的stdout
-        sys.stdout = old_stdout
+    # 获取翻译结果
+    translation = chat_result.chat_history[-1]["content"]
+    get_cache().put(cache_key, translation)
+    return translation
 
 
 def analyze_admission_info(md_content):
     """Analyze admission information using Gemini"""
 
-    config = ServiceConfig()
+    config = get_service_config()
+
+    cache_key = get_cache().make_key(f"analyze-{config.llm_model_name}-{ANALYZE_PROMPT_VERSION}", md_content)
+    cached_info = get_cache().get(cache_key)
+    if cached_info is not None:
+        print("Using cached admission info")
+        return cached_info
 
     analyze_agent = ConversableAgent(
         name="Analyze_Agent",
@@ -247,54 +557,163 @@ def analyze_admission_info(md_content):
 
     prompt = md_content + "\n\n请确保返回的是合法的JSON格式，不要包含任何其他说明文字。"
 
-    # 用当前的日期时间来命名重定向
-    output_file = f"analyze_{datetime.now().strftime('%Y%m%d_%H%M%S')}.stdout.log"
-    # 保存原始的stdout
-    old_stdout = sys.stdout
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            sys.stdout = f
+        with redirect_agent_stdout("analyze"):
             chat_result, _, _ = initiate_swarm_chat(initial_agent=analyze_agent,
-                                                agents=[analyze_agent],
-                                                messages=prompt,
-                                                after_work=AfterWorkOption.TERMINATE,
-                                                max_rounds=2)
+                                                    agents=[analyze_agent],
+                                                    messages=prompt,
+                                                    after_work=AfterWorkOption.TERMINATE,
+                                                    max_rounds=2)
 
-            # 获取分析结果
-            text = chat_result.chat_history[-1]["content"]
+        # 获取分析结果
+        text = chat_result.chat_history[-1]["content"]
     except Exception as e:
         print(f"Error analyzing admission info: {e}")
         return None
-    finally:
-        # 恢复原始的stdout
-        sys.stdout = old_stdout
 
     # Try to parse as JSON to validate format
     try:
         json.loads(text)
+        get_cache().put(cache_key, text)
         return text
     except json.JSONDecodeError:
         # If not valid JSON, try to extract JSON part
-        import re
-        json_match = re.search(r'\{.*\}', text, re.DOTALL)
+        json_match = JSON_PATTERN.search(text)
         if json_match:
             json_str = json_match.group()
             # Validate extracted JSON
             json.loads(json_str)
+            get_cache().put(cache_key, json_str)
             return json_str
         else:
             print(f"Could not extract valid JSON from response: {text}")
             return None
 
 
+def scan_subdirs(folder):
+    """返回folder下所有子目录名"""
+    with os.scandir(folder) as entries:
+        return [entry.name for entry in entries if entry.is_dir()]
+
+
+def scan_page_images(folder):
+    """返回folder下的scan_{序号}.png，按页序号（整数）排序"""
+    with os.scandir(folder) as entries:
+        names = [entry.name for entry in entries if entry.name.startswith('scan_') and entry.name.endswith('.png')]
+    names.sort(key=lambda name: int(name[len('scan_'):-len('.png')]))
+    return [os.path.join(folder, name) for name in names]
+
+
+def classify_files(folder):
+    """遍历一次目录，将文件按类型分类
+
+    Returns:
+        tuple: (pdf_files, md_files, zh_md_files, png_files)，md_files不包含中文版
+    """
+    pdf_files, md_files, zh_md_files, png_files = [], [], [], []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            name = entry.name
+            if name.endswith('.pdf'):
+                pdf_files.append(name)
+            elif name.endswith('中文.md'):
+                zh_md_files.append(name)
+            elif name.endswith('.md'):
+                md_files.append(name)
+            elif name.endswith('.png'):
+                png_files.append(name)
+    return pdf_files, md_files, zh_md_files, png_files
+
+
+def copy_file_fast(src, dst):
+    """复制文件及其元数据（同shutil.copy2）
+
+    优先使用os.copy_file_range在内核中复制（btrfs/xfs等文件系统上为reflink），不支持时退回到shutil.copyfile
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+    except (AttributeError, OSError):
+        # 非Linux或文件系统不支持copy_file_range
+        shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)
+    return dst
+
+
+def file_sha256(path):
+    """分块计算文件的SHA-256"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def load_state(output_folder):
+    """读取输出目录中的state.json（PDF转换状态），不存在或无法解析时返回None"""
+    try:
+        with open(os.path.join(output_folder, STATE_FILE_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(output_folder, state):
+    """保存转换状态，先写入临时文件再替换，避免中断时留下不完整的state.json"""
+    state_path = os.path.join(output_folder, STATE_FILE_NAME)
+    tmp_path = f'{state_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def load_page_manifest(folder):
+    """读取页面清单 {图像文件名: {"png_sha": ..., "md": ...}}，不存在或损坏时返回空字典"""
+    manifest_path = os.path.join(folder, PAGE_MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f'页面清单无法读取，忽略：{e}')
+        return {}
+
+
+def save_page_manifest(folder, manifest):
+    """保存页面清单，与save_state相同，先写入临时文件再替换，避免中断时留下不完整的清单而导致全部重新OCR"""
+    manifest_path = os.path.join(folder, PAGE_MANIFEST_FILE_NAME)
+    tmp_path = f'{manifest_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def count_lines(text):
+    """统计文本行数（与len(text.split('\\n'))一致），不生成行列表"""
+    return text.count('\n') + 1
+
+
+def count_nonblank_lines(text):
+    """统计文本中的非空行数，不生成行列表"""
+    return sum(1 for line in text.splitlines() if line.strip())
+
+
 def sanitize_filename(filename):
     """Sanitize filename by replacing invalid characters"""
-    # Replace slashes in date with dashes
-    filename = filename.replace('/', '-')
-    # Replace spaces and other special characters
-    filename = filename.replace(' ', '_')
-    filename = ''.join(c for c in filename if c.isalnum() or c in '_-')
-    return filename
+    # Replace slashes in date with dashes, spaces with underscores
+    filename = filename.translate(FILENAME_REPLACE_TABLE)
+    # Remove other special characters
+    return FILENAME_INVALID_PATTERN.sub('', filename)
 
 
 def process_single_pdf(pdf_path, output_base_folder, resume_dir=None):
@@ -313,70 +732,69 @@ def process_single_pdf(pdf_path, output_base_folder, resume_dir=None):
 
         # Copy original PDF if not already done
         if not os.path.exists(os.path.join(output_folder, os.path.basename(pdf_path))) and not resume_dir:
-            shutil.copy2(pdf_path, output_folder)
+            copy_file_fast(pdf_path, output_folder)
 
-        # 在恢复模式下，检查是否需要重新进行PDF转图片
-        log_file = os.path.join(output_folder, 'pdf2md.log')
+        # 在恢复模式下，检查是否需要重新进行PDF转图片（PDF内容未变化且已转换过时跳过）
+        pdf_sha = file_sha256(pdf_path)
         need_convert = True
-        if resume_dir and os.path.exists(log_file):
-            print(f'发现日志文件：{log_file}')
-            with open(log_file, 'r', encoding='utf-8') as f:
-                log_content = f.read()
-                if "Conversion completed" in log_content:
-                    need_convert = False
+        if resume_dir:
+            state = load_state(output_folder)
+            if state and state.get('converted') and state.get('pdf_sha') == pdf_sha:
+                print(f'PDF已转换为图片（{state.get("pages")}页），跳过转换')
+                need_convert = False
 
         # Convert PDF to images if needed
         if need_convert:
             print(f'Converting {pdf_path} to images...')
-            images = convert_pdf_to_images(pdf_path, 100)
-            save_images_with_progress(images, output_folder)
+            page_count = convert_pdf_to_images(pdf_path, 100, output_folder)
 
-            # 记录转换日志
-            with open(log_file, 'w', encoding='utf-8') as f:
-                f.write(f"PDF: {pdf_path}\n")
-                f.write(f"Total pages: {len(images)}\n")
-                f.write("Conversion completed\n")
+            # 记录转换状态
+            save_state(output_folder, {
+                'pdf_sha': pdf_sha,
+                'pages': page_count,
+                'converted': True,
+                'converted_at': datetime.now().isoformat(timespec='seconds'),
+            })
 
         # Process images to markdown
         print('Processing images to markdown...')
-        image_files = natsorted(glob.glob(f'{output_folder}/*.png'))
-        md_content = ""
+        image_files = scan_page_images(output_folder)
+        per_page_md = [None] * len(image_files)
+        pending_images = []
         need_translate = False
 
-        for img in image_files:
+        # 只有恢复模式下才可能存在之前生成的单页markdown，一次列出目录中已有的md文件
+        existing_md_files = set(classify_files(output_folder)[1]) if resume_dir else set()
+
+        for i, img in enumerate(image_files):
             img_name = os.path.basename(img)
-            md_file = os.path.join(output_folder, f"{os.path.splitext(img_name)[0]}.md")
+            md_name = f"{os.path.splitext(img_name)[0]}.md"
+            md_file = os.path.join(output_folder, md_name)
 
             # 检查是否需要重新处理该页面
-            need_process = True
-            if os.path.exists(md_file):
+            if md_name in existing_md_files:
                 with open(md_file, 'r', encoding='utf-8') as f:
                     content = f.read().strip()
                     if content and len(content) > 0:  # 如果文件不为空
-                        need_process = False
-                        md_content += content + '\n\n'
+                        per_page_md[i] = content
                         print(f'Using existing markdown for {img_name}')
-                    else:
-                        os.remove(md_file)  # 删除空的markdown文件
-                        print(f'Removing empty markdown file for {img_name}')
-
-            if need_process:
-                print(f'Processing {img_name}...')
-                try:
-                    text_content = ocr_by_google_cloud(img)
-                    markdown_output = format_to_markdown_ref_image(text_content, img)
-
-                    if markdown_output:
-                        # 保存单个页面的markdown
-                        with open(md_file, 'w', encoding='utf-8') as f:
-                            f.write(markdown_output)
-                        md_content += markdown_output + '\n\n'
-                        need_translate = True  # 只要有过处理痕迹，就需要翻译
-                except Exception as e:
-                    print(f"Error processing {img}: {e}")
-                    if os.path.exists(md_file):
-                        os.remove(md_file)
-                    raise e
+                        continue
+                os.remove(md_file)  # 删除空的markdown文件
+                print(f'Removing empty markdown file for {img_name}')
+
+            pending_images.append(img)
+
+        if pending_images:
+            # 所有需要处理的页面一起批量OCR，再并发格式化
+            print(f'OCR {len(pending_images)} images...')
+            new_contents = process_pages(pending_images, output_folder)
+            for i, img in enumerate(image_files):
+                if img in new_contents:
+                    per_page_md[i] = new_contents[img]
+            if new_contents:
+                need_translate = True  # 只要有过处理痕迹，就需要翻译
+
+        md_content = ''.join(page_md + '\n\n' for page_md in per_page_md if page_md is not None)
 
         # Analyze admission info
         print('Analyzing admission information...')
@@ -395,6 +813,10 @@ def process_single_pdf(pdf_path, output_base_folder, resume_dir=None):
                 new_folder_path = os.path.join(output_base_folder, new_folder_name)
                 base_name = sanitize_filename(f"{info_dict['大学名称']}_{info_dict['报名截止日期']}")
 
+                # 保存分析结果，生成索引时直接读取，无需再次分析
+                with open(os.path.join(output_folder, ADMISSION_INFO_FILE_NAME), 'w', encoding='utf-8') as f:
+                    json.dump(info_dict, f, ensure_ascii=False, indent=2)
+
                 # 不论是否是否是恢复模式，都会重新拼装和保存日语版markdown文件
                 md_path = os.path.join(output_folder, f'{base_name}.md')
                 with open(md_path, 'w', encoding='utf-8') as f:
@@ -406,8 +828,8 @@ def process_single_pdf(pdf_path, output_base_folder, resume_dir=None):
                     print(f'Found Chinese version: {zh_md_path}, compare lines...')
                     # 比较中文版和日文版的行数
                     with open(zh_md_path, 'r', encoding='utf-8') as f:
-                        zh_lines = len([line for line in f if line.strip()])
-                    jp_lines = len([line for line in md_content.split('\n') if line.strip()])
+                        zh_lines = count_nonblank_lines(f.read())
+                    jp_lines = count_nonblank_lines(md_content)
 
                     # 计算行数差异百分比
                     line_diff_percent = abs(zh_lines - jp_lines) / max(zh_lines + 1, jp_lines + 1) * 100
@@ -443,52 +865,61 @@ def process_single_pdf(pdf_path, output_base_folder, resume_dir=None):
         return False
 
 
-def generate_index_csv(output_folder):
-    """Generate index.csv file from processed markdown files"""
-    index_rows = []
-
-    # Get all subdirectories (university folders)
-    subdirs = [d for d in os.listdir(output_folder) if os.path.isdir(os.path.join(output_folder, d))]
-
-    for subdir in subdirs:
-        subdir_path = os.path.join(output_folder, subdir)
-
-        # Find the markdown file (not Chinese version)
-        md_files = [f for f in os.listdir(subdir_path) if f.endswith('.md') and not f.endswith('中文.md')]
-        if not md_files:
-            continue
+def _load_index_row(subdir_path):
+    """读取（或分析）单个大学文件夹的招生信息，返回index.csv的一行，无法获取时返回None"""
+    # Find the markdown file (not Chinese version)
+    _, md_files, _, _ = classify_files(subdir_path)
+    if not md_files:
+        return None
 
-        md_path = os.path.join(subdir_path, md_files[0])
+    md_path = os.path.join(subdir_path, md_files[0])
 
-        # Read and analyze markdown content
-        try:
+    # 优先读取处理PDF时保存的分析结果，没有时再分析markdown
+    try:
+        info_path = os.path.join(subdir_path, ADMISSION_INFO_FILE_NAME)
+        if os.path.exists(info_path):
+            with open(info_path, 'r', encoding='utf-8') as f:
+                info_dict = json.load(f)
+        else:
             with open(md_path, 'r', encoding='utf-8') as f:
                 md_content = f.read()
 
             info = analyze_admission_info(md_content)
-            if info == "NO":
-                continue
+            if info is None or info == "NO":
+                return None
 
             info_dict = json.loads(info)
+            with open(info_path, 'w', encoding='utf-8') as f:
+                json.dump(info_dict, f, ensure_ascii=False, indent=2)
+
+        # Create one entry per university
+        folder_name = sanitize_filename(f"{info_dict['大学名称']}_{info_dict['报名截止日期']}")
+        base_name = folder_name  # Same as folder name for files
+
+        return [
+            f"{folder_name}/{base_name}.pdf",  # pdf_path
+            f"{folder_name}/{base_name}.md",  # md_path
+            f"{folder_name}/{base_name}_中文.md",  # zh_md_path
+            info_dict['大学名称'],  # university_name
+            info_dict['报名截止日期'],  # deadline
+            info_dict['学校地址'],  # address
+            info_dict['学校简介']  # description
+        ]
+    except Exception as e:
+        print(f"Error processing {md_path}: {e}")
+        return None
 
-            # Create one entry per university
-            folder_name = sanitize_filename(f"{info_dict['大学名称']}_{info_dict['报名截止日期']}")
-            base_name = folder_name  # Same as folder name for files
-
-            row = [
-                f"{folder_name}/{base_name}.pdf",  # pdf_path
-                f"{folder_name}/{base_name}.md",  # md_path
-                f"{folder_name}/{base_name}_中文.md",  # zh_md_path
-                info_dict['大学名称'],  # university_name
-                info_dict['报名截止日期'],  # deadline
-                info_dict['学校地址'],  # address
-                info_dict['学校简介']  # description
-            ]
-            index_rows.append(row)
-
-        except Exception as e:
-            print(f"Error processing {md_path}: {e}")
-            continue
+
+def generate_index_csv(output_folder):
+    """Generate index.csv file from processed markdown files"""
+    # Get all subdirectories (university folders)
+    subdir_paths = [os.path.join(output_folder, d) for d in scan_subdirs(output_folder)]
+
+    # 需要调用LLM分析的文件夹并发处理
+    index_rows = []
+    if subdir_paths:
+        with ThreadPoolExecutor(max_workers=min(ANALYZE_MAX_WORKERS, len(subdir_paths))) as executor:
+            index_rows = [row for row in executor.map(_load_index_row, subdir_paths) if row is not None]
 
     # Write index.csv
     if index_rows:
@@ -513,7 +944,7 @@ def workflow(pdf_folder=None, resume_dir=None):
         # 在恢复模式下，直接使用resume_dir作为输出目录
         output_folder = resume_dir
         # 获取所有一级子目录
-        subdirs = [d for d in os.listdir(resume_dir) if os.path.isdir(os.path.join(resume_dir, d))]
+        subdirs = scan_subdirs(resume_dir)
 
         print(f'Found {len(subdirs)} directories to process')
         processed_dirs = 0
@@ -525,13 +956,13 @@ def workflow(pdf_folder=None, resume_dir=None):
             print(f'\nProcessing directory: {subdir}...')
 
             # 查找该目录下的PDF文件
-            pdf_files = [f for f in os.listdir(subdir_path) if f.endswith('.pdf')]
+            pdf_files, _, _, png_files = classify_files(subdir_path)
             if not pdf_files:
                 print(f'No PDF file found in {subdir}, skipping...')
                 continue
             
             # 统计页面数（通过PNG文件数量）
-            total_pages += len([f for f in os.listdir(subdir_path) if f.endswith('.png')])
+            total_pages += len(png_files)
 
             pdf_path = os.path.join(subdir_path, pdf_files[0])  # 只处理这个文件夹下第一个（理论上是唯一的）的PDF文件
             # 处理这个PDF文件，包括具体的resume逻辑也都在这里
@@ -564,8 +995,8 @@ def workflow(pdf_folder=None, resume_dir=None):
 
         for pdf_path in pdf_files:
             print(f'\nProcessing {os.path.basename(pdf_path)}...')
-            images = convert_pdf_to_images(pdf_path, 100)
-            total_pages += len(images)
+            # 只读取PDF信息获取页数，不做转换
+            total_pages += pdfinfo_from_path(pdf_path)["Pages"]
 
             if process_single_pdf(pdf_path, output_folder):
                 valid_handbooks += 1
@@ -593,7 +1024,7 @@ def review_workflow(output_folder):
     set_google_cloud_api_key_json()
 
     # 获取所有子目录（大学文件夹）
-    subdirs = [d for d in os.listdir(output_folder) if os.path.isdir(os.path.join(output_folder, d))]
+    subdirs = scan_subdirs(output_folder)
 
     # 处理统计
     total_dirs = len(subdirs)
@@ -610,9 +1041,7 @@ def review_workflow(output_folder):
         print(f'\n检查目录 ({processed_dirs}/{total_dirs}): {subdir}')
 
         # 查找相关文件
-        pdf_files = [f for f in os.listdir(subdir_path) if f.endswith('.pdf')]
-        md_files = [f for f in os.listdir(subdir_path) if f.endswith('.md') and not f.endswith('中文.md')]
-        zh_md_files = [f for f in os.listdir(subdir_path) if f.endswith('中文.md')]
+        pdf_files, md_files, zh_md_files, _ = classify_files(subdir_path)
 
         if not pdf_files:
             print(f'警告：目录 {subdir} 中未找到PDF文件，跳过处理')
@@ -627,8 +1056,7 @@ def review_workflow(output_folder):
             md_path = os.path.join(subdir_path, md_files[0])
             with open(md_path, 'r', encoding='utf-8') as f:
                 md_content = f.read()
-                jp_lines = md_content.split('\n')
-                jp_line_count = len(jp_lines)
+                jp_line_count = count_lines(md_content)
                 if jp_line_count >= 10:  # 仍然保留最小行数检查
                     needs_md_regeneration = False
 
@@ -636,22 +1064,30 @@ def review_workflow(output_folder):
         if needs_md_regeneration:
             print('重新生成日文Markdown文件...')
             # 转换PDF到图片
-            images = convert_pdf_to_images(pdf_path, 100)
-
-            # 保存图片
-            for i, image in enumerate(images):
-                image.save(os.path.join(subdir_path, f'scan_{i}.png'), 'PNG')
-
-            # 处理图片生成markdown
-            md_content = ""
-            image_files = natsorted(glob.glob(f'{subdir_path}/*.png'))
-
+            convert_pdf_to_images(pdf_path, 100, subdir_path)
+
+            # 处理图片生成markdown，图像未变化且已有markdown的页面直接使用清单中的结果
+            image_files = scan_page_images(subdir_path)
+            manifest = load_page_manifest(subdir_path)
+            png_shas = {img: file_sha256(img) for img in image_files}
+            page_contents = {}
+            pending_images = []
             for img in image_files:
-                print(f'处理图片 {os.path.basename(img)}...')
-                text_content = ocr_by_google_cloud(img)
-                markdown_output = format_to_markdown_ref_image(text_content, img)
-                if markdown_output:
-                    md_content += markdown_output + '\n\n'
+                page = manifest.get(os.path.basename(img), {})
+                if page.get('png_sha') == png_shas[img] and page.get('md', '').strip():
+                    page_contents[img] = page['md']
+                else:
+                    pending_images.append(img)
+            if pending_images:
+                print(f'需要重新处理 {len(pending_images)}/{len(image_files)} 页')
+                page_contents.update(process_pages(pending_images))
+            save_page_manifest(subdir_path, {
+                os.path.basename(img): {
+                    'png_sha': png_shas[img],
+                    'md': page_contents.get(img, '')
+                } for img in image_files
+            })
+            md_content = ''.join(page_contents[img] + '\n\n' for img in image_files if img in page_contents)
 
             # 保存新的markdown文件
             if md_content:
@@ -660,7 +1096,7 @@ def review_workflow(output_folder):
                     f.write(md_content)
                 regenerated_md += 1
                 # 更新日文行数
-                jp_line_count = len(md_content.split('\n'))
+                jp_line_count = count_lines(md_content)
             else:
                 print('警告：无法生成Markdown内容')
                 continue
@@ -671,7 +1107,7 @@ def review_workflow(output_folder):
             zh_md_path = os.path.join(subdir_path, zh_md_files[0])
             with open(zh_md_path, 'r', encoding='utf-8') as f:
                 zh_content = f.read()
-                zh_line_count = len(zh_content.split('\n'))
+                zh_line_count = count_lines(zh_content)
 
                 # 计算行数差异百分比
                 line_diff_percentage = abs(zh_line_count - jp_line_count) / jp_line_count * 100
@@ -686,7 +1122,7 @@ def review_workflow(output_folder):
         if needs_translation:
             print('重新生成中文翻译...')
             # 读取最新的日文md内容
-            current_md_files = [f for f in os.listdir(subdir_path) if f.endswith('.md') and not f.endswith('中文.md')]
+            _, current_md_files, _, _ = classify_files(subdir_path)
             if not current_md_files:
                 print('警告：未找到日文Markdown文件，跳过翻译')
                 continue
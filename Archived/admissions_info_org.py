@@ -111,18 +111,18 @@ if __name__ == '__main__':
     processed_md_count = 0
     error_md_count = 0
 
-    # 遍历一级子目录
-    for subdir in os.listdir(base_folder):
-        subdir_path = os.path.join(base_folder, subdir)
-        if not os.path.isdir(subdir_path):
-            continue
+    # 遍历一级子目录（scandir的目录项中已有类型信息，无需逐个stat）
+    with os.scandir(base_folder) as it:
+        subdir_paths = [entry.path for entry in it if entry.is_dir()]
 
+    for subdir_path in subdir_paths:
         # 查找非"*中文.md"的md文件
         md_file = None
-        for file in os.listdir(subdir_path):
-            if file.endswith('.md') and not file.endswith('中文.md'):
-                md_file = os.path.join(subdir_path, file)
-                break
+        with os.scandir(subdir_path) as it:
+            for entry in it:
+                if entry.name.endswith('.md') and not entry.name.endswith('中文.md'):
+                    md_file = entry.path
+                    break
         
         if md_file is None:
             print(f"Warning: No suitable MD file found in {subdir_path}")
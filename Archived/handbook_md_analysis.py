@@ -4,18 +4,25 @@
 # pylint: disable=invalid-name
 import argparse
 import datetime
+import json
 import os
 import sys
 import glob
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator
 
-from agents import Agent, Runner, trace
+from agents import Agent, trace
 from dotenv import load_dotenv
+from llm_cache import llm_cache
+from llm_runner import run_sync
 from logging_config import setup_logger
 
 # 设置日志记录器
 logger = setup_logger(logger_name="md_analysis", log_level="INFO")
 
+# 每个报告最多保留的备份数
+MAX_REPORT_BACKUPS = 3
+
 
 class MDAnalysisTools:
     """Markdown分析工具类"""
@@ -89,7 +96,28 @@ class ServiceConfig:
             if not self.translate_terms:
                 raise ValueError(f"错误：翻译术语文件 {translate_terms_file} 为空")
 
-        logger.info(f'SETUP INFO = MODEL: {self.model}, MODEL_MINI: {self.model_mini}')
+        # 同时分析的文件数，各文件之间互不依赖，耗时主要在等待LLM的响应
+        try:
+            self.workers = max(1, int(os.getenv("MD_ANALYSIS_WORKERS", "4")))
+        except ValueError:
+            logger.warning("MD_ANALYSIS_WORKERS配置无效，使用默认值4")
+            self.workers = 4
+
+        # 文档的最大字符数，超出部分不发送给LLM（分析和审核都会发送原文，过长的文档会使token消耗加倍）；0表示不限制
+        try:
+            self.max_md_chars = max(0, int(os.getenv("MD_ANALYSIS_MAX_CHARS", "0")))
+        except ValueError:
+            logger.warning("MD_ANALYSIS_MAX_CHARS配置无效，使用默认值0（不限制）")
+            self.max_md_chars = 0
+
+        # 文档的最小字符数（不含首尾空白），内容过少的文档通常是PDF转换失败的结果，不发送给LLM
+        try:
+            self.min_md_chars = max(1, int(os.getenv("MD_ANALYSIS_MIN_CHARS", "500")))
+        except ValueError:
+            logger.warning("MD_ANALYSIS_MIN_CHARS配置无效，使用默认值500")
+            self.min_md_chars = 500
+
+        logger.info(f'SETUP INFO = MODEL: {self.model}, MODEL_MINI: {self.model_mini}, WORKERS: {self.workers}')
         self._initialized = True
 
 
@@ -204,59 +232,127 @@ class MDAnalysisService:
 总之，要严格的践行Markdown的语法要求，不要只是看上去像，其实有不少语法错误
 """)
 
-        # 创建编排代理
-        self.orchestrator_agent = Agent(name="Orchestrator_Agent",
-                                        model=self.config.model,
-                                        instructions="你是一个工作流编排代理，负责协调招生信息文档分析、审核和报告生成的整个流程。根据用户提供的文档内容，选择合适的工具执行分析流程。",
-                                        tools=[
-                                            self.markdown_analyzer_agent.as_tool(tool_name="analyze_markdown", tool_description="分析日本大学招生Markdown文档并回答特定问题"),
-                                            self.review_agent.as_tool(tool_name="review_analysis", tool_description="审核分析结果，确保其准确性和质量"),
-                                            self.report_agent.as_tool(tool_name="generate_report", tool_description="将审核后的分析结果整理成最终的Markdown格式报告")
-                                        ])
-
-    def find_markdown_files(self, base_folder: str, review_mode: bool = False) -> List[str]:
-        """在指定文件夹中查找需要处理的Markdown文件
+    def iter_markdown_files(self, base_folder: str, review_mode: bool = False) -> Iterator[str]:
+        """在指定文件夹中查找需要处理的Markdown文件，边查找边返回
         
         Args:
             base_folder (str): 基础文件夹路径
             review_mode (bool): 是否为review模式，默认为False
         """
         base_dirs = glob.glob(base_folder)
-        md_files = []
 
         for base_dir in base_dirs:
-            for root, _, files in os.walk(base_dir):
-                for file in files:
-                    if file.endswith(".md"):
-                        # 跳过scan_开头的文件
-                        if file.startswith("scan_"):
-                            logger.debug(f"跳过scan_开头的文件：{file}")
-                            continue
-
-                        if "_中文" not in file and "_report" not in file:
-                            full_path = os.path.join(root, file)
-
-                            if review_mode:
-                                # 检查是否存在对应的report文件
-                                report_file = full_path.replace(".md", "_report.md")
-                                if os.path.exists(report_file):
-                                    # 检查report文件的行数
-                                    with open(report_file, 'r', encoding='utf-8') as f:
-                                        line_count = sum(1 for _ in f)
-                                    if line_count >= 10:
-                                        logger.info(f"跳过已有完整报告的文件：{full_path}")
-                                        continue
-
-                            md_files.append(full_path)
-
-        logger.info(f"共有{len(md_files)}个Markdown文件需要处理...")
-        return md_files
+            for entry in self._scan_files(base_dir):
+                file = entry.name
+                if not file.endswith(".md"):
+                    continue
+                # 跳过scan_开头的文件
+                if file.startswith("scan_"):
+                    logger.debug(f"跳过scan_开头的文件：{file}")
+                    continue
+                if "_中文" in file or "_report" in file:
+                    continue
+
+                full_path = entry.path
+                if review_mode:
+                    # 检查是否存在对应的report文件，且report文件的行数足够
+                    report_file = full_path.replace(".md", "_report.md")
+                    if self._has_min_lines(report_file, 10):
+                        logger.info(f"跳过已有完整报告的文件：{full_path}")
+                        continue
+
+                yield full_path
+
+    @staticmethod
+    def _scan_files(folder: str):
+        """递归列出folder下的所有文件（os.DirEntry），目录项中已有类型信息，无需逐个stat"""
+        try:
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.warning(f"无法读取目录：{folder} - {e}")
+            return
+        for entry in entries:
+            if entry.is_dir():
+                # 与os.walk相同，不进入指向目录的符号链接
+                if not entry.is_symlink():
+                    yield from MDAnalysisService._scan_files(entry.path)
+            else:
+                yield entry
+
+    @staticmethod
+    def _has_min_lines(file_path: str, min_lines: int) -> bool:
+        """判断文件是否至少有min_lines行，按块读取字节并统计换行符，够数后不再读取剩余部分
+
+        文件不存在时返回False
+        """
+        newlines = 0
+        last_byte = b'\n'
+        try:
+            with open(file_path, 'rb') as f:
+                while chunk := f.read(65536):
+                    newlines += chunk.count(b'\n')
+                    if newlines >= min_lines:
+                        return True
+                    last_byte = chunk[-1:]
+        except FileNotFoundError:
+            return False
+        # 最后一行没有换行符时也算一行
+        return newlines + (last_byte != b'\n') >= min_lines
+
+    @staticmethod
+    def _run_stage(agent: Agent, input_text: str) -> str:
+        """运行分析流程中的一个步骤，返回结果为空时抛出ValueError
+
+        以(模型, 系统提示词, 输入)为键缓存结果（LLM_CACHE=1时启用），文档未变化时不会重复请求
+        """
+        cache_key = llm_cache.key(agent.model, agent.instructions, input_text)
+        cached_output = llm_cache.get(cache_key)
+        if cached_output is not None:
+            return cached_output
+
+        logger.debug(f"运行 {agent.name}...")
+        result = run_sync(agent, input_text)
+        if not result or not result.final_output:
+            raise ValueError(f"{agent.name} 返回结果无效")
+        llm_cache.put(cache_key, result.final_output)
+        return result.final_output
+
+    def _report_source_hash(self, md_content: str) -> str:
+        """计算生成报告所用的全部输入（模型、各代理的提示词、文档内容）的哈希"""
+        return llm_cache.key(self.config.model, self.config.model_mini, self.markdown_analyzer_agent.instructions, self.review_agent.instructions,
+                             self.report_agent.instructions, md_content)
+
+    @staticmethod
+    def _is_report_current(report_file_path: str, source_hash: str) -> bool:
+        """报告存在，且生成时的输入哈希（记录在report_file_path.meta.json中）与source_hash一致"""
+        try:
+            with open(report_file_path + ".meta.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return meta.get("source_hash") == source_hash and os.path.exists(report_file_path)
+
+    @staticmethod
+    def _save_report_meta(report_file_path: str, source_hash: str) -> None:
+        """记录生成报告时的输入哈希"""
+        with open(report_file_path + ".meta.json", "w", encoding="utf-8") as f:
+            json.dump({"source_hash": source_hash}, f)
 
     def backup_existing_report(self, output_file_path: str) -> None:
-        """如果报告文件已存在，将其备份"""
-        if os.path.exists(output_file_path):
-            bak_file_path = output_file_path + "." + datetime.datetime.now().strftime("%Y%m%d%H%M%S") + ".bak"
-            os.rename(output_file_path, bak_file_path)
+        """如果报告文件已存在，将其备份，只保留最新的MAX_REPORT_BACKUPS个备份"""
+        if not os.path.exists(output_file_path):
+            return
+
+        bak_file_path = output_file_path + "." + datetime.datetime.now().strftime("%Y%m%d%H%M%S") + ".bak"
+        os.replace(output_file_path, bak_file_path)
+
+        # 备份文件名中的时间戳可以直接按字符串排序
+        folder, report_name = os.path.split(output_file_path)
+        with os.scandir(folder or ".") as it:
+            backups = sorted(entry.path for entry in it if entry.name.startswith(report_name + ".") and entry.name.endswith(".bak"))
+        for old_backup in backups[:-MAX_REPORT_BACKUPS]:
+            os.remove(old_backup)
 
     def process_single_file(self, markdown_file_path: str) -> bool:
         """处理单个Markdown文件
@@ -279,57 +375,62 @@ class MDAnalysisService:
                 logger.error(f"无法加载文件内容: {md_content}")
                 return False
 
-            # 检查文件内容是否为空
-            if not md_content.strip():
+            # 检查文件内容是否为空或过少
+            content_chars = len(md_content.strip())
+            if not content_chars:
                 logger.warning(f"文件内容为空：{markdown_file_path}")
                 return False
+            if content_chars < self.config.min_md_chars:
+                logger.warning(f"文件内容过少（{content_chars} 字符，少于 {self.config.min_md_chars} 字符），跳过：{markdown_file_path}")
+                return False
+
+            if self.config.max_md_chars and len(md_content) > self.config.max_md_chars:
+                logger.warning(f"文件内容过长（{len(md_content)} 字符），只使用前 {self.config.max_md_chars} 字符：{markdown_file_path}")
+                md_content = md_content[:self.config.max_md_chars]
 
             # 2. 准备输出文件路径
             report_file_path = markdown_file_path.replace(".md", "_report.md")
+
+            # 文档、模型和提示词都没有变化时，已有的报告就是最新的，无需重新生成
+            source_hash = self._report_source_hash(md_content)
+            if self._is_report_current(report_file_path, source_hash):
+                logger.info(f"报告已是最新，跳过：{markdown_file_path}")
+                return True
+
             try:
                 self.backup_existing_report(report_file_path)
             except Exception as e:
                 logger.warning(f"备份已有报告失败，将覆盖原文件：{e}")
 
-            # 3. 构建初始提示
+            # 3. 使用trace捕获整个流程
             logger.debug(f"文件大小: {len(md_content)} 字符")
-            initial_prompt = f"""请根据接下来提供的日本大学招生信息Markdown文档内容，对以下问题进行分析：
-{self.questions}
-
-请完成以下三个步骤:
-1. 使用analyze_markdown工具分析文档内容
-2. 使用review_analysis工具对分析结果进行审核校对
-3. 使用generate_report工具生成最终Markdown格式报告
-
-以下是要被分析的文档内容:
-{md_content}
-"""
-
-            # 4. 使用trace捕获整个流程
             with trace("招生信息文档分析"):
                 try:
-                    # 运行编排代理
-                    logger.debug("开始运行AI代理分析文档...")
-                    result = Runner.run_sync(self.orchestrator_agent, initial_prompt)
+                    # 分析、审核、生成报告三个步骤的顺序固定，直接依次调用各代理，
+                    # 不再经由编排代理以工具调用的方式转发（编排代理需要把整篇文档重新输出为工具参数）
+                    analysis = self._run_stage(self.markdown_analyzer_agent, md_content)
+                    reviewed_analysis = self._run_stage(self.review_agent, f"""Markdown原文：
+{md_content}
 
-                    # 检查结果是否有效
-                    if not result or not hasattr(result, 'final_output') or not result.final_output:
-                        logger.error(f"AI分析失败：返回结果无效 - {markdown_file_path}")
-                        return False
+-----------
+
+分析结果：
+{analysis}""")
+                    final_report = self._run_stage(self.report_agent, reviewed_analysis)
 
                     # 保存最终报告
-                    final_report = result.final_output
                     save_result = self.tools.save_report_to_file(final_report, report_file_path)
 
                     if save_result != "保存成功":
                         logger.error(f"保存报告失败：{save_result}")
                         return False
+                    self._save_report_meta(report_file_path, source_hash)
 
                 except Exception as e:
                     logger.error(f"AI代理处理过程出错：{markdown_file_path} - {str(e)}")
                     return False
 
-            # 5. 计算处理时间并记录
+            # 4. 计算处理时间并记录
             end_time = datetime.datetime.now()
             process_time = (end_time - start_time).total_seconds()
             logger.info(f"处理完成：{markdown_file_path} - 耗时: {process_time:.2f}秒")
@@ -346,25 +447,27 @@ class MDAnalysisService:
             base_folder (str): 基础文件夹路径
             review_mode (bool): 是否为review模式，默认为False
         """
-        # 查找所有需要处理的Markdown文件
-        md_files = self.find_markdown_files(base_folder, review_mode)
-
-        if not md_files:
-            logger.warning(f"在{base_folder}中未找到需要处理的Markdown文件")
-            return
-
-        # 线性处理每个文件
+        # 多个文件并发处理，process_single_file内部已捕获所有异常
         success_count = 0
         failed_files = []
 
-        for i, file_path in enumerate(md_files, 1):
-            logger.info(f"处理文件 [{i}/{len(md_files)}]: {file_path}")
-            success = self.process_single_file(file_path)
-
-            if success:
-                success_count += 1
-            else:
-                failed_files.append(file_path)
+        with ThreadPoolExecutor(max_workers=self.config.workers) as executor:
+            # 每找到一个文件就立即提交，第一个文件的分析与剩余目录的查找同时进行
+            futures = {executor.submit(self.process_single_file, file_path): file_path for file_path in self.iter_markdown_files(base_folder, review_mode)}
+            md_files = list(futures.values())
+
+            if not md_files:
+                logger.warning(f"在{base_folder}中未找到需要处理的Markdown文件")
+                return
+            logger.info(f"共有{len(md_files)}个Markdown文件需要处理...")
+
+            for i, future in enumerate(as_completed(futures), 1):
+                file_path = futures[future]
+                if future.result():
+                    success_count += 1
+                else:
+                    failed_files.append(file_path)
+                logger.info(f"进度 [{i}/{len(md_files)}]: {file_path}")
 
         # 汇总处理结果
         if failed_files:
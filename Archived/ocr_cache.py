@@ -0,0 +1,61 @@
+"""
+OCR/LLM结果缓存模块
+
+以内容的SHA-256为键，将OCR、格式化、翻译的结果保存在SQLite中，
+同一页面（或同一段文本）再次处理时直接返回缓存的结果
+"""
+# pylint: disable=invalid-name
+import hashlib
+import os
+import sqlite3
+import threading
+
+
+class OCRCache:
+    """基于SQLite（WAL模式）的结果缓存，可以在多个线程中共用"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.getenv("OCR_CACHE_PATH", ".cache/ocr_cache.sqlite3")
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(namespace, *parts):
+        """计算缓存键，namespace中应包含API/模型/提示词的版本，以便这些变化时缓存自动失效"""
+        sha = hashlib.sha256()
+        for part in parts:
+            sha.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        return f"{namespace}:{sha.hexdigest()}"
+
+    def get(self, key):
+        """读取缓存，未命中时返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, value):
+        """写入缓存，value为空时不做任何处理"""
+        if not value:
+            return
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)", (key, value))
+            self._conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """返回进程内共用的缓存实例"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = OCRCache()
+        return _cache
@@ -6,26 +6,77 @@
 python 03_pdf2img2md_make_index_openai.py [pdf_folder] [--resume resume_dir]
 
 '''
+import asyncio
 import json
 import os
+import re
 import sys
 import shutil
-import glob
+import subprocess
+import tempfile
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import argparse
 import base64
+import functools
+import io
+import threading
 
-from pdf2image import convert_from_path
-from tqdm import tqdm
+from pdf2image import convert_from_path, pdfinfo_from_path
 from dotenv import load_dotenv
-from natsort import natsorted
-from agents import Agent, Runner, TResponseInputItem
+from PIL import Image
+from openai import APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI, OpenAI
+from agents import Agent, OpenAIProvider, RunConfig, Runner, TResponseInputItem
 from logging_config import setup_logger
+from ocr_cache import get_cache
 
 # 设置日志记录器
 logger = setup_logger(logger_name="pdf2md", log_level="INFO")
 
+# 每个输出目录中记录处理进度的文件
+STATE_FILE_NAME = 'state.json'
+
+# OCR提示词的版本号，修改提示词或图像编码方式时需要同步修改，使旧的OCR缓存失效
+OCR_PROMPT_VERSION = "v1"
+# 翻译提示词的版本号，修改时需要同步修改，使旧的译文缓存失效
+TRANSLATE_PROMPT_VERSION = "v1"
+
+# 文件名中的斜杠（日期）替换为破折号、空格替换为下划线，其余非字母数字、下划线、破折号的字符删除
+# isalnum()对日语等非ASCII文字同样成立，因此使用\w而不是ASCII字符集
+FILENAME_REPLACE_TABLE = str.maketrans({'/': '-', ' ': '_'})
+FILENAME_INVALID_PATTERN = re.compile(r'[^\w-]')
+
+# 文本层中去掉空白后至少有这么多字符的页面，才视为带有文本层（只有页码的页面不算）
+TEXT_LAYER_MIN_CHARS = 20
+
+# OCR和格式化在一次请求中完成，图像只需发送一次
+OCR_FORMAT_INSTRUCTIONS = """你是一个专业的OCR文本识别和文本格式化专家。
+请仔细观察图像中的文本内容，尽可能准确地提取所有文本和表格，并直接以Markdown格式输出。
+输出应该保持原始文本的格式和结构，包括格式（加粗、斜体、下划线、表格）、段落和标题。
+特别注意表格的列数（有些表格首行有空单元格，也要算作一列）
+
+请注意：
+1. 仅提取图像中的实际文本，不要添加任何解释或说明，也不要进行归纳总结
+2. 保持原始日语文本，不要翻译
+3. 尽可能保持原始格式结构，特别是表格，要准确的提取表格中的所有文字
+4. 忽略所有的纯图形内容（比如：logo，地图等，包括页面上的水印）；特别注意不要以Base64的编码来处理任何纯图形内容
+5. 忽略所有的页眉和页脚，但保留原文中每页的页码（如果原文中有），严格按照原文中标注的页码来提取（不论原文是否有错）
+   页码一律独立一行，前后空行，以 【数字 + ページ】 的形式表现
+6. 如果文本中包含大量无意义的信息，请删除他们
+7. 对于像目录这样的内容，可能会包含大量的「..........」或事「-------------」这样的符号，如果只是为了表达页码的话请将其长度现在6个点也就是「......」
+8. 如果有URL信息，请保持完整的URL信息，但不要用Markdown的链接格式来处理URL，保留纯文本状态即可
+9. 如果遇到空白页或整页都是没有意义的内容，请返回：EMPTY_PAGE
+10. 结果会被直接保存为md文件，所以请不要添加任何```markdown```之类的定界符
+
+关于Markdown的语法格式，特别注意以下要求：
+1. 表格前后的空行要保留
+2. 列表前后的空行要保留
+3. 标题前后的空行要保留
+4. 表格的排版（特别是合并单元格）要与原文（图片）完全一致
+5. 根据Markdown的语法，需要添加空格的地方，请务必添加空格；但不要在表格的单元格内填充大量的空格，需要的话填充一个空格即可
+总之，要严格的践行Markdown的语法要求，不要只是看上去像，其实有不少语法错误
+"""
+
 
 class Config:
     """配置类，用于管理所有配置信息（单例模式）"""
@@ -68,168 +119,355 @@ class Config:
             if not self.translate_terms:
                 raise ValueError(f"错误：翻译术语文件 {translate_terms_file} 为空")
 
-        logger.info(f'SETUP INFO = DPI: {self.dpi}, OCR_MODEL: {self.ocr_model}, MODEL: {self.model}')
+        # 同时进行的OpenAI请求数
+        try:
+            self.concurrency = max(1, int(os.getenv("OPENAI_CONCURRENCY", "4")))
+        except ValueError:
+            logger.warning("OPENAI_CONCURRENCY配置无效，使用默认值4")
+            self.concurrency = 4
+
+        # 分段翻译时每段的最大字符数
+        try:
+            self.translate_chunk_size = max(1000, int(os.getenv("TRANSLATE_CHUNK_SIZE", "8000")))
+        except ValueError:
+            logger.warning("TRANSLATE_CHUNK_SIZE配置无效，使用默认值8000")
+            self.translate_chunk_size = 8000
+
+        # 同时处理的PDF数，所有PDF的OpenAI请求总数仍受OPENAI_CONCURRENCY限制
+        try:
+            self.pdf_concurrency = max(1, int(os.getenv("PDF_CONCURRENCY", "2")))
+        except ValueError:
+            logger.warning("PDF_CONCURRENCY配置无效，使用默认值2")
+            self.pdf_concurrency = 2
+
+        # 带有文本层的页面比例不低于该值时，直接使用文本层，只对其余页面进行栅格化和OCR（大于1时禁用）
+        try:
+            self.text_layer_ratio = float(os.getenv("TEXT_LAYER_RATIO", "0.8"))
+        except ValueError:
+            logger.warning("TEXT_LAYER_RATIO配置无效，使用默认值0.8")
+            self.text_layer_ratio = 0.8
+
+        # 通过Files API上传页面图像并以file_id引用，代替在请求中内嵌base64（使用不支持Files API的兼容服务时保持关闭）
+        self.image_upload = os.getenv("OPENAI_IMAGE_UPLOAD", "false").lower() == "true"
+
+        logger.info(f'SETUP INFO = DPI: {self.dpi}, OCR_MODEL: {self.ocr_model}, MODEL: {self.model}, '
+                    f'CONCURRENCY: {self.concurrency}, PDF_CONCURRENCY: {self.pdf_concurrency}')
         self._initialized = True
 
 
-def convert_pdf_to_images(pdf_file, dpi):
-    """Convert PDF file to list of images"""
-    images = convert_from_path(pdf_file, dpi=dpi)
-    return images
+def scan_subdirs(folder):
+    """列出目录下的所有子目录名，is_dir()直接使用目录项中的信息，无需逐个stat"""
+    with os.scandir(folder) as it:
+        return [entry.name for entry in it if entry.is_dir()]
+
+
+def scan_files(folder, suffix, prefix=''):
+    """列出目录下以prefix开头、以suffix结尾的文件（os.DirEntry），避免glob的模式匹配开销"""
+    with os.scandir(folder) as it:
+        return [entry for entry in it if entry.is_file() and entry.name.startswith(prefix) and entry.name.endswith(suffix)]
+
+
+def load_state(output_folder):
+    """读取输出目录中的state.json（处理进度），不存在或无法解析时返回None"""
+    try:
+        with open(os.path.join(output_folder, STATE_FILE_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def save_state(output_folder, state):
+    """保存处理进度，先写入临时文件再替换，避免中断时留下不完整的state.json"""
+    state_path = os.path.join(output_folder, STATE_FILE_NAME)
+    tmp_path = f'{state_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, state_path)
 
 
-def save_images_with_progress(images, output_folder):
-    """Save images with multi-threading and progress bars"""
-    total_pages = len(images)
-    logger.info(f'总页数: {total_pages}')
+def page_index(img_name):
+    """从scan_{序号}.png中取出页序号"""
+    return int(os.path.splitext(img_name)[0].rsplit('_', 1)[1])
 
-    max_workers = max(1, os.cpu_count() - 1)
-    logger.info(f'使用 {max_workers} 个线程进行转换')
 
-    chunk_size = (total_pages + max_workers - 1) // max_workers
-    chunks = [images[i:i + chunk_size] for i in range(0, total_pages, chunk_size)]
+def scan_page_sources(folder):
+    """列出目录下每页的输入（文本层scan_{序号}.txt或图像scan_{序号}.png），直接按页序号（整数）排序"""
+    return sorted((entry.path for entry in scan_files(folder, '', prefix='scan_') if entry.name.endswith(('.png', '.txt'))),
+                  key=page_index)
 
-    progress_bars = [tqdm(total=len(chunk), desc=f'线程 {i+1}', position=i, ncols=80) for i, chunk in enumerate(chunks)]
 
-    def save_chunk(chunk_images, start_idx, progress_bar):
-        for j, image in enumerate(chunk_images):
-            image.save(os.path.join(output_folder, f'scan_{start_idx + j}.png'), 'PNG')
-            progress_bar.update(1)
+def extract_text_layer(pdf_file):
+    """使用poppler的pdftotext按版面提取各页的文本层
 
+    Returns:
+        list: 各页的文本，pdftotext不可用或执行失败时返回None
+    """
     try:
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = []
-            for i, chunk in enumerate(chunks):
-                futures.append(executor.submit(save_chunk, chunk, i * chunk_size, progress_bars[i]))
+        result = subprocess.run(['pdftotext', '-layout', '-enc', 'UTF-8', pdf_file, '-'],
+                                capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning(f'无法提取文本层: {e}')
+        return None
+    # 各页以换页符分隔，最后一页之后也有换页符
+    return result.stdout.decode('utf-8', errors='replace').split('\f')[:-1]
 
-            for future in as_completed(futures):
-                future.result()
-    finally:
-        for progress_bar in progress_bars:
-            progress_bar.close()
 
+def prepare_text_layer(pdf_file, dpi, output_folder, ratio):
+    """PDF中带有文本层的页面足够多时，将文本层保存为scan_{序号}.txt，只对没有文本层的页面生成scan_{序号}.png
 
-def perform_ocr(image_path):
-    """使用OpenAI Vision模型进行OCR"""
-    logger.info("使用OpenAI Vision进行OCR...")
-    config = Config()
+    Returns:
+        int: 总页数，文本层不足以使用时返回None（调用者应转换所有页面）
+    """
+    if ratio > 1:
+        return None
+    page_texts = extract_text_layer(pdf_file)
+    if not page_texts:
+        return None
+
+    text_pages = [i for i, text in enumerate(page_texts) if len(''.join(text.split())) >= TEXT_LAYER_MIN_CHARS]
+    if len(text_pages) < ratio * len(page_texts):
+        logger.info(f'带有文本层的页面 {len(text_pages)}/{len(page_texts)}，使用图像OCR')
+        return None
+
+    logger.info(f'带有文本层的页面 {len(text_pages)}/{len(page_texts)}，直接使用文本层')
+    text_page_set = set(text_pages)
+    for i, text in enumerate(page_texts):
+        if i in text_page_set:
+            with open(os.path.join(output_folder, f'scan_{i}.txt'), 'w', encoding='utf-8') as f:
+                f.write(text)
+            continue
+        # 没有文本层的页面（扫描页）单独栅格化
+        with tempfile.TemporaryDirectory(dir=output_folder) as temp_folder:
+            image_paths = convert_from_path(pdf_file,
+                                            dpi=dpi,
+                                            output_folder=temp_folder,
+                                            fmt='png',
+                                            paths_only=True,
+                                            first_page=i + 1,
+                                            last_page=i + 1)
+            os.replace(image_paths[0], os.path.join(output_folder, f'scan_{i}.png'))
+    return len(page_texts)
+
+
+def convert_pdf_to_images(pdf_file, dpi, output_folder):
+    """将PDF转换为output_folder中的scan_{序号}.png
+
+    由poppler多线程直接将页面写入磁盘，不在内存中保留所有页面的图像
+
+    Returns:
+        int: 转换的页数
+    """
+    thread_count = max(1, os.cpu_count() - 1)
+    logger.info(f'使用 {thread_count} 个poppler线程进行转换')
+
+    with tempfile.TemporaryDirectory(dir=output_folder) as temp_folder:
+        image_paths = convert_from_path(pdf_file,
+                                        dpi=dpi,
+                                        output_folder=temp_folder,
+                                        fmt='png',
+                                        output_file='scan',
+                                        paths_only=True,
+                                        thread_count=thread_count)
+        for i, image_path in enumerate(image_paths):
+            os.replace(image_path, os.path.join(output_folder, f'scan_{i}.png'))
+
+    logger.info(f'总页数: {len(image_paths)}')
+    return len(image_paths)
+
+
+def encode_image_jpeg(image_path, max_side=2048, quality=85):
+    """将图像缩小并编码为JPEG
+
+    模型内部本身就会对图像进行缩小，发送原始PNG只会浪费带宽和时间；保存在本地的PNG保持原样
+    """
+    with Image.open(image_path) as image:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, 'JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=1)
+def get_openai_client():
+    """获取用于上传文件的OpenAI客户端，只创建一次"""
+    return OpenAI()
+
+
+def build_image_payload(image_path):
+    """将图像编码为input_image
+
+    启用OPENAI_IMAGE_UPLOAD时先上传图像，以file_id引用，请求体中不再包含base64编码的图像
+
+    Returns:
+        tuple: (input_image, file_id)，未上传时file_id为None
+    """
+    jpeg_bytes = encode_image_jpeg(image_path)
+    # OCR需要看清小字，使用high细节
+    if Config().image_upload:
+        try:
+            file_name = f"{os.path.splitext(os.path.basename(image_path))[0]}.jpg"
+            uploaded = get_openai_client().files.create(file=(file_name, jpeg_bytes, "image/jpeg"), purpose="vision")
+            return {"type": "input_image", "file_id": uploaded.id, "detail": "high"}, uploaded.id
+        except Exception as e:
+            logger.warning(f"上传图像失败，改为内嵌base64: {e}")
+
+    base64_image = base64.b64encode(jpeg_bytes).decode('utf-8')
+    return {"type": "input_image", "image_url": f"data:image/jpeg;base64,{base64_image}", "detail": "high"}, None
+
+
+def delete_uploaded_file(file_id):
+    """删除上传的图像，OCR结果已经缓存，图像不再需要；删除失败不影响处理"""
     try:
-        # 创建OCR代理
-        ocr_agent = Agent(
-            name="OCR Agent",
-            instructions="""你是一个专业的OCR文本识别专家。
-请仔细观察图像中的文本内容，并尽可能准确地提取所有文本和表格。
-输出应该保持原始文本的格式和结构，包括格式（加粗、斜体、下划线、表格）、段落和标题。
-针对表格的提取，可以采用markdown的语法来表示，特别注意表格的列数（有些表格首行有空单元格，也要算作一列）
+        get_openai_client().files.delete(file_id)
+    except Exception as e:
+        logger.warning(f"删除上传的图像失败: {file_id}: {e}")
 
-请注意：
-1. 仅提取图像中的实际文本，不要添加任何解释或说明
-2. 保持原始日语文本，不要翻译
-3. 尽可能保持原始格式结构，特别是表格，要准确的提取表格中的所有文字
-4. 忽略所有的纯图形内容（比如：logo，地图等，包括页面上的水印）
-5. 忽略所有的页眉和页脚，但保留原文中每页的页码（如果原文中有），严格按照原文中标注的页码来提取（不论原文是否有错）
-6. 如果遇到空白页或整页都是没有意义的内容，请返回：EMPTY_PAGE
-""",
-            model=config.ocr_model  # 使用专门的OCR模型
-        )
 
-        # 读取图像文件
-        with open(image_path, 'rb') as f:
-            image_data = f.read()
+_agent_loop = None
+_agent_loop_lock = threading.Lock()
+
+
+def get_agent_loop():
+    """所有OpenAI请求共用的事件循环，在后台线程中运行
+
+    各工作线程不再各自创建事件循环，所有请求在同一个线程中异步进行，共用同一个连接池
+    """
+    global _agent_loop
+    with _agent_loop_lock:
+        if _agent_loop is None:
+            _agent_loop = asyncio.new_event_loop()
+            threading.Thread(target=_agent_loop.run_forever, name="agent-loop", daemon=True).start()
+        return _agent_loop
+
+
+@functools.lru_cache(maxsize=1)
+def get_api_semaphore():
+    """限制同时进行的OpenAI请求数（OPENAI_CONCURRENCY），只在共用事件循环中使用"""
+    return asyncio.Semaphore(Config().concurrency)
+
+
+@functools.lru_cache(maxsize=1)
+def get_run_config():
+    """所有代理共用的RunConfig
+
+    不指定时Runner每次运行都会创建新的模型提供者和AsyncOpenAI客户端，无法复用已建立的连接。
+    所有请求都在共用事件循环中进行，因此一个AsyncOpenAI客户端（及其连接池）即可供所有代理使用。
+    重试统一由run_agent_async处理，关闭SDK自身的重试，避免两层重试叠加
+    """
+    return RunConfig(model_provider=OpenAIProvider(openai_client=AsyncOpenAI(max_retries=0)))
+
+
+def is_retryable_error(e):
+    """限流、服务端错误以及网络错误可以重试，其余错误（如400、401）直接抛出"""
+    if isinstance(e, (APIConnectionError, APITimeoutError)):
+        return True
+    if isinstance(e, APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return False
+
+
+async def run_agent_async(agent, input_items, max_attempts=5, base_delay=2):
+    """运行代理，受并发数限制，遇到限流、服务端错误或网络错误时指数退避后重试"""
+    for attempt in range(max_attempts):
+        try:
+            async with get_api_semaphore():
+                return await Runner.run(agent, input_items, run_config=get_run_config())
+        except Exception as e:
+            if attempt == max_attempts - 1 or not is_retryable_error(e):
+                raise
+            delay = base_delay * 2**attempt
+            logger.warning(f"OpenAI请求失败: {e}，{delay}秒后重试...")
+            await asyncio.sleep(delay)
+
+
+def run_agent(agent, input_items):
+    """将请求交给共用事件循环执行，调用线程只等待结果"""
+    return asyncio.run_coroutine_threadsafe(run_agent_async(agent, input_items), get_agent_loop()).result()
+
+
+@functools.lru_cache(maxsize=1)
+def get_ocr_format_agent():
+    """获取OCR并格式化为markdown的代理，只创建一次"""
+    return Agent(name="OCR Markdown Agent", instructions=OCR_FORMAT_INSTRUCTIONS, model=Config().model)
+
 
-        # 编码图像为base64
-        base64_image = base64.b64encode(image_data).decode('utf-8')
+def ocr_to_markdown(image_path):
+    """使用OpenAI Vision模型在一次请求中完成OCR并输出markdown
 
+    以图像内容的哈希为键缓存结果，相同的页面（包括不同PDF中相同的页面）不会重复请求
+    """
+    with open(image_path, 'rb') as f:
+        cache_key = get_cache().make_key(f"openai-ocr-md-{Config().model}-{OCR_PROMPT_VERSION}", f.read())
+    cached_markdown = get_cache().get(cache_key)
+    if cached_markdown is not None:
+        logger.info(f"使用缓存的OCR结果: {os.path.basename(image_path)}")
+        return cached_markdown
+
+    logger.info("使用OpenAI Vision进行OCR并格式化为markdown...")
+    file_id = None
+    try:
+        image_payload, file_id = build_image_payload(image_path)
         input_items: list[TResponseInputItem] = [{
             "role":
             "user",
             "content": [{
                 "type": "input_text",
-                "text": "请识别这个图像中的所有文字内容，保持原始格式。"
-            }, {
-                "type": "input_image",
-                "image_url": f"data:image/png;base64,{base64_image}"
-            }]
+                "text": "请识别这个图像中的所有文字内容，并按照系统提示词中的要求直接输出Markdown。"
+            }, image_payload]
         }]
 
-        # 运行OCR代理
-        result = Runner.run_sync(ocr_agent, input_items)
+        result = run_agent(get_ocr_format_agent(), input_items)
 
         if not result.final_output.strip():
             raise ValueError("OpenAI Vision未能提取任何文本")
 
+        get_cache().put(cache_key, result.final_output)
         return result.final_output
     except Exception as e:
         logger.error(f"OpenAI Vision OCR错误: {e}")
         return None  # 返回None而不是空字符串，表示OCR失败
+    finally:
+        if file_id:
+            delete_uploaded_file(file_id)
 
 
-def format_to_markdown(text_content, image_path):
-    """使用OpenAI格式化OCR文本为markdown"""
-    logger.info("格式化OCR文本为markdown...")
-
-    # 创建格式化代理
-    format_agent = Agent(name="Markdown Formatter",
-                         instructions="""你是一个专业的文本格式化专家。
-请将OCR出来的文本重新组织成Markdown格式。
-输出应该保持原始文本的格式和结构，包括格式（加粗、斜体、下划线、表格）、段落和标题。
-
-请注意：
-1. 保持除非OCR结果有明显的识别错误，否则不要修改OCR结果，更不要添加任何解释或说明，也不要进行归纳总结
-2. 保持原始日语文本，不要翻译
-3. 尽可能保持原始格式结构，特别是表格，要准确的提取不同的
-4. OCR时已经要求忽略页眉、页脚，仅保留原文中的页码，请保持
-   如有原文有页码的话，页码一律独立一行，前后空行，以 【数字 + ページ】 的形式表现
-5. OCR时已经要求忽略所有的纯图形内容（比如：logo，地图等，包括页面上的水印），请保持；特别注意不要以Base64的编码来处理任何纯图形内容
-6. 如果文本中包含大量无意义的信息，请删除他们
-7. 对于像目录这样的内容，可能会包含大量的「..........」或事「-------------」这样的符号，如果只是为了表达页码的话请将其长度现在6个点也就是「......」
-8. 如果有URL信息，请保持完整的URL信息，但不要用Markdown的链接格式来处理URL，保留纯文本状态即可
-9. 如果遇到空白页或整页都是没有意义的内容，请返回：EMPTY_PAGE
-10. 结果会被直接保存为md文件，所以请不要添加任何```markdown```之类的定界符
+def text_to_markdown(text_path):
+    """将PDF文本层中提取的一页文字整理为markdown，无需发送图像
 
-关于Markdown的语法格式，特别注意以下要求：
-1. 表格前后的空行要保留
-2. 列表前后的空行要保留
-3. 标题前后的空行要保留
-4. 表格的排版（特别是合并单元格）要与原文（图片）完全一致
-5. 根据Markdown的语法，需要添加空格的地方，请务必添加空格；但不要在表格的单元格内填充大量的空格，需要的话填充一个空格即可
-总之，要严格的践行Markdown的语法要求，不要只是看上去像，其实有不少语法错误
-""",
-                         model=Config().model)
+    以文字内容的哈希为键缓存结果
+    """
+    with open(text_path, 'r', encoding='utf-8') as f:
+        page_text = f.read()
+    cache_key = get_cache().make_key(f"openai-text-md-{Config().model}-{OCR_PROMPT_VERSION}", page_text)
+    cached_markdown = get_cache().get(cache_key)
+    if cached_markdown is not None:
+        logger.info(f"使用缓存的格式化结果: {os.path.basename(text_path)}")
+        return cached_markdown
+
+    logger.info("使用OpenAI将文本层格式化为markdown...")
+    try:
+        input_items = [{"role": "user", "content": f"""以下是从PDF的文本层中按版面提取的一页文字，请将其视为页面中的文字内容，并按照系统提示词中的要求直接输出Markdown：
 
-    # 读取图像文件
-    with open(image_path, 'rb') as f:
-        image_data = f.read()
-
-    # 编码图像为base64
-    base64_image = base64.b64encode(image_data).decode('utf-8')
-
-    input_items = [{
-        "role":
-        "user",
-        "content": [{
-            "type": "input_text",
-            "text": f"请将以下OCR文本重新组织成Markdown格式：\n\n{text_content} \n\n-----------\n\n务必尊从系统提示词中的要求来进行格式化。"
-        }, {
-            "type": "input_image",
-            "image_url": f"data:image/png;base64,{base64_image}"
-        }]
-    }]
+{page_text}"""}]
 
-    # 运行格式化代理
-    result = Runner.run_sync(format_agent, input_items)
+        result = run_agent(get_ocr_format_agent(), input_items)
 
-    return result.final_output
+        if not result.final_output.strip():
+            raise ValueError("未能从文本层生成任何内容")
 
+        get_cache().put(cache_key, result.final_output)
+        return result.final_output
+    except Exception as e:
+        logger.error(f"文本层格式化错误: {e}")
+        return None
 
-def translate_markdown(md_content):
-    """使用OpenAI翻译日语Markdown内容为中文"""
-    logger.info("翻译Markdown内容为中文...")
 
-    # 创建翻译代理
+@functools.lru_cache(maxsize=1)
+def get_translator_agent():
+    """获取翻译代理，只创建一次"""
     config = Config()
-    translator_agent = Agent(name="Translator",
-                             instructions=f"""你是一位专业的日语翻译专家，擅长将日语文本翻译成中文。
+    return Agent(name="Translator",
+                 instructions=f"""你是一位专业的日语翻译专家，擅长将日语文本翻译成中文。
 请将用户输入的日语Markdown文本翻译成中文，要求：
 1. 保持原有的Markdown格式，标题、列表、表格、段落等格式要与原文完全一致
 2. 翻译要准确、通顺，符合中文表达习惯
@@ -244,7 +482,47 @@ def translate_markdown(md_content):
 
 {config.translate_terms}
 """,
-                             model=config.model)
+                 model=config.model)
+
+
+def split_markdown(md_content, chunk_size):
+    """按空行（页面之间也以空行分隔）将markdown切分为不超过chunk_size个字符的段，单个段落过长时单独成段"""
+    chunks = []
+    current = []
+    current_len = 0
+    for paragraph in md_content.split('\n\n'):
+        if current and current_len + len(paragraph) + 2 > chunk_size:
+            chunks.append('\n\n'.join(current))
+            current = []
+            current_len = 0
+        current.append(paragraph)
+        current_len += len(paragraph) + 2
+    chunks.append('\n\n'.join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def translate_markdown(md_content):
+    """使用OpenAI翻译日语Markdown内容为中文，长文档分段并发翻译"""
+    config = Config()
+    chunks = split_markdown(md_content, config.translate_chunk_size)
+    if len(chunks) <= 1:
+        return translate_chunk(md_content)
+
+    logger.info(f"文档较长，分为 {len(chunks)} 段并发翻译")
+    with ThreadPoolExecutor(max_workers=config.concurrency) as executor:
+        return '\n\n'.join(executor.map(translate_chunk, chunks))
+
+
+def translate_chunk(md_content):
+    """翻译一段日语Markdown，以原文的哈希为键缓存译文，内容未变化的段落不会重复翻译"""
+    cache_key = get_cache().make_key(f"openai-translate-{Config().model}-{TRANSLATE_PROMPT_VERSION}", Config().translate_terms, md_content)
+    cached_translation = get_cache().get(cache_key)
+    if cached_translation is not None:
+        logger.info("使用缓存的译文")
+        return cached_translation
+
+    logger.info("翻译Markdown内容为中文...")
+
     input_items = [{"role": "user", "content": f"""请将以下日语Markdown文本翻译成中文：
 
 {md_content}
@@ -254,18 +532,17 @@ def translate_markdown(md_content):
 请直接返回翻译结果。务必尊从系统提示词中的要求来进行翻译。"""}]
 
     # 运行翻译代理
-    result = Runner.run_sync(translator_agent, input_items)
+    result = run_agent(get_translator_agent(), input_items)
 
+    get_cache().put(cache_key, result.final_output)
     return result.final_output
 
 
-def analyze_admission_info(md_content):
-    """使用OpenAI分析招生信息"""
-    logger.info("分析招生信息...")
-
-    # 创建分析代理
-    analyze_agent = Agent(name="Admission Analyzer",
-                          instructions="""你是一位专业的大学招生信息分析专家，擅长分析大学招生信息。
+@functools.lru_cache(maxsize=1)
+def get_analyze_agent():
+    """获取招生信息分析代理，只创建一次"""
+    return Agent(name="Admission Analyzer",
+                 instructions="""你是一位专业的大学招生信息分析专家，擅长分析大学招生信息。
 请根据输入的Markdown文本进行分析并提取以下信息，以JSON格式返回。
 
 请严格按照以下JSON格式返回（必须是合法的JSON格式，不要添加任何其他说明文字）：
@@ -274,26 +551,36 @@ def analyze_admission_info(md_content):
     "报名截止日期": "YYYY/MM/DD格式，如果有多个日期选择最晚的，无法确认则返回2099/01/01"
 }
 """,
-                          model=Config().model)
+                 model=Config().model)
+
+
+def extract_json_text(text):
+    """模型返回的内容不是纯JSON时，取出第一个{到最后一个}之间的部分，找不到时返回None"""
+    start = text.find('{')
+    end = text.rfind('}')
+    if start == -1 or end < start:
+        return None
+    return text[start:end + 1]
+
+
+def analyze_admission_info(md_content):
+    """使用OpenAI分析招生信息"""
+    logger.info("分析招生信息...")
 
     input_items = [{"role": "user", "content": md_content + "\n\n请确保返回的是合法的JSON格式，不要包含任何其他说明文字。"}]
 
     # 运行分析代理
-    result = Runner.run_sync(analyze_agent, input_items)
+    result = run_agent(get_analyze_agent(), input_items)
 
-    # 尝试解析JSON
+    # 尝试解析JSON，返回解析后的dict
     try:
-        json.loads(result.final_output)
-        return result.final_output
+        return json.loads(result.final_output)
     except json.JSONDecodeError:
         # 如果不是有效的JSON，尝试提取JSON部分
-        import re
-        json_match = re.search(r'\{.*\}', result.final_output, re.DOTALL)
-        if json_match:
-            json_str = json_match.group()
+        json_text = extract_json_text(result.final_output)
+        if json_text:
             try:
-                json.loads(json_str)
-                return json_str
+                return json.loads(json_text)
             except json.JSONDecodeError:
                 logger.error(f"无法提取有效的JSON: {result.final_output}")
                 return None
@@ -302,14 +589,56 @@ def analyze_admission_info(md_content):
             return None
 
 
+def process_page(img, output_folder):
+    """OCR单个页面并保存为markdown
+
+    Returns:
+        str: 页面的markdown，OCR失败或出错时返回None
+    """
+    img_name = os.path.basename(img)
+    md_file = os.path.join(output_folder, f"{os.path.splitext(img_name)[0]}.md")
+    logger.info(f'处理 {img_name}...')
+    try:
+        if img.endswith('.txt'):
+            markdown_output = text_to_markdown(img)
+        else:
+            markdown_output = ocr_to_markdown(img)
+        if markdown_output is None:  # OCR失败
+            logger.error(f"OCR失败: {img_name}")
+            return None
+
+        if markdown_output:
+            # 保存单个页面的markdown
+            with open(md_file, 'w', encoding='utf-8') as f:
+                f.write(markdown_output)
+        return markdown_output
+    except Exception as e:
+        logger.error(f"处理 {img} 时出错: {e}")
+        if os.path.exists(md_file):
+            os.remove(md_file)
+        return None  # 捕获异常后继续处理其他页面，而不是直接引发异常
+
+
+def read_page_md(page_source):
+    """读取页面对应的已有markdown（scan_{序号}.md），不存在或为空时返回None"""
+    try:
+        with open(f"{os.path.splitext(page_source)[0]}.md", 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def render_page(page_source, output_folder):
+    """优先使用已有的单页markdown，没有时才处理该页面"""
+    return read_page_md(page_source) or process_page(page_source, output_folder)
+
+
 def sanitize_filename(filename):
     """净化文件名，替换无效字符"""
-    # 将日期中的斜杠替换为破折号
-    filename = filename.replace('/', '-')
-    # 替换空格和其他特殊字符
-    filename = filename.replace(' ', '_')
-    filename = ''.join(c for c in filename if c.isalnum() or c in '_-')
-    return filename
+    # 将日期中的斜杠替换为破折号，空格替换为下划线
+    filename = filename.translate(FILENAME_REPLACE_TABLE)
+    # 删除其他特殊字符
+    return FILENAME_INVALID_PATTERN.sub('', filename)
 
 
 def process_single_pdf(pdf_path, output_base_folder, resume_dir=None):
@@ -334,75 +663,85 @@ def process_single_pdf(pdf_path, output_base_folder, resume_dir=None):
     
         pdf_path = os.path.join(output_folder, os.path.basename(pdf_path))
 
-        # 在恢复模式下，检查是否需要重新进行PDF转图片
-        log_file = os.path.join(output_folder, 'pdf2md.log')
-        need_convert = True
-        if resume_dir and os.path.exists(log_file):
-            logger.info(f'发现日志文件：{log_file}')
-            with open(log_file, 'r', encoding='utf-8') as f:
-                log_content = f.read()
-                if "Conversion completed" in log_content:
-                    need_convert = False
+        # 在恢复模式下，根据state.json检查是否需要重新进行PDF转图片
+        state = load_state(output_folder) if resume_dir else None
+        need_convert = state is None or len(state.get('png_done', [])) != state.get('pages_total')
+        if state is not None and not need_convert:
+            logger.info(f'发现处理进度：{os.path.join(output_folder, STATE_FILE_NAME)}')
 
         # 如果需要，将PDF转换为图像
         if need_convert:
-            logger.info(f'正在将 {pdf_path} 转换为图像...')
-            images = convert_pdf_to_images(pdf_path, config.dpi)  # 使用配置的DPI
-            save_images_with_progress(images, output_folder)
-
-            # 记录转换日志
-            with open(log_file, 'w', encoding='utf-8') as f:
-                f.write(f"PDF: {pdf_path}\n")
-                f.write(f"Total pages: {len(images)}\n")
-                f.write("Conversion completed\n")
+            # 清理上次中断时残留的页面输入，避免同一页同时存在.txt和.png
+            for page_source in scan_page_sources(output_folder):
+                os.remove(page_source)
+            # 带有文本层的PDF直接使用文本层，只对扫描页进行栅格化
+            pages_total = prepare_text_layer(pdf_path, config.dpi, output_folder, config.text_layer_ratio)
+            if pages_total is None:
+                logger.info(f'正在将 {pdf_path} 转换为图像...')
+                pages_total = convert_pdf_to_images(pdf_path, config.dpi, output_folder)  # 使用配置的DPI
+
+            # 记录转换进度
+            state = {
+                "pdf": os.path.basename(pdf_path),
+                "pages_total": pages_total,
+                "png_done": list(range(pages_total)),
+                "md_done": [],
+                "translated": False,
+                "analyzed": False,
+            }
+            save_state(output_folder, state)
+        md_done = set(state.get('md_done', []))
 
         # 将图片处理为markdown
         logger.info('正在处理图像生成markdown...')
-        image_files = natsorted(glob.glob(f'{output_folder}/*.png'))
-        md_content = ""
+        image_files = scan_page_sources(output_folder)
+        per_page_md = [None] * len(image_files)
+        pending_pages = []
         need_translate = False
         ocr_error_count = 0  # 添加OCR错误计数
 
-        for img in image_files:
+        for i, img in enumerate(image_files):
             img_name = os.path.basename(img)
             md_file = os.path.join(output_folder, f"{os.path.splitext(img_name)[0]}.md")
 
-            # 检查是否需要重新处理该页面
-            need_process = True
-            if os.path.exists(md_file):
+            # 检查是否需要重新处理该页面，一次stat同时判断文件是否存在和是否为空，空文件无需打开
+            try:
+                md_size = os.stat(md_file).st_size
+            except FileNotFoundError:
+                md_size = None
+            if md_size:
                 with open(md_file, 'r', encoding='utf-8') as f:
                     content = f.read().strip()
-                    if content and len(content) > 0:  # 如果文件不为空
-                        need_process = False
-                        md_content += content + '\n\n'
-                        logger.info(f'使用现有markdown: {img_name}')
-                    else:
-                        os.remove(md_file)  # 删除空的markdown文件
-                        logger.info(f'删除空的markdown文件: {img_name}')
-
-            if need_process:
-                logger.info(f'处理 {img_name}...')
-                try:
-                    text_content = perform_ocr(img)
-                    if text_content is None:  # OCR失败
-                        logger.error(f"OCR失败: {img_name}")
+                if content:  # 如果文件不只有空白
+                    per_page_md[i] = content
+                    md_done.add(page_index(img_name))
+                    logger.info(f'使用现有markdown: {img_name}')
+                    continue
+            if md_size is not None:
+                os.remove(md_file)  # 删除空的markdown文件
+                logger.info(f'删除空的markdown文件: {img_name}')
+            pending_pages.append(i)
+
+        # 需要处理的页面并发请求，结果按页码顺序放回
+        if pending_pages:
+            with ThreadPoolExecutor(max_workers=config.concurrency) as executor:
+                futures = {executor.submit(process_page, image_files[i], output_folder): i for i in pending_pages}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    markdown_output = future.result()
+                    if markdown_output is None:
                         ocr_error_count += 1
-                        continue  # 跳过此图像的后续处理
-
-                    markdown_output = format_to_markdown(text_content, img)
-
+                        continue
                     if markdown_output:
-                        # 保存单个页面的markdown
-                        with open(md_file, 'w', encoding='utf-8') as f:
-                            f.write(markdown_output)
-                        md_content += markdown_output + '\n\n'
+                        per_page_md[i] = markdown_output
                         need_translate = True  # 只要有过处理痕迹，就需要翻译
-                except Exception as e:
-                    logger.error(f"处理 {img} 时出错: {e}")
-                    ocr_error_count += 1
-                    if os.path.exists(md_file):
-                        os.remove(md_file)
-                    continue  # 捕获异常后继续处理下一个图像，而不是直接引发异常
+                        md_done.add(page_index(os.path.basename(image_files[i])))
+                        state.update(md_done=sorted(md_done), translated=False, analyzed=False)
+                        save_state(output_folder, state)
+
+        state['md_done'] = sorted(md_done)
+        save_state(output_folder, state)
+        md_content = ''.join(page_md + '\n\n' for page_md in per_page_md if page_md)
 
         # 检查是否所有页面都OCR失败
         if ocr_error_count == len(image_files):
@@ -423,9 +762,16 @@ def process_single_pdf(pdf_path, output_base_folder, resume_dir=None):
             return False
 
         # 分析招生信息
-        logger.info('分析招生信息...')
-        info = analyze_admission_info(md_content)
-        if info is None:
+        if state.get('analyzed') and not need_translate:
+            # 页面没有变化，直接使用上次的分析结果
+            info_dict = state.get('admission_info')
+        else:
+            logger.info('分析招生信息...')
+            info_dict = analyze_admission_info(md_content)
+            if info_dict is not None:
+                state.update(analyzed=True, admission_info=info_dict)
+                save_state(output_folder, state)
+        if info_dict is None:
             # 将output_folder重命名为：{output_folder}_can_not_analyze
             new_folder_name = f'{output_folder}_can_not_analyze'
             new_folder_path = os.path.join(output_base_folder, new_folder_name)
@@ -434,7 +780,6 @@ def process_single_pdf(pdf_path, output_base_folder, resume_dir=None):
             return False
         else:
             try:
-                info_dict = json.loads(info)
                 new_folder_name = sanitize_filename(f"{info_dict['大学名称']}_{info_dict['报名截止日期']}")
                 new_folder_path = os.path.join(output_base_folder, new_folder_name)
                 base_name = sanitize_filename(f"{info_dict['大学名称']}_{info_dict['报名截止日期']}")
@@ -446,12 +791,13 @@ def process_single_pdf(pdf_path, output_base_folder, resume_dir=None):
 
                 # 检查是否需要重新翻译
                 zh_md_path = os.path.join(output_folder, f'{base_name}_中文.md')
-                if os.path.exists(zh_md_path):
+                if state.get('translated') and not need_translate and os.path.exists(zh_md_path):
+                    logger.info(f'中文版本已是最新: {zh_md_path}')
+                elif os.path.exists(zh_md_path):
                     logger.info(f'找到中文版本: {zh_md_path}, 比较行数...')
                     # 比较中文版和日文版的行数
-                    with open(zh_md_path, 'r', encoding='utf-8') as f:
-                        zh_lines = len([line for line in f if line.strip()])
-                    jp_lines = len([line for line in md_content.split('\n') if line.strip()])
+                    zh_lines = _count_nonempty_lines(zh_md_path)
+                    jp_lines = _count_nonempty_text_lines(md_content)
 
                     # 计算行数差异百分比
                     line_diff_percent = abs(zh_lines - jp_lines) / max(zh_lines + 1, jp_lines + 1) * 100
@@ -460,6 +806,8 @@ def process_single_pdf(pdf_path, output_base_folder, resume_dir=None):
                         need_translate = True
                     else:
                         logger.info(f'中文版与日文版行数差异在允许范围内（{line_diff_percent:.1f}%），无需重新翻译')
+                        state['translated'] = True
+                        save_state(output_folder, state)
                 else:
                     need_translate = True
 
@@ -470,6 +818,8 @@ def process_single_pdf(pdf_path, output_base_folder, resume_dir=None):
                     if zh_content:
                         with open(zh_md_path, 'w', encoding='utf-8') as f:
                             f.write(zh_content)
+                        state['translated'] = True
+                        save_state(output_folder, state)
 
                 # 重命名文件夹和PDF
                 os.rename(output_folder, new_folder_path)
@@ -488,7 +838,6 @@ def process_single_pdf(pdf_path, output_base_folder, resume_dir=None):
 
 
 def workflow(pdf_folder=None, resume_dir=None):
-    load_dotenv(override=True)
     config = Config()
 
     if resume_dir:
@@ -496,33 +845,37 @@ def workflow(pdf_folder=None, resume_dir=None):
         # 在恢复模式下，直接使用resume_dir作为输出目录
         output_folder = resume_dir
         # 获取所有一级子目录
-        subdirs = [d for d in os.listdir(resume_dir) if os.path.isdir(os.path.join(resume_dir, d))]
+        subdirs = scan_subdirs(resume_dir)
 
         logger.info(f'找到 {len(subdirs)} 个目录需要处理')
         processed_dirs = 0
         valid_handbooks = 0
         total_pages = 0
 
+        pdf_paths = []
         for subdir in subdirs:
             subdir_path = os.path.join(resume_dir, subdir)
-            logger.info(f'\n处理目录: {subdir}...')
 
             # 查找该目录下的PDF文件
-            pdf_files = [f for f in os.listdir(subdir_path) if f.endswith('.pdf')]
+            pdf_files = [entry.name for entry in scan_files(subdir_path, '.pdf')]
             if not pdf_files:
                 logger.warning(f'在 {subdir} 中未找到PDF文件，跳过...')
                 continue
 
             # 统计页面数（通过PNG文件数量）
-            total_pages += len([f for f in os.listdir(subdir_path) if f.endswith('.png')])
+            total_pages += len(scan_page_sources(subdir_path))
 
-            pdf_path = os.path.join(subdir_path, pdf_files[0])  # 只处理这个文件夹下第一个（理论上是唯一的）的PDF文件
-            # 处理这个PDF文件，包括具体的resume逻辑也都在这里
-            if process_single_pdf(pdf_path, output_folder, resume_dir=resume_dir):
-                valid_handbooks += 1
-            processed_dirs += 1
+            pdf_paths.append(os.path.join(subdir_path, pdf_files[0]))  # 只处理这个文件夹下第一个（理论上是唯一的）的PDF文件
 
-            logger.info(f'进度: {processed_dirs}/{len(subdirs)} 个目录已处理')
+        # 多个PDF并发处理，包括具体的resume逻辑也都在process_single_pdf中
+        with ThreadPoolExecutor(max_workers=config.pdf_concurrency) as executor:
+            futures = {executor.submit(process_single_pdf, pdf_path, output_folder, resume_dir): pdf_path for pdf_path in pdf_paths}
+            for future in as_completed(futures):
+                if future.result():
+                    valid_handbooks += 1
+                processed_dirs += 1
+
+                logger.info(f'进度: {processed_dirs}/{len(pdf_paths)} 个目录已处理（{os.path.basename(futures[future])}）')
 
         logger.info('\n处理完成:')
         logger.info(f'总共处理的目录数: {processed_dirs}')
@@ -537,7 +890,7 @@ def workflow(pdf_folder=None, resume_dir=None):
         os.makedirs(output_folder, exist_ok=True)
 
         # 获取所有PDF文件
-        pdf_files = glob.glob(os.path.join(pdf_folder, '*.pdf'))
+        pdf_files = [entry.path for entry in scan_files(pdf_folder, '.pdf')]
         total_pdfs = len(pdf_files)
         processed_pdfs = 0
         valid_handbooks = 0
@@ -546,15 +899,18 @@ def workflow(pdf_folder=None, resume_dir=None):
         logger.info(f'找到 {total_pdfs} 个PDF文件')
 
         for pdf_path in pdf_files:
-            logger.info(f'\n处理 {os.path.basename(pdf_path)}...')
-            images = convert_pdf_to_images(pdf_path, config.dpi)  # 使用配置的DPI
-            total_pages += len(images)
+            # 只读取PDF信息获取页数，不做转换
+            total_pages += pdfinfo_from_path(pdf_path)["Pages"]
 
-            if process_single_pdf(pdf_path, output_folder):
-                valid_handbooks += 1
-            processed_pdfs += 1
+        # 多个PDF并发处理
+        with ThreadPoolExecutor(max_workers=config.pdf_concurrency) as executor:
+            futures = {executor.submit(process_single_pdf, pdf_path, output_folder): pdf_path for pdf_path in pdf_files}
+            for future in as_completed(futures):
+                if future.result():
+                    valid_handbooks += 1
+                processed_pdfs += 1
 
-            logger.info(f'进度: {processed_pdfs}/{total_pdfs} 个PDF已处理，找到 {valid_handbooks} 个有效手册')
+                logger.info(f'进度: {processed_pdfs}/{total_pdfs} 个PDF已处理（{os.path.basename(futures[future])}），找到 {valid_handbooks} 个有效手册')
 
         logger.info('\n处理完成:')
         logger.info(f'总共处理的PDF数: {processed_pdfs}')
@@ -563,17 +919,27 @@ def workflow(pdf_folder=None, resume_dir=None):
         logger.info(f'输出文件夹: {output_folder}')
 
 
+def _count_nonempty_lines(path):
+    """逐行统计文件中的非空行数，不将整个文件读入内存"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return sum(1 for line in f if line.strip())
+
+
+def _count_nonempty_text_lines(text):
+    """统计字符串中的非空行数，不生成行列表"""
+    return sum(1 for line in text.splitlines() if line.strip())
+
+
 def review_workflow(output_folder):
     """检查并修复已处理的结果目录
     
     Args:
         output_folder (str): 包含处理结果的目录路径
     """
-    load_dotenv(override=True)
     config = Config()  # 创建Config实例
 
     # 获取所有子目录（大学文件夹）
-    subdirs = [d for d in os.listdir(output_folder) if os.path.isdir(os.path.join(output_folder, d))]
+    subdirs = scan_subdirs(output_folder)
 
     # 处理统计
     total_dirs = len(subdirs)
@@ -590,9 +956,12 @@ def review_workflow(output_folder):
         logger.info(f'\n检查目录 ({processed_dirs}/{total_dirs}): {subdir}')
 
         # 查找相关文件
-        pdf_files = [f for f in os.listdir(subdir_path) if f.endswith('.pdf')]
-        md_files = [f for f in os.listdir(subdir_path) if f.endswith('.md') and not f.endswith('中文.md')]
-        zh_md_files = [f for f in os.listdir(subdir_path) if f.endswith('中文.md')]
+        with os.scandir(subdir_path) as it:
+            file_names = [entry.name for entry in it if entry.is_file()]
+        pdf_files = [f for f in file_names if f.endswith('.pdf')]
+        # 单页markdown（scan_{序号}.md）不是整本的日文md
+        md_files = [f for f in file_names if f.endswith('.md') and not f.endswith('中文.md') and not f.startswith('scan_')]
+        zh_md_files = [f for f in file_names if f.endswith('中文.md')]
 
         if not pdf_files:
             logger.warning(f'警告：目录 {subdir} 中未找到PDF文件，跳过处理')
@@ -605,33 +974,24 @@ def review_workflow(output_folder):
         jp_line_count = 0
         if md_files:
             md_path = os.path.join(subdir_path, md_files[0])
-            with open(md_path, 'r', encoding='utf-8') as f:
-                md_content = f.read()
-                jp_lines = md_content.split('\n')
-                jp_line_count = len(jp_lines)
-                if jp_line_count >= 10:  # 仍然保留最小行数检查
-                    needs_md_regeneration = False
+            jp_line_count = _count_nonempty_lines(md_path)
+            if jp_line_count >= 10:  # 仍然保留最小行数检查
+                needs_md_regeneration = False
 
         # 如果需要重新生成日文md
         if needs_md_regeneration:
             logger.info('重新生成日文Markdown文件...')
-            # 转换PDF到图片
-            images = convert_pdf_to_images(pdf_path, config.dpi)
-
-            # 保存图片
-            for i, image in enumerate(images):
-                image.save(os.path.join(subdir_path, f'scan_{i}.png'), 'PNG')
-
-            # 处理图片生成markdown
-            md_content = ""
-            image_files = natsorted(glob.glob(f'{subdir_path}/*.png'))
-
-            for img in image_files:
-                logger.info(f'处理图片 {os.path.basename(img)}...')
-                text_content = perform_ocr(img)
-                markdown_output = format_to_markdown(text_content, img)
-                if markdown_output:
-                    md_content += markdown_output + '\n\n'
+            # 重新生成页面输入（带有文本层的页面直接使用文本层）
+            for page_source in scan_page_sources(subdir_path):
+                os.remove(page_source)
+            if prepare_text_layer(pdf_path, config.dpi, subdir_path, config.text_layer_ratio) is None:
+                convert_pdf_to_images(pdf_path, config.dpi, subdir_path)
+
+            # 已有单页markdown的页面直接使用，其余页面并发处理，结果按页码顺序拼接
+            page_sources = scan_page_sources(subdir_path)
+            with ThreadPoolExecutor(max_workers=config.concurrency) as executor:
+                page_mds = list(executor.map(functools.partial(render_page, output_folder=subdir_path), page_sources))
+            md_content = ''.join(page_md + '\n\n' for page_md in page_mds if page_md)
 
             # 保存新的markdown文件
             if md_content:
@@ -639,8 +999,8 @@ def review_workflow(output_folder):
                 with open(new_md_path, 'w', encoding='utf-8') as f:
                     f.write(md_content)
                 regenerated_md += 1
-                # 更新日文行数
-                jp_line_count = len(md_content.split('\n'))
+                # 更新日文行数，直接统计内存中的内容，无需重新读取刚写入的文件
+                jp_line_count = _count_nonempty_text_lines(md_content)
             else:
                 logger.warning('警告：无法生成Markdown内容')
                 continue
@@ -649,24 +1009,24 @@ def review_workflow(output_folder):
         needs_translation = True
         if zh_md_files and jp_line_count > 0:  # 确保有日文文件作为参考
             zh_md_path = os.path.join(subdir_path, zh_md_files[0])
-            with open(zh_md_path, 'r', encoding='utf-8') as f:
-                zh_content = f.read()
-                zh_line_count = len(zh_content.split('\n'))
+            zh_line_count = _count_nonempty_lines(zh_md_path)
 
-                # 计算行数差异百分比
-                line_diff_percentage = abs(zh_line_count - jp_line_count) / jp_line_count * 100
+            # 计算行数差异百分比
+            line_diff_percentage = abs(zh_line_count - jp_line_count) / jp_line_count * 100
 
-                if line_diff_percentage <= 20:  # 允许20%的行数差异
-                    needs_translation = False
-                else:
-                    logger.warning(f'中文译文行数差异过大：日文 {jp_line_count} 行，中文 {zh_line_count} 行，差异 {line_diff_percentage:.1f}%')
-                    translation_line_diff_issues += 1
+            if line_diff_percentage <= 20:  # 允许20%的行数差异
+                needs_translation = False
+            else:
+                logger.warning(f'中文译文行数差异过大：日文 {jp_line_count} 行，中文 {zh_line_count} 行，差异 {line_diff_percentage:.1f}%')
+                translation_line_diff_issues += 1
 
         # 如果需要重新翻译
         if needs_translation:
             logger.info('重新生成中文翻译...')
             # 读取最新的日文md内容
-            current_md_files = [f for f in os.listdir(subdir_path) if f.endswith('.md') and not f.endswith('中文.md')]
+            current_md_files = [
+                entry.name for entry in scan_files(subdir_path, '.md') if not entry.name.endswith('中文.md') and not entry.name.startswith('scan_')
+            ]
             if not current_md_files:
                 logger.warning('警告：未找到日文Markdown文件，跳过翻译')
                 continue
@@ -686,9 +1046,9 @@ def review_workflow(output_folder):
             else:
                 logger.warning('警告：翻译失败')
 
-        # 清理临时图片文件
-        for img in glob.glob(f'{subdir_path}/scan_*.png'):
-            os.remove(img)
+        # 清理临时的页面输入（图片和文本层）
+        for page_source in scan_page_sources(subdir_path):
+            os.remove(page_source)
 
     # 生成报告
     logger.info('\n=== Review 处理报告 ===')
@@ -705,6 +1065,9 @@ if __name__ == '__main__':
     parser.add_argument('--resume', help='恢复之前中断的工作，指定输出目录路径')
     args = parser.parse_args()
 
+    # 只在启动时加载一次.env，之后Config单例直接使用环境变量
+    load_dotenv(override=True)
+
     if args.resume:
         if not os.path.isdir(args.resume):
             logger.error(f'错误: 恢复目录 {args.resume} 不是一个目录')
@@ -1,6 +1,7 @@
 import argparse
 import sys
 from autogen import ConversableAgent, GroupChat, GroupChatManager, UserProxyAgent, register_function
+from autogen.io import IOConsole, IOStream
 import datetime
 import os
 import glob
@@ -61,6 +62,18 @@ def setup_logger():
     logger.addHandler(file_handler)
     logger.addHandler(console_handler)
 
+class FileIOStream(IOConsole):
+    """将autogen的对话输出写入文件
+
+    通过IOStream.set_default设置，只对当前上下文生效，不需要替换全局的sys.stdout
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def print(self, *objects, sep=" ", end="\n", flush=False):
+        print(*objects, sep=sep, end=end, file=self.file, flush=flush)
+
 def load_markdown_file(markdown_file_path: str) -> str:
     """
     Load the content of a markdown file.
@@ -89,7 +102,7 @@ def save_report_to_file(report_content: str, report_file_path: str) -> str:
         report_content (str): The content of the report.
         report_file_path (str): The path to the report markdown file.
     """
-    print(f"save_report_to_file - report_file_path: {report_file_path}")
+    IOStream.get_default().print(f"save_report_to_file - report_file_path: {report_file_path}")
     
     # 根据report_file_path，获取report_file_path的完全路径
     report_file_path = os.path.abspath(report_file_path)
@@ -239,15 +252,13 @@ def main(base_folder: str, output_file_path: str) -> None:
         report_file_path = {output_file_path}
         """
         std_output_file = f"output_{os.path.basename(markdown_file_path)}_{datetime.datetime.now().strftime("%Y%m%d%H%M%S")}.txt"
-        sys.stdout = open(std_output_file, "w")
         try:
-            user_proxy.initiate_chat(
-                recipient=manager,
-                message=task
-            )
-            
-            sys.stdout.close()
-            sys.stdout = sys.__stdout__
+            # autogen的对话输出写入std_output_file，日志和其他输出不受影响
+            with open(std_output_file, "w", encoding="utf-8") as std_output, IOStream.set_default(FileIOStream(std_output)):
+                user_proxy.initiate_chat(
+                    recipient=manager,
+                    message=task
+                )
             
             logger.info(f"完成：{markdown_file_path}")
             if os.getenv("LOG_LEVEL") == "INFO":
@@ -256,9 +267,6 @@ def main(base_folder: str, output_file_path: str) -> None:
                 logger.info(f"删除：{std_output_file}")
                 
         except Exception as e:
-            sys.stdout.close()
-            sys.stdout = sys.__stdout__
-            
             logger.error(f"未能完成: {markdown_file_path} 的分析，发生错误: {e}")
             
 if __name__ == "__main__":
@@ -1,11 +1,18 @@
 """
 配置管理模块
 """
+import functools
 import os
 from dotenv import load_dotenv
 from autogen import LLMConfig
 
 
+@functools.lru_cache(maxsize=None)
+def load_llm_config_file(llm_config_path: str) -> LLMConfig:
+    """读取并解析LLM配置文件，同一路径只解析一次（where()返回新的对象，不会修改缓存的配置）"""
+    return LLMConfig.from_json(path=llm_config_path)
+
+
 class ServiceConfig:
     """配置类，用于管理所有配置信息"""
 
@@ -34,4 +41,4 @@ class ServiceConfig:
             LLMConfig: 加载的LLM配置对象
         """
         filter_dict = {"tags": [model_tag]}
-        return LLMConfig.from_json(path=self.llm_config_path).where(**filter_dict)
+        return load_llm_config_file(self.llm_config_path).where(**filter_dict)
@@ -1,7 +1,9 @@
 import os
 import time
 
-from agents import Agent, Runner
+from agents import Agent
+from llm_cache import llm_cache
+from llm_runner import run_sync
 from logging_config import setup_logger
 
 logger = setup_logger(logger_name="AnalysisTool", log_level="INFO")
@@ -22,12 +24,8 @@ class AnalysisTool:
         self.analysis_questions = analysis_questions
         self.translate_terms = translate_terms
 
-    def _analyze_markdown(self, md_content: str) -> str:
-        """使用OpenAI分析Markdown内容"""
-        logger.info("分析Markdown内容...")
-
-        analyzer_agent = Agent(name="Markdown_Analyzer_Agent",
-                               instructions=f"""你是一位严谨的日本留学信息专家,你根据用户最初输入的完整Markdown内容继续以下工作流：
+        self.analyzer_agent = Agent(name="Markdown_Analyzer_Agent",
+                                    instructions=f"""你是一位严谨的日本留学信息专家,你根据用户最初输入的完整Markdown内容继续以下工作流：
 0. Markdown原文可能很长，因为有些Markdown包含了大量和留学生入学无关的信息，可以先将这部分信息排除再进行分析
  - 但是要注意，有些学校可能不会直接使用'外国人留学生'这样的说法，但他们事实上招收留学生，如：
    - 允许没有日本国籍的人报名
@@ -54,25 +52,10 @@ class AnalysisTool:
 
 {self.translate_terms}
 """,
-                               model=self.model_name)
-
-        input_items = [{"role": "user", "content": f"""请根据以下Markdown内容进行分析：
+                                    model=self.model_name)
 
-{md_content}
-
------------
-
-请直接返回分析结果。务必尊从系统提示词中的要求来进行分析。"""}]
-
-        result = Runner.run_sync(analyzer_agent, input_items)
-        return result.final_output
-
-    def _review_analysis(self, md_content: str, analysis_result: str) -> str:
-        """使用OpenAI审核分析结果"""
-        logger.info("审核分析结果...")
-
-        review_agent = Agent(name="Review_Agent",
-                             instructions=f"""你是一位严谨的校对人员,你根据用户输入的Markdown原文对用户输入的分析结果进行校对。
+        self.review_agent = Agent(name="Review_Agent",
+                                  instructions=f"""你是一位严谨的校对人员,你根据用户输入的Markdown原文对用户输入的分析结果进行校对。
 你的工作流程如下：
 0. Markdown原文可能很长，因为有些Markdown包含了大量和留学生入学无关的信息，可以先将这部分信息排除再进行分析
 1. 逐一核对,针对其中不相符的情况直接对分析结果进行修正。
@@ -89,32 +72,10 @@ class AnalysisTool:
 
 {self.translate_terms}
 """,
-                             model=self.model_name)
+                                  model=self.model_name)
 
-        input_items = [{
-            "role": "user",
-            "content": f"""请根据以下原始文档内容对分析结果进行校对：
-
-原始文档：
-{md_content}
-
-分析结果：
-{analysis_result}
-
------------
-
-请直接返回校对后的分析结果。务必尊从系统提示词中的要求来进行校对。"""
-        }]
-
-        result = Runner.run_sync(review_agent, input_items)
-        return result.final_output
-
-    def _generate_report(self, analysis_result: str) -> str:
-        """使用OpenAI生成最终报告"""
-        logger.info("生成最终报告...")
-
-        report_agent = Agent(name="Report_Agent",
-                             instructions="""你是专业的编辑，你的工作是将用户输入的分析结果整理成Markdown格式的最终报告。
+        self.report_agent = Agent(name="Report_Agent",
+                                  instructions="""你是专业的编辑，你的工作是将用户输入的分析结果整理成Markdown格式的最终报告。
 你的工作流程如下：
 1. 基于用户输入的分析结果，整理成Markdown格式的最终报告，不需要再对Markdown文档的原文进行分析，也不要进行任何推测；
     - 报告标题：
@@ -139,7 +100,60 @@ class AnalysisTool:
 5. 根据Markdown的语法，需要添加空格的地方，请务必添加空格；但不要在表格的单元格内填充大量的空格，需要的话填充一个空格即可
 总之，要严格的践行Markdown的语法要求，不要只是看上去像，其实有不少语法错误
 """,
-                             model=self.model_name)
+                                  model=self.model_name)
+
+    def _analyze_markdown(self, md_content: str) -> str:
+        """使用OpenAI分析Markdown内容"""
+        logger.info("分析Markdown内容...")
+
+        input_items = [{"role": "user", "content": f"""请根据以下Markdown内容进行分析：
+
+{md_content}
+
+-----------
+
+请直接返回分析结果。务必尊从系统提示词中的要求来进行分析。"""}]
+
+        cache_key = llm_cache.key(self.model_name, self.analyzer_agent.instructions, md_content)
+        cached_output = llm_cache.get(cache_key)
+        if cached_output is not None:
+            return cached_output
+
+        result = run_sync(self.analyzer_agent, input_items)
+        llm_cache.put(cache_key, result.final_output)
+        return result.final_output
+
+    def _review_analysis(self, md_content: str, analysis_result: str) -> str:
+        """使用OpenAI审核分析结果"""
+        logger.info("审核分析结果...")
+
+        input_items = [{
+            "role": "user",
+            "content": f"""请根据以下原始文档内容对分析结果进行校对：
+
+原始文档：
+{md_content}
+
+分析结果：
+{analysis_result}
+
+-----------
+
+请直接返回校对后的分析结果。务必尊从系统提示词中的要求来进行校对。"""
+        }]
+
+        cache_key = llm_cache.key(self.model_name, self.review_agent.instructions, md_content, analysis_result)
+        cached_output = llm_cache.get(cache_key)
+        if cached_output is not None:
+            return cached_output
+
+        result = run_sync(self.review_agent, input_items)
+        llm_cache.put(cache_key, result.final_output)
+        return result.final_output
+
+    def _generate_report(self, analysis_result: str) -> str:
+        """使用OpenAI生成最终报告"""
+        logger.info("生成最终报告...")
 
         input_items = [{"role": "user", "content": f"""请将以下分析结果整理成Markdown格式的最终报告：
 
@@ -149,7 +163,13 @@ class AnalysisTool:
 
 请直接返回最终报告。务必尊从系统提示词中的要求来生成报告。"""}]
 
-        result = Runner.run_sync(report_agent, input_items)
+        cache_key = llm_cache.key(self.model_name, self.report_agent.instructions, analysis_result)
+        cached_output = llm_cache.get(cache_key)
+        if cached_output is not None:
+            return cached_output
+
+        result = run_sync(self.report_agent, input_items)
+        llm_cache.put(cache_key, result.final_output)
         return result.final_output
 
     def md2report(self, md_content: str) -> str:
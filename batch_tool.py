@@ -0,0 +1,112 @@
+import io
+import json
+import os
+import time
+from typing import Optional
+
+from llm_runner import get_openai_client
+from logging_config import setup_logger
+
+logger = setup_logger(logger_name="BatchTool", log_level="INFO")
+
+
+class BatchTool:
+    """OpenAI Batch API工具类，用于提交非实时的批量请求
+
+    Batch API的费用为同步请求的50%，并且有独立的速率限制，适合不需要立即得到结果的大批量处理
+    """
+
+    FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+    def __init__(self, endpoint: str = "/v1/responses", poll_interval: int = 60):
+        """初始化Batch工具类
+
+        Batch工具需要在环境变量中设置OPENAI_API_KEY请确认.env文件中已经设置
+        """
+        if not os.getenv("OPENAI_API_KEY"):
+            raise ValueError("OPENAI_API_KEY 环境变量未设置")
+
+        self.client = get_openai_client()
+        self.endpoint = endpoint
+        self.poll_interval = poll_interval
+
+    def batch_submit(self, requests: list[dict]) -> dict[str, dict]:
+        """
+        提交一组请求并阻塞等待批量任务结束
+
+        Args:
+            requests (list[dict]): 每个元素包含custom_id和body（即同步调用时的请求体）
+
+        Returns:
+            dict[str, dict]: custom_id到结果行的映射，未返回结果的请求不会出现在映射中
+        """
+        lines = [
+            json.dumps({
+                "custom_id": request["custom_id"],
+                "method": "POST",
+                "url": self.endpoint,
+                "body": request["body"]
+            }, ensure_ascii=False) for request in requests
+        ]
+        batch_input = io.BytesIO("\n".join(lines).encode("utf-8"))
+
+        input_file = self.client.files.create(file=("batch_input.jsonl", batch_input), purpose="batch")
+        batch = None
+        try:
+            batch = self.client.batches.create(input_file_id=input_file.id, endpoint=self.endpoint, completion_window="24h")
+            logger.info(f"已提交批量任务 {batch.id}，共 {len(requests)} 个请求")
+
+            while batch.status not in self.FINAL_STATUSES:
+                time.sleep(self.poll_interval)
+                batch = self.client.batches.retrieve(batch.id)
+                logger.debug(f"批量任务 {batch.id} 状态: {batch.status}")
+
+            # 过期或被取消的批量任务仍可能已完成部分请求，返回已有的结果，其余请求由调用者另行处理
+            if batch.status == "failed":
+                raise RuntimeError(f"批量任务 {batch.id} 未能完成，状态: {batch.status}")
+            if batch.status != "completed":
+                logger.warning(f"批量任务 {batch.id} 未能全部完成，状态: {batch.status}，只返回已完成的结果")
+
+            results = {}
+            if batch.output_file_id:
+                output = self.client.files.content(batch.output_file_id).text
+                for line in output.splitlines():
+                    if line.strip():
+                        item = json.loads(line)
+                        results[item["custom_id"]] = item
+
+            logger.info(f"批量任务 {batch.id} 已结束，成功返回 {len(results)}/{len(requests)} 个结果")
+            return results
+        finally:
+            # 输入文件中包含每一页图像的base64编码，结果读取后与输出、错误文件一起删除
+            file_ids = [input_file.id]
+            if batch is not None:
+                file_ids += [file_id for file_id in (batch.output_file_id, batch.error_file_id) if file_id]
+            self._delete_files(file_ids)
+
+    def _delete_files(self, file_ids: list[str]):
+        for file_id in file_ids:
+            try:
+                self.client.files.delete(file_id)
+            except Exception as e:
+                logger.warning(f"删除批量任务文件 {file_id} 失败: {e}")
+
+    @staticmethod
+    def output_text(result: Optional[dict]) -> Optional[str]:
+        """从结果行中取出模型输出的文本，请求失败时返回None"""
+        if not result or result.get("error"):
+            return None
+
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            return None
+
+        texts = []
+        for output in response.get("body", {}).get("output", []):
+            if output.get("type") != "message":
+                continue
+            for content in output.get("content", []):
+                if content.get("type") == "output_text":
+                    texts.append(content.get("text", ""))
+
+        return "".join(texts) or None
@@ -42,33 +42,53 @@
 - 生成的文章默认保存在 `blogs` 目录下，可通过 -o 参数指定其他输出目录
 - 处理日志保存在 `log` 目录下
 - 文章中的大学名称会自动添加对应的URL链接
+- 指定 --cache 参数（或设置环境变量 LLM_CACHE=1）时，LLM的结果会缓存在 `.cache/llm` 目录下，
+  重新运行时内容未变的文件不再调用LLM
 """
 
 import os
 import json
+import re
 from datetime import datetime
 from typing import Optional
 import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-from agents import Agent, Runner, trace
+from agents import Agent, trace
 from dotenv import load_dotenv
+from llm_cache import llm_cache
+from llm_runner import run_sync
 from logging_config import setup_logger
 from university_utils import UniversityUtils
 
 logger = setup_logger(logger_name="blog_writer", log_level="INFO")
 
+# 提示词要求不带定界符，但模型偶尔仍会用```json ... ```包裹返回的JSON
+CODE_FENCE_PATTERN = re.compile(r"^\s*```[\w-]*[ \t]*\n(?P<body>.*?)\n?```\s*$", re.DOTALL)
+
 
 class ArticleWriter:
 
     LOG_DIR = Path("log")
     DEFAULT_OUTPUT_DIR = Path("blogs")
+    # 批量处理模式中，内容少于该字符数的文件视为无效材料，不发送给LLM
+    MIN_SOURCE_CHARS = 500
 
     def __init__(self, output_dir: Optional[str] = None):
         load_dotenv()
 
         self.model = os.getenv("OPENAI_BLOG_WRITER_MODEL", "gpt-4o")
+        # 批量处理模式中，文章生成时直接输出格式化后的Markdown；设置为1时恢复为生成后再单独格式化（用于对比质量）
+        self.two_stage = os.getenv("BLOG_TWO_STAGE", "0") == "1"
+
+        # 批量处理模式中同时生成的文章数，各文件之间互不依赖，耗时主要在等待LLM的响应
+        try:
+            self.concurrency = max(1, int(os.getenv("BLOG_CONCURRENCY", "4")))
+        except ValueError:
+            logger.warning("BLOG_CONCURRENCY配置无效，使用默认值4")
+            self.concurrency = 4
 
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
@@ -95,6 +115,10 @@ class ArticleWriter:
         self.expand_writer: Optional[Agent] = None
 
     def _init_agents(self):
+        # 代理的配置在运行期间不变，只需创建一次；批量处理时各线程共用同一组代理
+        if self.article_writer is not None:
+            return
+
         self.article_writer = Agent(name="article_writer",
                                     model=self.model,
                                     instructions="""你是一位专业的日本留学相关的文章的写作优化专家。
@@ -106,11 +130,12 @@ class ArticleWriter:
 5、记录下在你输出中提到的大学中文名称（全名）列表（大学中文全名、大学日文全名）
 6、在文章的末尾添加一个"相关大学"的标题，列出上表中的中文全名
 7、表格是很好的信息组织方式，如果需要，可以使用markdown的语法来表示表格
+8、文章内容直接以Markdown格式输出，注意正确的使用H1～H4的标题以及加粗等markdown语法
 
 请以JSON格式返回结果，格式如下：
 {
     "title": "文章标题",
-    "content": "文章内容",
+    "content": "文章内容（Markdown格式）",
     "universities": [
         {
             "chinese_name": "大学中文名",
@@ -123,7 +148,16 @@ class ArticleWriter:
  - 请不要对日本留学相关的内容进行任何推测，不要添加任何主观臆断
  - 输入的原文中可能存在一些留学咨询机构的广告（比如请咨询XXX，或是XXX位你提供服务），请不要在你输出的内容中保留任何的广告内容，特别是联系方式
  - 你撰写的文章中必须使用大学完整的中文名称
- - 不要在返回中带有```json 或是 ``` 这样的定界符
+ - 不要在返回中带有```json 或是 ``` 这样的定界符，content中也不要带有```markdown 这样的标记
+
+关于Markdown的语法格式，特别注意以下要求：
+1. 表格前后的空行要保留
+2. 列表前后的空行要保留
+3. 标题前后的空行要保留
+4. 表格的排版要特别注意，保证表格的完整性
+5. 根据Markdown的语法，需要添加空格的地方，请务必添加空格；但不要在表格的单元格内填充大量的空格，需要的话填充一个空格即可
+6. 文章开始的summary部分（若有）可以使用块引用的语法来突出表示
+总之，要严格的践行Markdown的语法要求，不要只是看上去像，其实有不少语法错误
 """)
 
         self.blog_formatter = Agent(name="blog_formatter",
@@ -249,6 +283,50 @@ class ArticleWriter:
  - 请使用简体中文输出
 """)
 
+    @staticmethod
+    def _strip_code_fence(text: str) -> str:
+        """去掉包裹整个返回内容的```定界符，没有定界符时原样返回"""
+        match = CODE_FENCE_PATTERN.match(text)
+        return match.group("body") if match else text
+
+    @staticmethod
+    def _run_json(agent: Agent, content: str, task_name: str, cache_text: Optional[str] = None) -> dict:
+        """运行返回JSON的代理并解析结果
+
+        以(模型, 系统提示词, 输入)为键缓存结果（LLM_CACHE=1时启用），只缓存能够正确解析的结果；
+        指定cache_text时以它代替输入计算缓存键
+        """
+        cache_key = llm_cache.key(agent.model, agent.instructions, content if cache_text is None else cache_text)
+        cached_output = llm_cache.get(cache_key)
+        if cached_output is not None:
+            return json.loads(cached_output)
+
+        result = run_sync(agent, [{"role": "user", "content": content}])
+        if not result or not result.final_output:
+            raise Exception(f"{task_name}失败")
+
+        output = ArticleWriter._strip_code_fence(result.final_output)
+        try:
+            data = json.loads(output)
+        except json.JSONDecodeError as e:
+            raise Exception(f"{task_name}结果格式错误: {e}") from e
+
+        llm_cache.put(cache_key, output)
+        return data
+
+    @staticmethod
+    def _add_university_links(content: str, universities: list[dict]) -> str:
+        """将文章中的大学中文名替换为链接
+
+        所有大学名合并为一个正则表达式，只扫描一次全文；较长的名称优先匹配，避免短名称在长名称内部被替换
+        """
+        urls = {university["chinese_name"]: university["url"] for university in universities if university["chinese_name"]}
+        if not urls:
+            return content
+
+        pattern = re.compile("|".join(re.escape(name) for name in sorted(urls, key=len, reverse=True)))
+        return pattern.sub(lambda match: f"[{match.group(0)}]({urls[match.group(0)]})", content)
+
     def write_article(self, sample_md_content: str) -> Optional[str]:
         task = f"""请根据以下参考内容，撰写一篇专业的日本留学咨询文章。
 
@@ -261,15 +339,8 @@ class ArticleWriter:
             self._init_agents()
 
             with trace("文章生成"):
-                input_items = [{"role": "user", "content": task}]
-                result = Runner.run_sync(self.article_writer, input_items)
-                if not result or not result.final_output:
-                    raise Exception("文章生成失败")
-
-                try:
-                    article_data = json.loads(result.final_output)
-                except json.JSONDecodeError as e:
-                    raise Exception(f"文章生成结果格式错误: {e}") from e
+                # 参考内容只有空白（缩进、空行、行尾空格等）不同时视为同一输入，命中同一个缓存
+                article_data = self._run_json(self.article_writer, task, "文章生成", cache_text=' '.join(task.split()))
 
             logger.info("为大学添加URL链接...")
             valid_universities = []
@@ -280,26 +351,20 @@ class ArticleWriter:
                         university["url"] = url
                         valid_universities.append(university)
 
-            logger.info("开始格式化文章...")
-            with trace("文章格式化"):
-                format_input_items = [{"role": "user", "content": f"""请格式化以下文章：
+            if self.two_stage:
+                logger.info("开始格式化文章...")
+                with trace("文章格式化"):
+                    format_data = self._run_json(self.blog_formatter, f"""请格式化以下文章：
                         
 {article_data["content"]}
-"""}]
-                format_result = Runner.run_sync(self.blog_formatter, format_input_items)
-                if not format_result or not format_result.final_output:
-                    raise Exception("文章格式化失败")
-
-                try:
-                    format_data = json.loads(format_result.final_output)
-                except json.JSONDecodeError as e:
-                    raise Exception(f"文章格式化结果格式错误: {e}") from e
-
-                formatted_content = format_data["formatted_content"]
+""", "文章格式化")
+                    formatted_content = format_data["formatted_content"]
+            else:
+                # 文章生成时已经按照Markdown的格式要求输出，无需再单独请求一次格式化
+                formatted_content = article_data["content"]
 
             logger.info("在文章中添加大学URL链接...")
-            for university in valid_universities:
-                formatted_content = formatted_content.replace(university["chinese_name"], f"[{university['chinese_name']}]({university['url']})")
+            formatted_content = self._add_university_links(formatted_content, valid_universities)
 
             logger.info("保存文章...")
             return self._save_article(article_data["title"], formatted_content)
@@ -330,7 +395,7 @@ class ArticleWriter:
 请严格按照系统提示词中的要求和说明进行工作并输出结果。特别注意输出结果所使用的语言要根据系统提示词中的要求来决定。
 """
                     }]
-                    result = Runner.run_sync(self.article_reducer, input_items)
+                    result = run_sync(self.article_reducer, input_items)
                     if not result or not result.final_output:
                         raise Exception("缩减文章失败")
 
@@ -339,11 +404,7 @@ class ArticleWriter:
 
             logger.info("开始生成综合性文章...")
             with trace("综合性文章生成"):
-                input_items = [{
-                    "role":
-                    "user",
-                    "content":
-                    """请根据以下多所大学的信息，撰写一篇综合性的日本留学的BLOG。
+                content = """请根据以下多所大学的信息，撰写一篇综合性的日本留学的BLOG。
 
 """ + '\n\n'.join(article_summaries) + """
 
@@ -352,15 +413,7 @@ class ArticleWriter:
 
 请严格按照系统提示词中的要求和说明进行工作并输出结果。
 """
-                }]
-                result = Runner.run_sync(self.comparative_writer, input_items)
-                if not result or not result.final_output:
-                    raise Exception("综合性文章生成失败")
-
-                try:
-                    article_data = json.loads(result.final_output)
-                except json.JSONDecodeError as e:
-                    raise Exception(f"综合性文章生成结果格式错误: {e}") from e
+                article_data = self._run_json(self.comparative_writer, content, "综合性文章生成")
 
             logger.info("为大学添加URL链接...")
             valid_universities = []
@@ -373,24 +426,14 @@ class ArticleWriter:
 
             logger.info("开始格式化文章...")
             with trace("文章格式化"):
-                format_input_items = [{"role": "user", "content": f"""请格式化以下文章：
+                format_data = self._run_json(self.blog_formatter, f"""请格式化以下文章：
                         
 {article_data["content"]}
-"""}]
-                format_result = Runner.run_sync(self.blog_formatter, format_input_items)
-                if not format_result or not format_result.final_output:
-                    raise Exception("文章格式化失败")
-
-                try:
-                    format_data = json.loads(format_result.final_output)
-                except json.JSONDecodeError as e:
-                    raise Exception(f"文章格式化结果格式错误: {e}") from e
-
+""", "文章格式化")
                 formatted_content = format_data["formatted_content"]
 
             logger.info("在文章中添加大学URL链接...")
-            for university in valid_universities:
-                formatted_content = formatted_content.replace(university["chinese_name"], f"[{university['chinese_name']}]({university['url']})")
+            formatted_content = self._add_university_links(formatted_content, valid_universities)
 
             logger.info("保存文章...")
             return self._save_article(article_data["title"], formatted_content)
@@ -406,11 +449,7 @@ class ArticleWriter:
 
             logger.info("开始根据材料和扩展方向生成文章...")
             with trace("材料扩展文章生成"):
-                input_items = [{
-                    "role":
-                    "user",
-                    "content":
-                    f"""请根据以下基础材料和扩展写作方向，撰写一篇扩展性的日本留学BLOG文章。
+                content = f"""请根据以下基础材料和扩展写作方向，撰写一篇扩展性的日本留学BLOG文章。
 
 基础材料：
 {md_content}
@@ -423,15 +462,7 @@ class ArticleWriter:
 
 请严格按照系统提示词中的要求和说明进行工作并输出结果。基于基础材料，按照扩展写作方向进行创作。
 """
-                }]
-                result = Runner.run_sync(self.expand_writer, input_items)
-                if not result or not result.final_output:
-                    raise Exception("扩展文章生成失败")
-
-                try:
-                    article_data = json.loads(result.final_output)
-                except json.JSONDecodeError as e:
-                    raise Exception(f"扩展文章生成结果格式错误: {e}") from e
+                article_data = self._run_json(self.expand_writer, content, "扩展文章生成")
 
             logger.info("为大学添加URL链接...")
             valid_universities = []
@@ -444,24 +475,14 @@ class ArticleWriter:
 
             logger.info("开始格式化文章...")
             with trace("文章格式化"):
-                format_input_items = [{"role": "user", "content": f"""请格式化以下文章：
+                format_data = self._run_json(self.blog_formatter, f"""请格式化以下文章：
                         
 {article_data["content"]}
-"""}]
-                format_result = Runner.run_sync(self.blog_formatter, format_input_items)
-                if not format_result or not format_result.final_output:
-                    raise Exception("文章格式化失败")
-
-                try:
-                    format_data = json.loads(format_result.final_output)
-                except json.JSONDecodeError as e:
-                    raise Exception(f"文章格式化结果格式错误: {e}") from e
-
+""", "文章格式化")
                 formatted_content = format_data["formatted_content"]
 
             logger.info("在文章中添加大学URL链接...")
-            for university in valid_universities:
-                formatted_content = formatted_content.replace(university["chinese_name"], f"[{university['chinese_name']}]({university['url']})")
+            formatted_content = self._add_university_links(formatted_content, valid_universities)
 
             logger.info("保存文章...")
             return self._save_article(article_data["title"], formatted_content)
@@ -481,10 +502,18 @@ class ArticleWriter:
 
         logger.info(f"开始输出：{title}")
 
-        output_file = self.output_dir / f"{title}_{datetime.now().strftime('%Y%m%d%H%M%S')}.md"
-
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write(formatted_content)
+        # 批量模式下多篇文章并发生成，同一标题可能在同一秒内完成；以独占模式创建文件，已存在时追加序号，避免互相覆盖
+        base_name = f"{title}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        output_file = self.output_dir / f"{base_name}.md"
+        suffix = 1
+        while True:
+            try:
+                with open(output_file, "x", encoding="utf-8") as f:
+                    f.write(formatted_content)
+                break
+            except FileExistsError:
+                suffix += 1
+                output_file = self.output_dir / f"{base_name}_{suffix}.md"
 
         return "Success"
 
@@ -495,21 +524,38 @@ def process_batch_mode(input_folder_path: Path, output_dir: Optional[str] = None
 
         md_file_count = 0
         success_count = 0
+        skipped_count = 0
 
-        for md_file in input_folder_path.glob("*.md"):
+        def process_file(md_file: Path) -> Optional[bool]:
+            """处理单个文件，返回是否成功；内容过少而跳过时返回None，与生成失败区分"""
             logger.info(f"开始处理: {md_file.name}")
-            md_file_count += 1
             with open(md_file, "r", encoding="utf-8") as f:
                 content = f.read()
-            result = writer.write_article(content)
-            if result is None:
-                logger.error(f"处理失败: {md_file.name}")
-            else:
-                logger.info(f"处理成功: {md_file.name}")
-                success_count += 1
-
-        if success_count < md_file_count:
-            logger.warning(f"处理完成：共 {md_file_count} 个文件，成功 {success_count} 个，失败 {md_file_count - success_count} 个")
+            if len(content.strip()) < ArticleWriter.MIN_SOURCE_CHARS:
+                logger.warning(f"文件内容过少，跳过: {md_file.name}")
+                return None
+            return writer.write_article(content) is not None
+
+        # 各文件的文章生成并发进行，总并发的LLM请求数仍受LLM_CONCURRENCY限制
+        with ThreadPoolExecutor(max_workers=writer.concurrency) as executor:
+            futures = {executor.submit(process_file, md_file): md_file for md_file in input_folder_path.glob("*.md")}
+            for future in as_completed(futures):
+                md_file = futures[future]
+                md_file_count += 1
+                result = future.result()
+                if result is None:
+                    skipped_count += 1
+                elif result:
+                    logger.info(f"处理成功: {md_file.name}")
+                    success_count += 1
+                else:
+                    logger.error(f"处理失败: {md_file.name}")
+
+        failed_count = md_file_count - success_count - skipped_count
+        if failed_count > 0:
+            logger.warning(f"处理完成：共 {md_file_count} 个文件，成功 {success_count} 个，跳过 {skipped_count} 个，失败 {failed_count} 个")
+        elif skipped_count > 0:
+            logger.info(f"处理完成：共 {md_file_count} 个文件，成功 {success_count} 个，跳过 {skipped_count} 个（内容过少）")
         else:
             logger.info(f"处理完成：全部 {md_file_count} 个文件处理成功")
 
@@ -583,8 +629,12 @@ if __name__ == "__main__":
     group.add_argument('-e', '--expand', help='材料扩展模式：基于指定的markdown文件和扩展方向生成文章')
     parser.add_argument('-p', '--prompt', help='扩展写作方向（仅在材料扩展模式下使用）')
     parser.add_argument('-o', '--output', help='指定输出目录（默认为"blogs"目录）')
+    parser.add_argument('--cache', action='store_true', help='缓存LLM的结果，重新运行时内容未变的文件不再调用LLM（等同于LLM_CACHE=1）')
     args = parser.parse_args()
 
+    if args.cache:
+        os.environ["LLM_CACHE"] = "1"
+
     try:
         if args.expand:
             if not args.prompt:
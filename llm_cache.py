@@ -0,0 +1,73 @@
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from logging_config import setup_logger
+
+logger = setup_logger(logger_name="LLMCache", log_level="INFO")
+
+
+class LLMCache:
+    """LLM结果缓存，以(模型, 系统提示词, 输入内容)的SHA-256为键，将final_output保存为文件
+
+    仅在环境变量LLM_CACHE=1时启用，用于重复处理同一文档（或不同PDF中的相同页面）时跳过重复的LLM调用
+    """
+
+    def __init__(self, cache_dir: str = ".cache/llm"):
+        self.default_cache_dir = cache_dir
+
+    # 模块导入时.env可能尚未加载，因此每次使用时再读取环境变量
+    @property
+    def enabled(self) -> bool:
+        return os.getenv("LLM_CACHE", "0") == "1"
+
+    @property
+    def cache_dir(self) -> Path:
+        return Path(os.getenv("LLM_CACHE_DIR", self.default_cache_dir))
+
+    @staticmethod
+    def key(*parts) -> str:
+        """根据各部分内容计算缓存键，parts可以是str或bytes"""
+        sha = hashlib.sha256()
+        for part in parts:
+            data = part if isinstance(part, bytes) else str(part).encode('utf-8')
+            # 加入长度前缀，避免不同的分段方式得到相同的键
+            sha.update(len(data).to_bytes(8, 'big'))
+            sha.update(data)
+        return sha.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.txt"
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未启用或未命中时返回None"""
+        if not self.enabled:
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+
+        logger.debug(f"命中LLM缓存: {key}")
+        return value
+
+    def put(self, key: str, value: str):
+        """写入缓存，未启用或value为空时不做任何处理"""
+        if not self.enabled or not value:
+            return
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再替换，避免并发写入时读到不完整的内容
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+
+
+llm_cache = LLMCache()
@@ -0,0 +1,160 @@
+# pylint: disable=invalid-name
+import asyncio
+import functools
+import os
+import random
+import threading
+import time
+
+import openai
+from agents import Agent, OpenAIProvider, RunConfig, Runner
+from openai.types.responses import ResponseTextDeltaEvent
+from logging_config import setup_logger
+
+logger = setup_logger(logger_name="LLMRunner", log_level="INFO")
+
+_semaphore = None
+_semaphore_lock = threading.Lock()
+
+# 所有线程共用一个在后台线程中运行的事件循环和一个AsyncOpenAI客户端：客户端的连接池与事件循环绑定，
+# 各线程通过run_coroutine_threadsafe提交请求，所有调用都可以复用已建立的TLS连接，线程池结束后也不会残留未关闭的循环和连接
+_agent_loop = None
+_run_config_instance = None
+_agent_loop_lock = threading.Lock()
+
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+
+def _get_semaphore() -> threading.Semaphore:
+    """所有线程共用的并发上限，首次使用时按环境变量LLM_CONCURRENCY创建（.env在模块导入后才加载）"""
+    global _semaphore  # pylint: disable=global-statement
+    with _semaphore_lock:
+        if _semaphore is None:
+            try:
+                # pylint: disable=invalid-envvar-default
+                concurrency = max(1, int(os.getenv("LLM_CONCURRENCY", 8)))
+            except Exception:
+                concurrency = 8
+            _semaphore = threading.Semaphore(concurrency)
+        return _semaphore
+
+
+def get_openai_client() -> openai.OpenAI:
+    """所有工具共用的同步OpenAI客户端（文件上传、Batch API等），同步客户端本身是线程安全的"""
+    global _openai_client  # pylint: disable=global-statement
+    with _openai_client_lock:
+        if _openai_client is None:
+            _openai_client = openai.OpenAI(timeout=openai.Timeout(120.0, connect=10.0))
+        return _openai_client
+
+
+def _get_agent_loop() -> asyncio.AbstractEventLoop:
+    """首次使用时启动共用的后台事件循环（守护线程，随进程退出）"""
+    global _agent_loop  # pylint: disable=global-statement
+    with _agent_loop_lock:
+        if _agent_loop is None:
+            _agent_loop = asyncio.new_event_loop()
+            threading.Thread(target=_agent_loop.run_forever, name="llm-agent-loop", daemon=True).start()
+        return _agent_loop
+
+
+def _run_config() -> RunConfig:
+    """所有agent共用的RunConfig，SDK自身的重试关闭，由retry装饰器统一处理"""
+    global _run_config_instance  # pylint: disable=global-statement
+    with _agent_loop_lock:
+        if _run_config_instance is None:
+            client = openai.AsyncOpenAI(timeout=openai.Timeout(120.0, connect=10.0), max_retries=0)
+            _run_config_instance = RunConfig(model_provider=OpenAIProvider(openai_client=client))
+        return _run_config_instance
+
+
+def _run_coroutine(coro):
+    """在共用事件循环中执行协程，并在调用线程中阻塞等待结果"""
+    return asyncio.run_coroutine_threadsafe(coro, _get_agent_loop()).result()
+
+
+def _is_retryable(e: Exception) -> bool:
+    """限流、服务端错误以及网络错误可以重试，其余错误（如400、401）直接抛出"""
+    if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return False
+
+
+def _retry_after(e: Exception):
+    """读取服务端返回的Retry-After（秒），没有时返回None"""
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry(max_attempts: int = 6, base: float = 2, jitter: float = 0.25):
+    """对可重试的OpenAI错误进行指数退避重试的装饰器，优先使用服务端给出的Retry-After
+
+    被装饰的调用所用的客户端需关闭SDK自身的重试（max_retries=0），否则两层重试会叠加
+    """
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            attempt = 0
+            while True:
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    attempt += 1
+                    if attempt >= max_attempts or not _is_retryable(e):
+                        raise
+
+                    # 服务端给出Retry-After时至少等待该时长，避免在限流窗口内耗尽重试次数
+                    delay = base * 2**attempt
+                    retry_after = _retry_after(e)
+                    if retry_after is not None:
+                        delay = max(retry_after, delay)
+                    delay += random.uniform(0, jitter)
+                    logger.warning(f"LLM调用失败（第{attempt}次）: {e}，{delay:.1f}秒后重试")
+                    time.sleep(delay)
+
+        return wrapper
+
+    return decorator
+
+
+@retry()
+def upload_file(file, purpose: str) -> str:
+    """上传文件到OpenAI Files并返回file_id，与LLM调用共用并发上限和重试"""
+    with _get_semaphore():
+        return get_openai_client().with_options(max_retries=0).files.create(file=file, purpose=purpose).id
+
+
+@retry()
+def run_sync(agent: Agent, input_items):
+    """Runner.run_sync的替代，限制全局并发数并对限流等临时错误自动重试"""
+    with _get_semaphore():
+        return _run_coroutine(Runner.run(agent, input_items, run_config=_run_config()))
+
+
+async def _run_streamed(agent: Agent, input_items) -> str:
+    result = Runner.run_streamed(agent, input_items, run_config=_run_config())
+    received = 0
+    async for event in result.stream_events():
+        if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+            # 每收到约4000个字符记录一次进度，便于观察长文本的生成情况
+            if (received + len(event.data.delta)) // 4000 > received // 4000:
+                logger.debug(f"{agent.name} 已生成 {received + len(event.data.delta)} 个字符")
+            received += len(event.data.delta)
+    return result.final_output
+
+
+@retry()
+def run_streamed(agent: Agent, input_items) -> str:
+    """以流式方式执行agent并返回final_output，适合输出较长的OCR、翻译等任务，避免长时间阻塞在单个响应上"""
+    with _get_semaphore():
+        return _run_coroutine(_run_streamed(agent, input_items))
@@ -1,9 +1,28 @@
 import os
+import atexit
 import logging
+import logging.handlers
 import datetime
+import queue
+
+# 每个logger对应一个后台写日志的QueueListener，重复调用setup_logger时先停止旧的
+_listeners = {}
+
+
+def _stop_listeners():
+    """程序退出时停止所有QueueListener，确保队列中剩余的日志写入完毕"""
+    for listener in _listeners.values():
+        listener.stop()
+    _listeners.clear()
+
+
+atexit.register(_stop_listeners)
+
 
 def setup_logger(logger_name="app", log_dir="log", log_level="INFO") -> logging.Logger:
     """设置日志记录器
+
+    日志记录只放入队列，由后台线程写入文件和控制台，多线程并发记录日志时不会因文件写入互相等待
     
     Args:
         logger_name (str): 日志记录器名称
@@ -23,6 +42,8 @@ def setup_logger(logger_name="app", log_dir="log", log_level="INFO") -> logging.
     # 防止日志重复
     if app_logger.hasHandlers():
         app_logger.handlers.clear()
+    if logger_name in _listeners:
+        _listeners.pop(logger_name).stop()
 
     # 创建格式化器
     formatter = logging.Formatter(fmt="%(asctime)s [%(levelname)s] %(name)s: %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
@@ -40,11 +61,15 @@ def setup_logger(logger_name="app", log_dir="log", log_level="INFO") -> logging.
     console_handler.setFormatter(formatter)
     console_handler.setLevel(getattr(logging, level))
 
-    # 添加处理器到logger
-    app_logger.addHandler(file_handler)
-    app_logger.addHandler(console_handler)
+    # 文件和控制台处理器由后台线程执行，logger上只添加队列处理器
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    _listeners[logger_name] = listener
+
+    app_logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
     # 设置不传播到父logger
     app_logger.propagate = False
 
-    return app_logger 
\ No newline at end of file
+    return app_logger
@@ -1,33 +1,21 @@
 import base64
+import io
 import os
+import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from agents import Agent, Runner, TResponseInputItem
+from PIL import Image
+from agents import Agent, TResponseInputItem
+from batch_tool import BatchTool
+from llm_cache import llm_cache
+from llm_runner import get_openai_client, run_streamed, run_sync, upload_file
 from logging_config import setup_logger
 
 logger = setup_logger(logger_name="OCRTool", log_level="INFO")
 
-
-class OCRTool:
-    """OCR工具类，用于处理图像OCR识别"""
-
-    def __init__(self, ocr_model_name: str = "gpt-4o-mini"):
-        """初始化OCR工具类
-        
-        OCR工具需要在环境变量中设置OPENAI_API_KEY请确认.env文件中已经设置
-        """
-        if not os.getenv("OPENAI_API_KEY"):
-            raise ValueError("OPENAI_API_KEY 环境变量未设置")
-
-        self.model_name = ocr_model_name
-
-    def _perform_ocr(self, image_path):
-        """使用OpenAI Vision模型进行OCR"""
-        logger.info(f"使用OpenAI Vision对{image_path}进行OCR...")
-
-        try:
-            ocr_agent = Agent(name="OCR Agent",
-                              instructions="""你是一个专业的OCR文本识别专家。
+OCR_INSTRUCTIONS = """你是一个专业的OCR文本识别专家。
 请仔细观察图像中的文本内容，并尽可能准确地提取所有文本和表格。
 输出应该保持原始文本的格式和结构，包括格式（加粗、斜体、下划线、表格）、段落和标题。
 针对表格的提取，可以采用markdown的语法来表示，特别注意表格的列数（有些表格首行有空单元格，也要算作一列）
@@ -39,42 +27,18 @@ class OCRTool:
 4. 忽略所有的纯图形内容（比如：logo，地图等，包括页面上的水印）
 5. 忽略所有的页眉和页脚，但保留原文中每页的页码（如果原文中有），严格按照原文中标注的页码来提取（不论原文是否有错）
 6. 如果遇到空白页或整页都是没有意义的内容，请返回：EMPTY_PAGE
-""",
-                              model=self.model_name)
-
-            with open(image_path, 'rb') as f:
-                image_data = f.read()
-            base64_image = base64.b64encode(image_data).decode('utf-8')
-
-            input_items: list[TResponseInputItem] = [{
-                "role":
-                "user",
-                "content": [{
-                    "type": "input_text",
-                    "text": "请识别这个图像中的所有文字内容，保持原始格式。"
-                }, {
-                    "type": "input_image",
-                    "image_url": f"data:image/png;base64,{base64_image}"
-                }]
-            }]
-
-            result = Runner.run_sync(ocr_agent, input_items)
-
-            if not result.final_output.strip():
-                raise ValueError("OpenAI Vision未能提取任何文本")
-
-            return result.final_output
-        except Exception as e:
-            logger.error(f"OpenAI Vision OCR错误: {e}")
-            return None  # 返回None而不是空字符串，表示OCR失败
+"""
 
-    def _format_to_markdown(self, text_content, image_path):
-        """使用OpenAI格式化OCR文本为markdown"""
-        logger.info("格式化OCR文本为markdown...")
+# 批量OCR时，要求模型用该定界符分隔每一页的结果
+OCR_BATCH_INSTRUCTIONS = OCR_INSTRUCTIONS + """
+用户会一次性提供多张图像，每张图像之前都有一行「=== PAGE 序号 ===」的标记。
+请逐张识别，并严格按照以下格式输出每一张图像的识别结果（序号与标记中的序号一致，不要遗漏任何一张）：
+<<<PAGE 序号>>>
+该图像的识别结果
+<<<END 序号>>>
+"""
 
-        # 创建格式化代理
-        format_agent = Agent(name="Markdown Formatter",
-                             instructions="""你是一个专业的文本格式化专家。
+FORMAT_INSTRUCTIONS = """你是一个专业的文本格式化专家。
 请将OCR出来的文本重新组织成Markdown格式。
 输出应该保持原始文本的格式和结构，包括格式（加粗、斜体、下划线、表格）、段落和标题。
 
@@ -98,33 +62,266 @@ class OCRTool:
 4. 表格的排版（特别是合并单元格）要与原文（图片）完全一致
 5. 根据Markdown的语法，需要添加空格的地方，请务必添加空格；但不要在表格的单元格内填充大量的空格，需要的话填充一个空格即可
 总之，要严格的践行Markdown的语法要求，不要只是看上去像，其实有不少语法错误
-""",
-                             model=self.model_name)
+"""
 
+# 单次请求同时完成OCR和Markdown格式化
+OCR_FORMAT_INSTRUCTIONS = """你是一个专业的OCR文本识别和文本格式化专家。
+请仔细观察图像中的文本内容，尽可能准确地提取所有文本和表格，并直接以Markdown格式输出。
+输出应该保持原始文本的格式和结构，包括格式（加粗、斜体、下划线、表格）、段落和标题。
+特别注意表格的列数（有些表格首行有空单元格，也要算作一列）
+
+请注意：
+1. 仅提取图像中的实际文本，不要添加任何解释或说明，也不要进行归纳总结
+2. 保持原始日语文本，不要翻译
+3. 尽可能保持原始格式结构，特别是表格，要准确的提取表格中的所有文字
+4. 忽略所有的纯图形内容（比如：logo，地图等，包括页面上的水印）；特别注意不要以Base64的编码来处理任何纯图形内容
+5. 忽略所有的页眉和页脚，但保留原文中每页的页码（如果原文中有），严格按照原文中标注的页码来提取（不论原文是否有错）
+页码一律独立一行，前后空行，以 【数字 + ページ】 的形式表现
+6. 如果文本中包含大量无意义的信息，请删除他们
+7. 对于像目录这样的内容，可能会包含大量的「..........」或事「-------------」这样的符号，如果只是为了表达页码的话请将其长度现在6个点也就是「......」
+8. 如果有URL信息，请保持完整的URL信息，但不要用Markdown的链接格式来处理URL，保留纯文本状态即可
+9. 如果遇到空白页或整页都是没有意义的内容，请返回：EMPTY_PAGE
+10. 结果会被直接保存为md文件，所以请不要添加任何```markdown```之类的定界符
+
+关于Markdown的语法格式，特别注意以下要求：
+1. 表格前后的空行要保留
+2. 列表前后的空行要保留
+3. 标题前后的空行要保留
+4. 表格的排版（特别是合并单元格）要与原文（图片）完全一致
+5. 根据Markdown的语法，需要添加空格的地方，请务必添加空格；但不要在表格的单元格内填充大量的空格，需要的话填充一个空格即可
+总之，要严格的践行Markdown的语法要求，不要只是看上去像，其实有不少语法错误
+"""
+
+BATCH_PAGE_PATTERN = re.compile(r'<<<PAGE (\d+)>>>\s*(.*?)\s*<<<END \1>>>', re.DOTALL)
+
+
+class OCRTool:
+    """OCR工具类，用于处理图像OCR识别"""
+
+    def __init__(self, ocr_model_name: str = "gpt-4o-mini", single_pass: bool = True, image_upload: bool = False):
+        """初始化OCR工具类
+        
+        OCR工具需要在环境变量中设置OPENAI_API_KEY请确认.env文件中已经设置
+
+        Args:
+            ocr_model_name (str): OCR使用的模型
+            single_pass (bool): 是否在一次请求中同时完成OCR和格式化，失败时会退回到OCR、格式化两步处理
+            image_upload (bool): 同一图像需要发送多次时（两步处理、批量处理），是否先上传到OpenAI Files再以file_id引用；
+                使用不支持Files API的兼容服务时保持关闭
+        """
+        if not os.getenv("OPENAI_API_KEY"):
+            raise ValueError("OPENAI_API_KEY 环境变量未设置")
+
+        self.model_name = ocr_model_name
+        self.single_pass = single_pass
+        self.image_upload = image_upload
+
+        self.ocr_agent = Agent(name="OCR Agent", instructions=OCR_INSTRUCTIONS, model=self.model_name)
+        self.ocr_batch_agent = Agent(name="OCR Batch Agent", instructions=OCR_BATCH_INSTRUCTIONS, model=self.model_name)
+        self.format_agent = Agent(name="Markdown Formatter", instructions=FORMAT_INSTRUCTIONS, model=self.model_name)
+        self.ocr_format_agent = Agent(name="OCR Markdown Agent", instructions=OCR_FORMAT_INSTRUCTIONS, model=self.model_name)
+        self.client = get_openai_client()
+        # 已上传的图像，(路径, 修改时间) -> file_id；OCR和格式化两个步骤共用同一次上传
+        self._uploaded_files = {}
+        self._upload_lock = threading.Lock()
+
+    @staticmethod
+    def _encode_for_vision(image_bytes: bytes, max_side: int = 2048, quality: int = 85) -> tuple[str, bytes]:
+        """将图像缩小并重新编码为JPEG后再发送给模型
+
+        模型内部本身就会对图像进行缩小，发送原始PNG只会浪费带宽；保存在本地的PNG保持原样
+
+        Returns:
+            tuple[str, bytes]: (MIME类型, 图像数据)
+        """
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.convert('RGB').save(buffer, 'JPEG', quality=quality, optimize=True)
+        return "image/jpeg", buffer.getvalue()
+
+    def _upload_image(self, image_path, image_bytes: bytes) -> str:
+        """将图像上传到OpenAI Files，同一图像只上传一次
+
+        Returns:
+            str: 上传后的file_id
+        """
+        key = (str(image_path), os.path.getmtime(image_path))
+        with self._upload_lock:
+            file_id = self._uploaded_files.get(key)
+        if file_id:
+            return file_id
+
+        mime, jpeg_bytes = self._encode_for_vision(image_bytes)
+        file_name = f"{os.path.splitext(os.path.basename(image_path))[0]}.{mime.split('/')[1]}"
+        file_id = upload_file((file_name, jpeg_bytes, mime), purpose="vision")
+        logger.debug(f"已上传 {image_path}，file_id: {file_id}")
+
+        with self._upload_lock:
+            self._uploaded_files[key] = file_id
+        return file_id
+
+    @staticmethod
+    def _read_image(image_path) -> bytes:
+        """读取页面图像的原始数据，同一页的缓存键计算和input_image构建共用这一次读取"""
         with open(image_path, 'rb') as f:
-            image_data = f.read()
-        base64_image = base64.b64encode(image_data).decode('utf-8')
+            return f.read()
+
+    def _image_input(self, image_path, image_bytes: bytes, reuse: bool = False) -> dict:
+        """构建input_image，同一页的多次请求应共用构建结果，避免重复缩小和编码
 
-        input_items = [{
+        默认内嵌base64编码的JPEG；只有启用image_upload且同一图像会被发送多次（reuse）时才上传并以file_id引用，
+        上传失败时同样退回到内嵌base64
+        """
+        if self.image_upload and reuse:
+            try:
+                return {"type": "input_image", "file_id": self._upload_image(image_path, image_bytes), "detail": "auto"}
+            except Exception as e:
+                logger.warning(f"上传图像 {image_path} 失败，改为内嵌base64: {e}")
+
+        mime, jpeg_bytes = self._encode_for_vision(image_bytes)
+        image_url = f"data:{mime};base64,{base64.b64encode(jpeg_bytes).decode('utf-8')}"
+        return {"type": "input_image", "image_url": image_url, "detail": "auto"}
+
+    def delete_uploaded_files(self):
+        """删除本工具上传到OpenAI Files的所有图像，在整份PDF处理完成后调用"""
+        with self._upload_lock:
+            file_ids = list(self._uploaded_files.values())
+            self._uploaded_files.clear()
+
+        if not file_ids:
+            return
+
+        def delete(file_id):
+            try:
+                self.client.files.delete(file_id)
+            except Exception as e:
+                logger.warning(f"删除已上传的图像 {file_id} 失败: {e}")
+
+        with ThreadPoolExecutor(max_workers=min(8, len(file_ids))) as executor:
+            list(executor.map(delete, file_ids))
+
+    @staticmethod
+    def _ocr_input_items(image_input: dict) -> list[TResponseInputItem]:
+        """构建OCR请求的输入"""
+        return [{
+            "role":
+            "user",
+            "content": [{
+                "type": "input_text",
+                "text": "请识别这个图像中的所有文字内容，保持原始格式。"
+            }, image_input]
+        }]
+
+    @staticmethod
+    def _ocr_format_input_items(image_input: dict) -> list[TResponseInputItem]:
+        """构建单次完成OCR及格式化的请求的输入"""
+        return [{
+            "role":
+            "user",
+            "content": [{
+                "type": "input_text",
+                "text": "请识别这个图像中的所有文字内容，并按照系统提示词中的要求直接输出Markdown。"
+            }, image_input]
+        }]
+
+    @staticmethod
+    def _format_input_items(text_content, image_input: dict) -> list[TResponseInputItem]:
+        """构建格式化请求的输入"""
+        return [{
             "role":
             "user",
             "content": [{
                 "type": "input_text",
                 "text": f"请将以下OCR文本重新组织成Markdown格式：\n\n{text_content} \n\n-----------\n\n务必尊从系统提示词中的要求来进行格式化。"
-            }, {
-                "type": "input_image",
-                "image_url": f"data:image/png;base64,{base64_image}"
-            }]
+            }, image_input]
         }]
 
-        result = Runner.run_sync(format_agent, input_items)
+    @staticmethod
+    def _strip_code_fence(text: str) -> str:
+        """去掉模型有时仍会添加的```markdown之类的定界符"""
+        text = text.replace("``` Markdown", "")
+        text = text.replace("``` markdown", "")
+        text = text.replace("```Markdown", "")
+        text = text.replace("```markdown", "")
+        text = text.replace("```", "")
+        return text
+
+    def _perform_ocr(self, image_path, image_bytes: bytes, image_input: dict):
+        """使用OpenAI Vision模型进行OCR"""
+        logger.info(f"使用OpenAI Vision对{image_path}进行OCR...")
+
+        try:
+            cache_key = llm_cache.key(self.model_name, OCR_INSTRUCTIONS, image_bytes)
+            cached_output = llm_cache.get(cache_key)
+            if cached_output is not None:
+                return cached_output
+
+            final_output = run_streamed(self.ocr_agent, self._ocr_input_items(image_input))
+
+            if not final_output.strip():
+                raise ValueError("OpenAI Vision未能提取任何文本")
+
+            llm_cache.put(cache_key, final_output)
+            return final_output
+        except Exception as e:
+            logger.error(f"OpenAI Vision OCR错误: {e}")
+            return None  # 返回None而不是空字符串，表示OCR失败
 
-        result.final_output = result.final_output.replace("``` Markdown", "")
-        result.final_output = result.final_output.replace("``` markdown", "")
-        result.final_output = result.final_output.replace("```Markdown", "")
-        result.final_output = result.final_output.replace("```markdown", "")
-        result.final_output = result.final_output.replace("```", "")
-        return result.final_output
+    def _perform_ocr_batch(self, image_inputs: list[dict]) -> list[str]:
+        """使用OpenAI Vision模型在一次请求中对多张图像进行OCR
+
+        Returns:
+            list[str]: 与image_inputs顺序一致的OCR文本，无法按页解析时抛出异常
+        """
+        logger.info(f"使用OpenAI Vision对{len(image_inputs)}张图像进行批量OCR...")
+
+        content = [{"type": "input_text", "text": "请依次识别以下每一张图像中的所有文字内容，保持原始格式。"}]
+        for i, image_input in enumerate(image_inputs):
+            content.append({"type": "input_text", "text": f"=== PAGE {i} ==="})
+            content.append(image_input)
+
+        input_items: list[TResponseInputItem] = [{"role": "user", "content": content}]
+
+        result = run_sync(self.ocr_batch_agent, input_items)
+
+        pages = {int(match.group(1)): match.group(2) for match in BATCH_PAGE_PATTERN.finditer(result.final_output)}
+        missing_pages = [i for i in range(len(image_inputs)) if not pages.get(i, "").strip()]
+        if missing_pages:
+            raise ValueError(f"批量OCR结果中缺少以下页: {missing_pages}")
+
+        return [pages[i] for i in range(len(image_inputs))]
+
+    def _format_to_markdown(self, text_content, image_bytes: bytes, image_input: dict):
+        """使用OpenAI格式化OCR文本为markdown"""
+        logger.info("格式化OCR文本为markdown...")
+
+        cache_key = llm_cache.key(self.model_name, FORMAT_INSTRUCTIONS, text_content, image_bytes)
+        cached_output = llm_cache.get(cache_key)
+        if cached_output is not None:
+            return cached_output
+
+        result = run_sync(self.format_agent, self._format_input_items(text_content, image_input))
+        final_output = self._strip_code_fence(result.final_output)
+        llm_cache.put(cache_key, final_output)
+        return final_output
+
+    def _ocr_and_format(self, image_path, image_bytes: bytes) -> str:
+        """使用OpenAI Vision模型在一次请求中完成OCR并输出markdown"""
+        logger.info(f"使用OpenAI Vision对{image_path}进行OCR并格式化为markdown...")
+
+        cache_key = llm_cache.key(self.model_name, OCR_FORMAT_INSTRUCTIONS, image_bytes)
+        cached_output = llm_cache.get(cache_key)
+        if cached_output is not None:
+            return cached_output
+
+        image_input = self._image_input(image_path, image_bytes)
+        final_output = self._strip_code_fence(run_streamed(self.ocr_format_agent, self._ocr_format_input_items(image_input)))
+        if not final_output.strip():
+            raise ValueError("OpenAI Vision未能提取任何文本")
+
+        llm_cache.put(cache_key, final_output)
+        return final_output
 
     def img2md(self, image_path) -> str:
         """
@@ -139,16 +336,140 @@ class OCRTool:
             str: 转换后的markdown文本
         """
         start_time = time.time()
+        image_bytes = self._read_image(image_path)
+
+        if self.single_pass:
+            try:
+                result = self._ocr_and_format(image_path, image_bytes)
+                logger.info(f"OCR及格式化总耗时: {time.time() - start_time:.2f}秒")
+                return result
+            except Exception as e:
+                logger.warning(f"单次OCR及格式化失败，改为分两步处理: {e}")
+
+        # OCR和格式化两个请求共用同一份input_image
+        image_input = self._image_input(image_path, image_bytes, reuse=True)
 
         ocr_start = time.time()
-        text_content = self._perform_ocr(image_path)
+        text_content = self._perform_ocr(image_path, image_bytes, image_input)
         ocr_time = time.time() - ocr_start
 
         format_start = time.time()
-        result = self._format_to_markdown(text_content, image_path)
+        result = self._format_to_markdown(text_content, image_bytes, image_input)
         format_time = time.time() - format_start
 
         total_time = time.time() - start_time
         logger.info(f"OCR步骤耗时: {ocr_time:.2f}秒，格式化步骤耗时: {format_time:.2f}秒，总耗时: {total_time:.2f}秒")
 
         return result
+
+    def imgs2md(self, image_paths) -> list[str]:
+        """
+        将多张图像转换为markdown，OCR步骤合并为一次请求以减少往返次数
+
+        批量OCR的结果无法按页解析时，会退回到逐页调用img2md
+
+        Args:
+            image_paths (list): 图像路径列表
+
+        Returns:
+            list[str]: 与image_paths顺序一致的markdown文本
+        """
+        if len(image_paths) == 1:
+            return [self.img2md(image_paths[0])]
+
+        start_time = time.time()
+
+        # 批量OCR和每页的格式化请求共用同一份input_image
+        images_bytes = [self._read_image(image_path) for image_path in image_paths]
+        image_inputs = [self._image_input(image_path, image_bytes, reuse=True) for image_path, image_bytes in zip(image_paths, images_bytes)]
+
+        ocr_start = time.time()
+        try:
+            text_contents = self._perform_ocr_batch(image_inputs)
+        except Exception as e:
+            logger.warning(f"批量OCR失败，改为逐页处理: {e}")
+            return [self.img2md(image_path) for image_path in image_paths]
+        ocr_time = time.time() - ocr_start
+
+        format_start = time.time()
+        results = [
+            self._format_to_markdown(text_content, image_bytes, image_input)
+            for text_content, image_bytes, image_input in zip(text_contents, images_bytes, image_inputs)
+        ]
+        format_time = time.time() - format_start
+
+        total_time = time.time() - start_time
+        logger.info(f"批量OCR步骤耗时: {ocr_time:.2f}秒，格式化步骤耗时: {format_time:.2f}秒，总耗时: {total_time:.2f}秒（{len(image_paths)}页）")
+
+        return results
+
+    def imgs2md_by_batch_api(self, image_paths) -> list:
+        """
+        通过OpenAI Batch API将多张图像转换为markdown
+
+        启用single_pass时只提交一次批量任务（与同步处理的单次OCR及格式化相同），否则OCR和格式化各提交一次批量任务；
+        费用为同步请求的一半，但需要等待批量任务完成（最长24小时），只适合非实时的处理
+
+        Args:
+            image_paths (list): 图像路径列表
+
+        Returns:
+            list: 与image_paths顺序一致的markdown文本，处理失败的页为None
+        """
+        start_time = time.time()
+        batch_tool = BatchTool()
+
+        # 两步处理时OCR和格式化两次批量任务共用同一份input_image
+        image_inputs = [self._image_input(image_path, self._read_image(image_path), reuse=not self.single_pass) for image_path in image_paths]
+
+        if self.single_pass:
+            ocr_requests = [{
+                "custom_id": f"ocr_format:{i}",
+                "body": {
+                    "model": self.model_name,
+                    "instructions": OCR_FORMAT_INSTRUCTIONS,
+                    "input": self._ocr_format_input_items(image_input)
+                }
+            } for i, image_input in enumerate(image_inputs)]
+            ocr_results = batch_tool.batch_submit(ocr_requests)
+
+            results = []
+            for i in range(len(image_paths)):
+                result = BatchTool.output_text(ocr_results.get(f"ocr_format:{i}"))
+                results.append(self._strip_code_fence(result) if result and result.strip() else None)
+
+            total_time = time.time() - start_time
+            logger.info(f"Batch API单次处理 {len(image_paths)} 页，成功 {sum(1 for result in results if result)} 页，总耗时: {total_time:.2f}秒")
+
+            return results
+
+        ocr_requests = [{
+            "custom_id": f"ocr:{i}",
+            "body": {
+                "model": self.model_name,
+                "instructions": OCR_INSTRUCTIONS,
+                "input": self._ocr_input_items(image_input)
+            }
+        } for i, image_input in enumerate(image_inputs)]
+        ocr_results = batch_tool.batch_submit(ocr_requests)
+        text_contents = [BatchTool.output_text(ocr_results.get(f"ocr:{i}")) for i in range(len(image_paths))]
+
+        format_requests = [{
+            "custom_id": f"format:{i}",
+            "body": {
+                "model": self.model_name,
+                "instructions": FORMAT_INSTRUCTIONS,
+                "input": self._format_input_items(text_content, image_input)
+            }
+        } for i, (text_content, image_input) in enumerate(zip(text_contents, image_inputs)) if text_content and text_content.strip()]
+        format_results = batch_tool.batch_submit(format_requests) if format_requests else {}
+
+        results = []
+        for i in range(len(image_paths)):
+            result = BatchTool.output_text(format_results.get(f"format:{i}"))
+            results.append(self._strip_code_fence(result) if result else None)
+
+        total_time = time.time() - start_time
+        logger.info(f"Batch API处理 {len(image_paths)} 页，成功 {sum(1 for result in results if result)} 页，总耗时: {total_time:.2f}秒")
+
+        return results
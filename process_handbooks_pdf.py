@@ -6,6 +6,8 @@ import os
 import sys
 from pathlib import Path
 import shutil
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 
 from dotenv import load_dotenv
 from buffalo import Buffalo, Work, Project
@@ -55,11 +57,55 @@ class Config:
         except Exception:
             self.ocr_dpi = 150
 
+        try:
+            # pylint: disable=invalid-envvar-default
+            self.pdf2img_thread_count = max(1, int(os.getenv("PDF2IMG_THREAD_COUNT", (os.cpu_count() or 2) - 1)))
+        except Exception:
+            self.pdf2img_thread_count = max(1, (os.cpu_count() or 2) - 1)
+
         try:
             self.ocr_model_name = os.getenv("OCR_MODEL_NAME", "gpt-4o-mini")
         except Exception:
             self.ocr_model_name = "gpt-4o-mini"
 
+        try:
+            # pylint: disable=invalid-envvar-default
+            self.ocr_concurrency = max(1, int(os.getenv("OCR_CONCURRENCY", 8)))
+        except Exception:
+            self.ocr_concurrency = 8
+
+        try:
+            # pylint: disable=invalid-envvar-default
+            self.ocr_batch_size = max(1, int(os.getenv("OCR_BATCH_SIZE", 1)))
+        except Exception:
+            self.ocr_batch_size = 1
+
+        try:
+            # pylint: disable=invalid-envvar-default
+            self.factory_concurrency = max(1, int(os.getenv("FACTORY_CONCURRENCY", 2)))
+        except Exception:
+            self.factory_concurrency = 2
+
+        try:
+            self.ocr_single_pass = os.getenv("OCR_SINGLE_PASS", "true").lower() == "true"
+        except Exception:
+            self.ocr_single_pass = True
+
+        if self.ocr_single_pass and self.ocr_batch_size > 1:
+            # 多页合并时OCR和格式化只能分两步处理（1次批量OCR + 每页1次格式化），单次处理不会生效
+            logger.warning(f"OCR_BATCH_SIZE={self.ocr_batch_size} 时OCR_SINGLE_PASS不生效，每页会多一次格式化请求；需要单次处理时请将OCR_BATCH_SIZE设为1")
+
+        try:
+            self.ocr_use_batch_api = os.getenv("OCR_USE_BATCH_API", "false").lower() == "true"
+        except Exception:
+            self.ocr_use_batch_api = False
+
+        try:
+            # 同一图像需要发送多次时通过Files API上传并以file_id引用（使用不支持Files API的兼容服务时保持关闭）
+            self.image_upload = os.getenv("OPENAI_IMAGE_UPLOAD", "false").lower() == "true"
+        except Exception:
+            self.image_upload = False
+
         try:
             translate_terms_file = os.getenv("TRANSLATE_TERMS_FILE", "")
             if not translate_terms_file:
@@ -76,6 +122,18 @@ class Config:
         except Exception:
             self.translate_model_name = "gpt-4o-mini"
 
+        try:
+            # pylint: disable=invalid-envvar-default
+            self.translate_chunk_size = max(1000, int(os.getenv("TRANSLATE_CHUNK_SIZE", 8000)))
+        except Exception:
+            self.translate_chunk_size = 8000
+
+        try:
+            # pylint: disable=invalid-envvar-default
+            self.translate_concurrency = max(1, int(os.getenv("TRANSLATE_CONCURRENCY", 4)))
+        except Exception:
+            self.translate_concurrency = 4
+
         try:
             self.analysis_model_name = os.getenv("OPENAI_ANALYSIS_MODEL", "gpt-4o-mini")
         except Exception:
@@ -126,10 +184,17 @@ def pdf2img(project: Project, work: Work, config: Config):
                 # retry is not necessary, not change status
                 return
 
-            images = convert_from_path(pdf_path, dpi=config.ocr_dpi)
+            # pdftoppm按页区间分多个进程并行栅格化，并直接输出PNG文件到临时目录，无需在Python中重新编码，之后只需改名
+            with tempfile.TemporaryDirectory(dir=project.project_path) as output_folder:
+                images = convert_from_path(pdf_path,
+                                           dpi=config.ocr_dpi,
+                                           thread_count=config.pdf2img_thread_count,
+                                           output_folder=output_folder,
+                                           fmt='png',
+                                           paths_only=True)
 
-            for i, image in enumerate(images):
-                image.save(project.project_path / f'scan_{i}.png', 'PNG')
+                for i, image in enumerate(images):
+                    os.replace(image, project.project_path / f'scan_{i}.png')
 
             work.set_status(Work.DONE)
             project.save_project()
@@ -147,67 +212,109 @@ def pdf2img(project: Project, work: Work, config: Config):
                 return
 
 
+def list_scan_images(folder: Path) -> list[Path]:
+    """列出folder中的scan_{序号}.png，按页序号（整数）排序，避免scan_10排在scan_2之前"""
+    with os.scandir(folder) as it:
+        names = [entry.name for entry in it if entry.name.startswith('scan_') and entry.name.endswith('.png')]
+    names.sort(key=lambda name: int(name[len('scan_'):-len('.png')]))
+    return [folder / name for name in names]
+
+
+def load_page_md(img_path: Path):
+    """读取图片对应的已存在的md文件，文件不存在、为空或读取失败时返回None"""
+    current_page_md_path = img_path.with_suffix('.md')
+    if not current_page_md_path.exists():
+        return None
+
+    logger.info(f'{img_path.name} 对应的md文件 {current_page_md_path.name} 已存在，跳过')
+    try:
+        with open(current_page_md_path, 'r', encoding='utf-8') as f:
+            current_page_content = f.read()
+        if current_page_content is None or len(current_page_content) == 0:
+            raise ValueError(f"{img_path.name} 对应的md文件 {current_page_md_path.name} 虽然存在但内容为空")
+        return current_page_content
+    except Exception as e:
+        logger.info(f'{img_path.name} 对应的md文件 {current_page_md_path.name} 虽然存在但读取失败: {str(e)}，从这里开始OCR')
+        return None
+
+
+def ocr_pages(project: Project, ocr_tool: OCRTool, img_paths: list[Path], config: Config) -> list[str]:
+    """对一组图片执行OCR，返回与img_paths顺序一致的markdown内容
+
+    每一页的结果都会保存到对应的md文件中，以便中断后可以从这里继续
+    """
+    page_names = ', '.join(img_path.name for img_path in img_paths)
+    logger.info(f'开始使用 {config.ocr_model_name} 处理图片: {page_names}')
+
+    # 将图片转换为markdown，比较容易因为波动等原因发生失败，提供1次重试的机会
+    retry_limit = 1
+    while True:
+        try:
+            page_contents = ocr_tool.imgs2md(img_paths)
+
+            for img_path, current_page_content in zip(img_paths, page_contents):
+                if current_page_content is None or len(current_page_content) == 0:
+                    raise ValueError(f"{img_path.name} OCR识别结束，但结果为空")
+
+                # 将当前结果保存到md文件中，如果文件已存在就直接覆盖
+                with open(img_path.with_suffix('.md'), 'w', encoding='utf-8') as f:
+                    f.write(current_page_content)
+
+            return page_contents
+        except Exception as e:
+            logger.error(f'{project.folder_name} - {page_names} 处理失败: {str(e)}，重试中...')
+            if retry_limit > 0:
+                retry_limit -= 1
+                # 重试间隔10秒
+                time.sleep(10)
+                continue
+            else:
+                raise Exception(f'{project.folder_name} - {page_names} 处理失败，超过重试次数限制，放弃') from e
+
+
 def ocr(project: Project, work: Work, config: Config):
     logger.info(f'{project.folder_name} - {work.name} 开始处理')
     work.set_status(Work.IN_PROGRESS)
     project.save_project()
 
+    ocr_tool = None
     try:
-        image_files = sorted(project.project_path.glob('scan_*.png'))
+        image_files = list_scan_images(project.project_path)
         logger.debug(f'{project.folder_name} - 找到 {len(image_files)} 张图片')
         if not image_files:
             raise FileNotFoundError(f'{project.folder_name} - 未找到扫描图片')
 
-        # 先提取当前文件夹中所有的md文件
-        md_files = sorted(project.project_path.glob('*.md'))
-        logger.debug(f'{project.folder_name} - 找到 {len(md_files)} 个md文件')
+        ocr_tool = OCRTool(config.ocr_model_name, config.ocr_single_pass, config.image_upload)
 
-        ocr_tool = OCRTool(config.ocr_model_name)
+        # 如果当前图片的md文件已存在，则跳过，只对剩余的页面执行OCR
+        page_contents = [load_page_md(img_path) for img_path in image_files]
+        pending_pages = [i for i, content in enumerate(page_contents) if content is None]
 
-        md_content = ""
-        for img_path in image_files:
-            # 如果当前图片的md文件已存在，则跳过
-            if f'{img_path.stem}.md' in [md_file.name for md_file in md_files]:
-                logger.info(f'{img_path.name} 对应的md文件 {img_path.stem}.md 已存在，跳过')
-                try:
-                    with open(project.project_path / f'{img_path.stem}.md', 'r', encoding='utf-8') as f:
-                        current_page_content = f.read()
-                        if current_page_content is None or len(current_page_content) == 0:
-                            raise ValueError(f"{img_path.name} 对应的md文件 {img_path.stem}.md 虽然存在但内容为空")
-
-                        md_content += current_page_content + '\n\n'
+        # 启用Batch API时，先将剩余页面整体提交为批量任务（费用减半但非实时），失败的页面再走下面的同步处理
+        if config.ocr_use_batch_api and pending_pages:
+            try:
+                batch_results = ocr_tool.imgs2md_by_batch_api([image_files[i] for i in pending_pages])
+            except Exception as e:
+                logger.error(f'{project.folder_name} - Batch API处理失败: {str(e)}，全部改为同步处理')
+                batch_results = []
+            for i, current_page_content in zip(pending_pages, batch_results):
+                if current_page_content is None:
                     continue
-                except Exception as e:
-                    logger.info(f'{img_path.name} 对应的md文件 {img_path.stem}.md 虽然存在但读取失败: {str(e)}，从这里开始OCR')
-
-            logger.info(f'开始使用 {config.ocr_model_name} 处理图片: {img_path.name}')
-
-            # 将图片转换为markdown，比较容易因为波动等原因发生失败，提供1次重试的机会
-            retry_limit = 1
-            while True:
-                try:
-                    current_page_content = ocr_tool.img2md(img_path)
-
-                    if current_page_content is None or len(current_page_content) == 0:
-                        raise ValueError("OCR识别结束，但结果为空")
-
-                    # 将当前结果保存到md文件中，如果文件已存在就直接覆盖
-                    current_page_md_path = project.project_path / f'{img_path.stem}.md'
-                    with open(current_page_md_path, 'w', encoding='utf-8') as f:
-                        f.write(current_page_content)
-
-                    md_content += current_page_content + '\n\n'
-
-                    break
-                except Exception as e:
-                    logger.error(f'{project.folder_name} - {work.name} 处理失败: {str(e)}，重试中...')
-                    if retry_limit > 0:
-                        retry_limit -= 1
-                        # 重试间隔10秒
-                        time.sleep(10)
-                        continue
-                    else:
-                        raise Exception(f'{project.folder_name} - {work.name} 处理失败，超过重试次数限制，放弃') from e
+                with open(image_files[i].with_suffix('.md'), 'w', encoding='utf-8') as f:
+                    f.write(current_page_content)
+                page_contents[i] = current_page_content
+            pending_pages = [i for i in pending_pages if page_contents[i] is None]
+            logger.info(f'{project.folder_name} - Batch API处理完成，剩余 {len(pending_pages)} 页改为同步处理')
+
+        # 剩余的页面按OCR_BATCH_SIZE分组，每组合并为一次OCR请求；各组都是独立的网络请求，使用线程池并发处理
+        batches = [pending_pages[i:i + config.ocr_batch_size] for i in range(0, len(pending_pages), config.ocr_batch_size)]
+        with ThreadPoolExecutor(max_workers=config.ocr_concurrency) as executor:
+            futures = {executor.submit(ocr_pages, project, ocr_tool, [image_files[i] for i in batch], config): batch for batch in batches}
+            for future in as_completed(futures):
+                for i, current_page_content in zip(futures[future], future.result()):
+                    page_contents[i] = current_page_content
+
+        md_content = ''.join(current_page_content + '\n\n' for current_page_content in page_contents)
 
         # 保存OCR结果
         if md_content:
@@ -225,6 +332,11 @@ def ocr(project: Project, work: Work, config: Config):
         # 需要人类介入，排除问题后修改该work的状态到not_started后，重新启动即可从失败的地方开始继续
         return
 
+    finally:
+        # 本项目上传的图像已不再需要
+        if ocr_tool is not None:
+            ocr_tool.delete_uploaded_files()
+
 
 def translate(project: Project, work: Work, config: Config):
     logger.info(f'{project.folder_name} - {work.name} 开始处理')
@@ -243,7 +355,7 @@ def translate(project: Project, work: Work, config: Config):
         if not md_content.strip():
             raise ValueError(f'{project.folder_name} - markdown文件内容为空')
 
-        translate_tool = TranslateTool(config.translate_model_name, config.translate_terms)
+        translate_tool = TranslateTool(config.translate_model_name, config.translate_terms, config.translate_chunk_size, config.translate_concurrency)
         logger.info(f'开始使用 {config.translate_model_name} 执行翻译')
 
         # 翻译md内容，比较容易因为波动等原因发生失败，提供1次重试的机会
@@ -330,6 +442,17 @@ def analysis(project: Project, work: Work, config: Config):
         return
 
 
+def link_or_copy(src: Path, dst: Path):
+    """优先创建硬链接（同一文件系统下无需重新读写文件内容），失败时退回到复制
+
+    注意：硬链接时输出文件与buffalo项目中的文件是同一份数据，原地编辑其中一个会同时改变另一个
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
 def output(project: Project, work: Work, config: Config):
     logger.info(f'{project.folder_name} - {work.name} 开始处理')
     work.set_status(Work.IN_PROGRESS)
@@ -379,10 +502,11 @@ def output(project: Project, work: Work, config: Config):
         target_folder = config.output_folder / target_folder_name
         target_folder.mkdir(exist_ok=True)
 
-        # 复制所有文件到新位置
-        for file in project.project_path.glob('*'):
-            if file.is_file():
-                shutil.copy2(file, target_folder / file.name)
+        # 复制所有文件到新位置，文件较多（每页的图片和md），交给IO线程池并行处理，全部完成后再重命名
+        with ThreadPoolExecutor(max_workers=4) as io_executor:
+            futures = [io_executor.submit(link_or_copy, file, target_folder / file.name) for file in project.project_path.glob('*') if file.is_file()]
+            for future in futures:
+                future.result()
 
         # 重命名PDF文件
         handbook_pdf_path = target_folder / 'handbook.pdf'
@@ -420,6 +544,32 @@ workers = {
 }
 
 
+# pdf2img是本地CPU密集的任务，其余任务都在等待LLM的网络响应，两类任务分别在各自的线程池中执行，
+# 使下一个PDF的栅格化与前一个PDF的OCR等任务重叠进行
+PDF2IMG_JOB_NAMES = ["01_pdf2img"]
+# 越靠后的任务越优先，尽快完成已开始的项目
+LLM_JOB_NAMES = ["05_output", "04_analysis", "03_translate", "02_ocr"]
+
+
+def get_next_job(buffalo: Buffalo, job_names: list[str]):
+    """按job_names的顺序查找第一个可以开始的任务，没有时返回(None, None)"""
+    for job_name in job_names:
+        project, work = buffalo.get_a_job(job_name)
+        if project is not None and work is not None:
+            return project, work
+    return None, None
+
+
+def run_worker(project: Project, work: Work, config: Config) -> str:
+    """执行任务并返回执行后的状态"""
+    worker = workers[work.name]
+    try:
+        worker(project, work, config)
+    except Exception as e:
+        logger.error(f'{project.folder_name} - {work.name} 处理失败，错误信息: {e}')
+    return work.status
+
+
 def factory_start():
     config = Config()
 
@@ -427,32 +577,55 @@ def factory_start():
     success_count = 0
     failed_count = 0
 
-    while True:
-        buffalo = Buffalo(base_dir=config.base_dir, template_path=config.buffalo_template_file)
-        project: Project
-        work: Work
-        project, work = buffalo.get_a_job()
-        if project is None or work is None:
-            # 没有任务了，退出
-            break
-
-        job_count += 1
-        worker = workers[work.name]
-        try:
-            worker(project, work, config)
-            if work.status == Work.NOT_STARTED:
-                logger.info(f'{project.folder_name} - {work.name} 未能正确处理，将会自动重试...')
-            if work.status == Work.IN_PROGRESS:
-                logger.info(f'{project.folder_name} - {work.name} 未能正确处理，需要人工介入')
-                failed_count += 1
-            if work.status == Work.DONE:
-                logger.info(f'{project.folder_name} - {work.name} 处理完成')
-                success_count += 1
-        except Exception as e:
-            logger.error(f'{project.folder_name} - {work.name} 处理失败，错误信息: {e}')
-            continue
-        finally:
+    pools = [
+        (ThreadPoolExecutor(max_workers=1), 1, PDF2IMG_JOB_NAMES),
+        (ThreadPoolExecutor(max_workers=config.factory_concurrency), config.factory_concurrency, LLM_JOB_NAMES),
+    ]
+    running = {}  # future -> (project, work, pool_index)
+
+    # 只在调度线程中加载一次buffalo状态：工作线程修改的正是这里取出的project、work对象，状态变化直接可见，
+    # 不再每轮重新读取YAML，也就不会读到工作线程正在写入的项目文件
+    buffalo = Buffalo(base_dir=config.base_dir, template_path=config.buffalo_template_file)
+    project: Project
+    work: Work
+
+    try:
+        while True:
+
+            for pool_index, (executor, pool_size, job_names) in enumerate(pools):
+                while sum(1 for _, _, i in running.values() if i == pool_index) < pool_size:
+                    project, work = get_next_job(buffalo, job_names)
+                    if project is None or work is None:
+                        break
+
+                    # 提交前先标记为进行中，避免下一轮再次分配同一任务；同时保存，中断后重启时也能看到该状态
+                    work.set_status(Work.IN_PROGRESS)
+                    project.save_project()
+
+                    job_count += 1
+                    running[executor.submit(run_worker, project, work, config)] = (project, work, pool_index)
+
+            if not running:
+                # 没有任务了，退出
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                project, work, _ = running.pop(future)
+                status = future.result()
+                if status == Work.NOT_STARTED:
+                    logger.info(f'{project.folder_name} - {work.name} 未能正确处理，将会自动重试...')
+                if status == Work.IN_PROGRESS:
+                    logger.info(f'{project.folder_name} - {work.name} 未能正确处理，需要人工介入')
+                    failed_count += 1
+                if status == Work.DONE:
+                    logger.info(f'{project.folder_name} - {work.name} 处理完成')
+                    success_count += 1
+
             time.sleep(1)
+    finally:
+        for executor, _, _ in pools:
+            executor.shutdown(wait=True)
 
     logger.info('当前base dir中的buffalo项目所属的所有任务都已执行完毕')
     logger.info(f'总共执行了 {job_count} 个任务，成功了 {success_count} 个，失败了 {failed_count} 个')
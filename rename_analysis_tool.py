@@ -3,11 +3,15 @@ import time
 import json
 import re
 
-from agents import Agent, Runner
+from agents import Agent
+from llm_runner import run_sync
 from logging_config import setup_logger
 
 logger = setup_logger(logger_name="RenameAnalysisTool", log_level="INFO")
 
+# 模型返回的内容不是纯JSON时，用于从中提取JSON部分
+JSON_PATTERN = re.compile(r'\{.*\}', re.DOTALL)
+
 
 class RenameAnalysisTool:
     """重命名分析工具类，用于分析招生信息并生成文件夹名"""
@@ -22,11 +26,7 @@ class RenameAnalysisTool:
 
         self.model_name = model_name
 
-    def _analyze_markdown(self, md_content: str) -> str:
-        """使用OpenAI分析招生信息"""
-        logger.info("分析招生信息...")
-
-        analyze_agent = Agent(
+        self.analyze_agent = Agent(
             name="Admission Analyzer",
             instructions="""你是一位专业的大学招生信息分析专家，擅长分析大学招生信息。
 请根据输入的Markdown文本进行分析并提取以下信息，以JSON格式返回。
@@ -47,13 +47,33 @@ class RenameAnalysisTool:
             model=self.model_name
         )
 
+    def _analyze_markdown(self, md_content: str) -> dict:
+        """使用OpenAI分析招生信息，返回解析后的JSON"""
+        logger.info("分析招生信息...")
+
         input_items = [{
             "role": "user",
             "content": md_content + "\n\n请确保返回的是合法的JSON格式，不要包含任何其他说明文字。"
         }]
 
-        result = Runner.run_sync(analyze_agent, input_items)
-        return result.final_output
+        result = run_sync(self.analyze_agent, input_items)
+        return self._parse_json(result.final_output)
+
+    @staticmethod
+    def _parse_json(text: str) -> dict:
+        """解析模型返回的JSON，不是纯JSON时尝试从中提取JSON部分"""
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            json_match = JSON_PATTERN.search(text)
+            if not json_match:
+                logger.error(f"响应中没有有效的JSON: {text}")
+                raise ValueError("响应中没有有效的JSON") from e
+            try:
+                return json.loads(json_match.group())
+            except json.JSONDecodeError as exc:
+                logger.error(f"无法提取有效的JSON: {text}")
+                raise ValueError("无法提取有效的JSON") from exc
 
     def md2report(self, md_content: str) -> tuple[str, str]:
         """
@@ -70,26 +90,9 @@ class RenameAnalysisTool:
         start_time = time.time()
 
         analyze_start = time.time()
-        result = self._analyze_markdown(md_content)
+        info_dict = self._analyze_markdown(md_content)
         analyze_time = time.time() - analyze_start
 
-        # 验证返回的是否为有效的JSON
-        try:
-            info_dict = json.loads(result)
-        except json.JSONDecodeError as e:
-            # 如果不是有效的JSON，尝试提取JSON部分
-            json_match = re.search(r'\{.*\}', result, re.DOTALL)
-            if json_match:
-                json_str = json_match.group()
-                try:
-                    info_dict = json.loads(json_str)
-                except json.JSONDecodeError as exc:
-                    logger.error(f"无法提取有效的JSON: {result}")
-                    raise ValueError("无法提取有效的JSON") from exc
-            else:
-                logger.error(f"响应中没有有效的JSON: {result}")
-                raise ValueError("响应中没有有效的JSON") from e
-
         # 验证必要的字段是否存在
         if "大学名称" not in info_dict or "报名截止日期" not in info_dict:
             raise ValueError("JSON中缺少必要的字段：大学名称或报名截止日期")
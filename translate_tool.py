@@ -1,31 +1,42 @@
 import os
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from agents import Agent, Runner
+from agents import Agent
+from llm_cache import llm_cache
+from llm_runner import run_streamed
 from logging_config import setup_logger
 
 logger = setup_logger(logger_name="TranslateTool", log_level="INFO")
 
+# 格式化时页码统一为独立一行的【数字 ページ】，以此作为分段翻译的边界
+PAGE_MARKER_PATTERN = re.compile(r'^【\s*\d+\s*ページ\s*】[ \t]*$', re.MULTILINE)
+
 
 class TranslateTool:
     """翻译工具类，用于处理日语到中文的翻译"""
 
-    def __init__(self, model_name: str = "gpt-4o", translate_terms: str = ""):
+    def __init__(self, model_name: str = "gpt-4o", translate_terms: str = "", chunk_size: int = 8000, concurrency: int = 4):
         """初始化翻译工具类
         
         翻译工具需要在环境变量中设置OPENAI_API_KEY请确认.env文件中已经设置
+
+        Args:
+            model_name (str): 翻译使用的模型
+            translate_terms (str): 翻译术语表
+            chunk_size (int): 分段翻译时每段的最大字符数
+            concurrency (int): 分段翻译的并发数
         """
         if not os.getenv("OPENAI_API_KEY"):
             raise ValueError("OPENAI_API_KEY 环境变量未设置")
 
         self.model_name = model_name
         self.translate_terms = translate_terms
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
 
-    def _translate_markdown(self, md_content: str) -> str:
-        """使用OpenAI翻译日语Markdown内容为中文"""
-        logger.info("翻译Markdown内容为中文...")
-
-        translator_agent = Agent(
+        self.translator_agent = Agent(
             name="Translator",
             instructions=f"""你是一位专业的日语翻译专家，擅长将日语文本翻译成中文。
 请将用户输入的日语Markdown文本翻译成中文，要求：
@@ -45,6 +56,10 @@ class TranslateTool:
             model=self.model_name
         )
 
+    def _translate_markdown(self, md_content: str) -> str:
+        """使用OpenAI翻译日语Markdown内容为中文"""
+        logger.info("翻译Markdown内容为中文...")
+
         input_items = [{
             "role": "user",
             "content": f"""请将以下日语Markdown文本翻译成中文：
@@ -56,8 +71,49 @@ class TranslateTool:
 请直接返回翻译结果。务必尊从系统提示词中的要求来进行翻译。"""
         }]
 
-        result = Runner.run_sync(translator_agent, input_items)
-        return result.final_output
+        cache_key = llm_cache.key(self.model_name, self.translator_agent.instructions, md_content)
+        cached_output = llm_cache.get(cache_key)
+        if cached_output is not None:
+            return cached_output
+
+        final_output = run_streamed(self.translator_agent, input_items)
+        llm_cache.put(cache_key, final_output)
+        return final_output
+
+    @staticmethod
+    def _split_markdown(md_content: str, chunk_size: int) -> list[str]:
+        """将Markdown按页码行切分，再合并为不超过chunk_size个字符的段落
+
+        没有页码行或单页过长时，退回到按空行切分
+        """
+        pieces = []
+        start = 0
+        for match in PAGE_MARKER_PATTERN.finditer(md_content):
+            pieces.append(md_content[start:match.end()])
+            start = match.end()
+        pieces.append(md_content[start:])
+
+        blocks = []
+        for piece in pieces:
+            if len(piece) <= chunk_size:
+                blocks.append(piece)
+            else:
+                blocks.extend(paragraph + '\n\n' for paragraph in piece.split('\n\n'))
+
+        # 累积当前段落的块和长度，避免反复拼接和测量整段字符串
+        chunks = []
+        current = []
+        current_len = 0
+        for block in blocks:
+            if current and current_len + len(block) > chunk_size:
+                chunks.append(''.join(current))
+                current = []
+                current_len = 0
+            current.append(block)
+            current_len += len(block)
+        chunks.append(''.join(current))
+
+        return [chunk.strip() for chunk in chunks if chunk.strip()]
 
     def md2zh(self, md_content: str) -> str:
         """
@@ -74,7 +130,14 @@ class TranslateTool:
         start_time = time.time()
 
         translate_start = time.time()
-        result = self._translate_markdown(md_content)
+        # 长文档按页分段并发翻译，避免单次请求的输出过长被截断
+        chunks = self._split_markdown(md_content, self.chunk_size)
+        if len(chunks) <= 1:
+            result = self._translate_markdown(md_content)
+        else:
+            logger.info(f"文档较长，分为 {len(chunks)} 段并发翻译")
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                result = '\n\n'.join(executor.map(self._translate_markdown, chunks))
         translate_time = time.time() - translate_start
 
         total_time = time.time() - start_time
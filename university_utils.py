@@ -5,16 +5,34 @@
 import os
 import re
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
+
+# 招生简章目录名的格式为「大学名_yyyy-mm-dd」或「大学名_yyyymmdd」
+UNIVERSITY_DIR_PATTERN = re.compile(r"(?P<name>.+)_(?P<date>\d{4}-?\d{2}-?\d{2})")
+
+
+def normalize_date(date_str: str) -> str:
+    """统一日期格式为yyyy-mm-dd"""
+    if "-" not in date_str:
+        return f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}"
+    return date_str
 
 
 class UniversityUtils:
 
     def __init__(self):
-        self.pdf_dirs = [d for d in os.listdir(".") if d.startswith("pdf_with_md")]
         self.university_list = None
+        self._name_list_str = ""
         _ = self.get_university_list()
 
+    @staticmethod
+    def _iter_pdf_dirs() -> Iterator[str]:
+        """逐个返回当前目录下的pdf_with_md*目录，先按名称过滤，不符合的目录项无需判断类型"""
+        with os.scandir(".") as it:
+            for entry in it:
+                if entry.name.startswith("pdf_with_md") and entry.is_dir():
+                    yield entry.name
+
     def get_university_list(self) -> dict:
         """获取所有大学列表
         
@@ -25,59 +43,48 @@ class UniversityUtils:
             return self.university_list
 
         self.university_list = {}
+        # 大学日文名到已收录目录的日期（yyyy-mm-dd）的映射，遇到同名大学时无需重新解析已收录的目录名
+        latest_dates = {}
 
         # 遍历所有pdf目录
-        for pdf_dir in self.pdf_dirs:
-            # 获取一级子目录
-            for subdir in os.listdir(pdf_dir):
-                subdir_path = Path(pdf_dir) / subdir
-                if not subdir_path.is_dir():
-                    continue
+        for pdf_dir in self._iter_pdf_dirs():
+            # 获取一级子目录，is_dir()直接使用目录项中的类型信息
+            with os.scandir(pdf_dir) as it:
+                subdir_entries = [entry for entry in it if entry.is_dir()]
 
-                # 检查必需文件是否存在
-                required_files = [f"{subdir}.md", f"{subdir}_中文.md", f"{subdir}_report.md"]
-                is_valid = all((subdir_path / f).exists() for f in required_files)
-                if not is_valid:
-                    continue
+            for subdir_entry in subdir_entries:
+                subdir = subdir_entry.name
 
-                # 解析目录名获取大学名和日期
-                match = re.match(r"(.+)_(\d{4}[-]?\d{2}[-]?\d{2}|\d{8})", subdir)
+                # 解析目录名获取大学名和日期，目录名不合格时无需再列出其中的文件
+                match = UNIVERSITY_DIR_PATTERN.match(subdir)
                 if not match:
                     continue
 
-                univ_name = match.group(1)
-                date_str = match.group(2)
-
-                # 统一日期格式为yyyy-mm-dd
-                if "-" not in date_str:
-                    date_str = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}"
-
-                # 如果大学不在字典中，直接添加
-                if univ_name not in self.university_list:
-                    self.university_list[univ_name] = subdir_path
+                # 一次列出目录中的文件，检查必需文件是否存在
+                with os.scandir(subdir_entry.path) as it:
+                    file_names = {entry.name for entry in it}
+                required_files = [f"{subdir}.md", f"{subdir}_中文.md", f"{subdir}_report.md"]
+                if not all(f in file_names for f in required_files):
                     continue
 
-                # 如果大学已在字典中，比较日期
-                existing_path = self.university_list[univ_name]
-                existing_match = re.match(r".+_(\d{4}[-]?\d{2}[-]?\d{2}|\d{8})", existing_path.name)
-                if not existing_match:
-                    # 如果已存在的目录名不合法，直接用新的替代
-                    self.university_list[univ_name] = subdir_path
-                    continue
+                subdir_path = Path(pdf_dir) / subdir
 
-                existing_date = existing_match.group(1)
-                if "-" not in existing_date:
-                    existing_date = f"{existing_date[:4]}-{existing_date[4:6]}-{existing_date[6:]}"
+                univ_name = match.group("name")
+                date_str = normalize_date(match.group("date"))
 
-                # 比较日期，保留较新的
-                if date_str > existing_date:
+                # 大学不在字典中时直接添加，已在字典中时保留日期较新的
+                if univ_name not in latest_dates or date_str > latest_dates[univ_name]:
+                    latest_dates[univ_name] = date_str
                     self.university_list[univ_name] = subdir_path
 
+        # 大学列表在构建后不再变化，名称列表字符串只需拼接一次
+        self._name_list_str = "\n".join(self.university_list)
+
         return self.university_list
 
     def get_university_name_list_str(self) -> str:
         """获取所有大学日文名列表字符串（便于用于prompt）"""
-        return "\n".join([k for k in self.university_list])
+        return self._name_list_str
 
     def get_university_url(self, jp_name: str) -> Optional[str]:
         """获取大学对应的URL